@@ -0,0 +1,149 @@
+"""
+Daily Analytics Benchmark
+Measures the throughput of the daily report computation.
+
+This script:
+1. Generates synthetic patient-days of 1 Hz readings (random walk with
+   tachycardia and bradycardia episodes and gaps without data)
+2. Times each step on one core: parsing the archived ISO timestamps,
+   building the per-minute grids from readings (archive days) and from
+   minute rollup items (recent days), daily_analytics.analyze over batches
+   of grids, and building the report items
+3. Reports patient-days per second per step and end to end per source
+   (grid, analyze and report item of every day)
+
+Fetching from DynamoDB or S3 is not included: it is I/O bound and runs
+concurrently in the Lambda.
+
+Usage:
+    python benchmarks/daily_analytics.py
+    python benchmarks/daily_analytics.py --days 50 --batch 2000
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+from decimal import Decimal
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cloud',
+                   'infrastructure', 'modules', 'lambda', 'src')
+
+DAY = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def synthetic_day(rng: np.random.Generator) -> tuple:
+    """
+    Generate one patient-day of 1 Hz readings.
+
+    Returns:
+        Tuple of (epoch ms array, BPM array)
+    """
+    seconds = np.arange(86400)
+    bpm = 70 + 8 * np.sin(seconds / 86400 * 2 * np.pi) + np.cumsum(rng.normal(0, 0.05, 86400))
+    bpm += rng.normal(0, 2, 86400)
+    for _ in range(rng.integers(0, 4)):
+        start = rng.integers(0, 86400 - 1800)
+        bpm[start:start + rng.integers(120, 1800)] = rng.choice([35, 160]) + rng.normal(0, 3)
+    # The wearable is off for a few hours
+    worn = np.ones(86400, dtype=bool)
+    off = rng.integers(0, 86400 - 4 * 3600)
+    worn[off:off + rng.integers(3600, 4 * 3600)] = False
+
+    ts_ms = int(DAY.timestamp() * 1000) + seconds[worn] * 1000
+    return ts_ms, np.clip(np.round(bpm[worn]), 25, 220)
+
+
+def rollup_items(ts_ms: np.ndarray, bpm: np.ndarray) -> list:
+    """Build the minute rollup items bpm_processor would keep for a day."""
+    minute = (ts_ms - int(DAY.timestamp() * 1000)) // 60000
+    items = []
+    for m in np.unique(minute):
+        values = bpm[minute == m]
+        period = (DAY + timedelta(minutes=int(m))).strftime('%Y-%m-%dT%H:%M')
+        items.append({
+            'state_key': f"rollup#minute#{period}",
+            'count': Decimal(len(values)),
+            'sum': Decimal(int(values.sum())),
+            'sum_sq': Decimal(int((values * values).sum())),
+            'bpm_values': {Decimal(int(v)) for v in np.unique(values)}
+        })
+    return items
+
+
+def per_second(count: int, seconds: float) -> str:
+    return f"{count / seconds:>12,.0f}"
+
+
+def iso_timestamps(ts_ms: np.ndarray) -> list:
+    """Format epoch ms as the ISO timestamps the archive holds."""
+    return [f"{ts}Z" for ts in ts_ms.astype('datetime64[ms]').astype(str)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the daily analytics computation')
+    parser.add_argument('--days', type=int, default=20, help='Distinct synthetic patient-days')
+    parser.add_argument('--batch', type=int, default=500, help='Patient-days per analyze() call')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed analyze() calls')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    args = parser.parse_args()
+
+    sys.path.insert(0, SRC)
+    import daily_analytics
+    from downsampling import parse_timestamps
+
+    rng = np.random.default_rng(args.seed)
+    days = [synthetic_day(rng) for _ in range(args.days)]
+    readings = sum(len(bpm) for _, bpm in days)
+    items = [rollup_items(ts_ms, bpm) for ts_ms, bpm in days]
+    archived = [(iso_timestamps(ts_ms), bpm.tolist()) for ts_ms, bpm in days]
+
+    print(f"{args.days} synthetic patient-days, {readings / args.days:,.0f} readings each")
+    print(f"{'step':<36}{'patient-days/s':>14}")
+
+    # As load_archive_day: parse the timestamps, then build the grid
+    began = time.perf_counter()
+    parsed = [(parse_timestamps(timestamps), np.array(bpm, dtype=np.float64)) for timestamps, bpm in archived]
+    parse_seconds = (time.perf_counter() - began) / args.days
+    print(f"{'parse archived timestamps':<36}{per_second(1, parse_seconds):>14}")
+
+    began = time.perf_counter()
+    grids = [daily_analytics.DayGrid.from_readings(ts_ms, bpm, DAY) for ts_ms, bpm in parsed]
+    grid_seconds = (time.perf_counter() - began) / args.days
+    archive_seconds = parse_seconds + grid_seconds
+    print(f"{'grid from 1 Hz readings':<36}{per_second(1, grid_seconds):>14}")
+
+    began = time.perf_counter()
+    rollup_grids = [daily_analytics.DayGrid.from_rollups(day_items, DAY.date()) for day_items in items]
+    rollup_seconds = (time.perf_counter() - began) / args.days
+    print(f"{'grid from minute rollups':<36}{per_second(1, rollup_seconds):>14}")
+
+    batch = (grids * (args.batch // len(grids) + 1))[:args.batch]
+    daily_analytics.analyze(batch)
+    began = time.perf_counter()
+    for _ in range(args.repeat):
+        metrics = daily_analytics.analyze(batch)
+    analyze_seconds = (time.perf_counter() - began) / (args.batch * args.repeat)
+    print(f"{f'analyze (batches of {args.batch})':<36}{per_second(1, analyze_seconds):>14}")
+
+    began = time.perf_counter()
+    for index in range(len(batch)):
+        daily_analytics.build_report(metrics, index, 'bench-user', DAY.date(), 'archive')
+    report_seconds = (time.perf_counter() - began) / len(batch)
+    print(f"{'report items':<36}{per_second(1, report_seconds):>14}")
+
+    print()
+    for source, grid_seconds in (('archive (1 Hz readings)', archive_seconds), ('minute rollups', rollup_seconds)):
+        total = grid_seconds + analyze_seconds + report_seconds
+        print(f"{f'end to end, {source}':<36}{per_second(1, total):>14}")
+
+    # Both sources describe the same day
+    archive, rollups = daily_analytics.analyze(grids), daily_analytics.analyze(rollup_grids)
+    drift = np.nanmax(np.abs(archive['mean_bpm'] - rollups['mean_bpm']))
+    print(f"max mean BPM difference between sources: {drift:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Fleet Replay Benchmark
+Replays a synthetic fleet through both Lambda handlers on the local backend.
+
+This script:
+1. Generates 1 Hz heart rate readings for users x devices (random walk with
+   occasional tachycardia and bradycardia episodes) and sends them to
+   bpm_processor.lambda_handler in fog-sized batches
+2. Queries every user through api_handler.lambda_handler (current, history,
+   device history, statistics, devices)
+3. Reports per-invocation latency, items written, simulated read/write units
+   and S3/SNS requests, per measurement layout
+
+Nothing talks to AWS: aws_clients serves the in-memory or SQLite stand-ins
+of local_backend (AWS_BACKEND). Units follow the DynamoDB sizing rules, so
+they compare layouts and code changes, not absolute bills.
+
+Usage:
+    python benchmarks/fleet_replay.py
+    python benchmarks/fleet_replay.py --users 20 --devices 2 --minutes 30 --backend sqlite
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cloud',
+                   'infrastructure', 'modules', 'lambda', 'src')
+
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'DYNAMODB_TABLE_NAME': 'bench-measurements',
+    'USER_STATE_TABLE_NAME': 'bench-user-state',
+    'DEVICES_TABLE_NAME': 'bench-devices',
+    'S3_BUCKET_NAME': 'bench-archive',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:bench-alerts',
+    'LOG_LEVEL': 'ERROR'
+}
+
+LAYOUTS = ['item', 'bucket']
+QUERIES = [
+    ('GET /bpm/current', '/bpm/current', None),
+    ('GET /bpm/history', '/bpm/history', {'limit': '100'}),
+    ('GET /bpm/history device', '/bpm/history', {'limit': '100', 'device_id': '{device}'}),
+    ('GET /bpm/statistics', '/bpm/statistics', {'period': 'day'}),
+    ('GET /devices', '/devices', None)
+]
+
+
+def fleet_batches(users: int, devices: int, minutes: int, interval: int, seed: int):
+    """
+    Yield the batches a fog node per user would send, oldest first.
+
+    Args:
+        users: Number of users
+        devices: Devices per user
+        minutes: Length of the replay
+        interval: Seconds of readings per batch
+        seed: Random seed
+
+    Yields:
+        Lists of readings (one invocation each)
+    """
+    rng = random.Random(seed)
+    start = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(minutes=minutes)
+    levels = {(u, d): rng.uniform(60, 85) for u in range(users) for d in range(devices)}
+    episodes = {}
+
+    for offset in range(0, minutes * 60, interval):
+        for u in range(users):
+            batch = []
+            for d in range(devices):
+                key = (u, d)
+                if key not in episodes and rng.random() < 0.002:
+                    episodes[key] = (rng.choice([35, 160]), rng.randint(30, 180))
+                for second in range(offset, offset + interval):
+                    levels[key] += rng.gauss(0, 1.5) + (72 - levels[key]) * 0.05
+                    bpm = levels[key]
+                    if key in episodes:
+                        target, remaining = episodes[key]
+                        bpm = target + rng.gauss(0, 3)
+                        episodes[key] = (target, remaining - 1)
+                        if remaining <= 1:
+                            del episodes[key]
+                    batch.append({
+                        'user_id': f"bench-user-{u:04d}",
+                        'device_id': f"bench-device-{u:04d}-{d}",
+                        'timestamp': (start + timedelta(seconds=second)).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                        'bpm': max(25, min(220, round(bpm)))
+                    })
+            yield batch
+
+
+def api_event(path: str, user_id: str, query_params: dict = None) -> dict:
+    """Build an authenticated API Gateway GET event."""
+    return {
+        'httpMethod': 'GET',
+        'path': path,
+        'headers': {},
+        'queryStringParameters': query_params,
+        'requestContext': {'authorizer': {'claims': {'sub': user_id, 'cognito:groups': 'patients'}}}
+    }
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Return a percentile of the samples (nearest rank)."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def usage(metrics: dict) -> dict:
+    """Sum the request counters of local_backend.metrics()."""
+    tables = metrics['dynamodb'].values()
+    return {
+        'read_units': sum(t['read_units'] for t in tables),
+        'write_units': sum(t['write_units'] for t in tables),
+        'items_written': sum(t['items_written'] for t in tables),
+        's3_put': metrics['s3']['PUT'],
+        's3_get': metrics['s3']['GET'],
+        's3_list': metrics['s3']['LIST'],
+        'sns_publish': metrics['sns']['Publish']
+    }
+
+
+def run_layout(args) -> dict:
+    """Replay the fleet with the layout of this process and return the results."""
+    sys.path.insert(0, SRC)
+    import local_backend
+    import bpm_processor
+    import api_handler
+
+    backend = local_backend.get_backend()
+    result = {'layout': os.environ['MEASUREMENT_LAYOUT'], 'ingest': {}, 'queries': {}}
+
+    latencies, readings = [], 0
+    # bpm_processor prints its EMF latency records to stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        for batch in fleet_batches(args.users, args.devices, args.minutes, args.interval, args.seed):
+            began = time.perf_counter()
+            bpm_processor.lambda_handler(batch, None)
+            latencies.append((time.perf_counter() - began) * 1000)
+            readings += len(batch)
+    result['ingest'] = {
+        'invocations': len(latencies),
+        'readings': readings,
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        **usage(backend.metrics)
+    }
+
+    for name, path, params in QUERIES:
+        backend.reset_metrics()
+        latencies = []
+        for u in range(args.users):
+            user_id = f"bench-user-{u:04d}"
+            query = {k: v.format(device=f"bench-device-{u:04d}-0") for k, v in params.items()} if params else None
+            began = time.perf_counter()
+            response = api_handler.lambda_handler(api_event(path, user_id, query), None)
+            latencies.append((time.perf_counter() - began) * 1000)
+            if response['statusCode'] != 200:
+                raise RuntimeError(f"{name} returned {response['statusCode']}: {response['body']}")
+        result['queries'][name] = {
+            'p50_ms': percentile(latencies, 0.5),
+            'p95_ms': percentile(latencies, 0.95),
+            **{k: v / len(latencies) for k, v in usage(backend.metrics).items()}
+        }
+    return result
+
+
+def print_results(results: list):
+    """Print the ingest and query tables of every layout."""
+    print('Ingest (bpm_processor, one invocation per fog batch)')
+    print(f"{'layout':<8}{'calls':>7}{'readings':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'items':>9}{'WCU':>10}{'WCU/rdg':>9}{'RCU':>9}{'S3 PUT':>8}{'S3 GET':>8}{'SNS':>6}")
+    for result in results:
+        r = result['ingest']
+        print(f"{result['layout']:<8}{r['invocations']:>7}{r['readings']:>10}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}"
+              f"{r['p99_ms']:>9.2f}{r['items_written']:>9}{r['write_units']:>10.0f}"
+              f"{r['write_units'] / r['readings']:>9.2f}{r['read_units']:>9.1f}{r['s3_put']:>8}{r['s3_get']:>8}"
+              f"{r['sns_publish']:>6}")
+    print()
+    print('Queries (api_handler, per request)')
+    print(f"{'layout':<8}{'route':<26}{'p50 ms':>9}{'p95 ms':>9}{'RCU':>9}{'S3 GET':>8}{'S3 LIST':>9}")
+    for result in results:
+        for name, r in result['queries'].items():
+            print(f"{result['layout']:<8}{name:<26}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['read_units']:>9.1f}"
+                  f"{r['s3_get']:>8.1f}{r['s3_list']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a synthetic fleet through the Lambda handlers')
+    parser.add_argument('--backend', default='memory', choices=['memory', 'sqlite'],
+                        help='Local backend (sqlite uses --db, in memory by default)')
+    parser.add_argument('--db', default=':memory:', help='SQLite file for --backend sqlite')
+    parser.add_argument('--layout', choices=LAYOUTS, help='Measurement layout (default: both)')
+    parser.add_argument('--users', type=int, default=10, help='Users in the fleet')
+    parser.add_argument('--devices', type=int, default=2, help='Devices per user')
+    parser.add_argument('--minutes', type=int, default=20, help='Minutes of 1 Hz readings to replay')
+    parser.add_argument('--interval', type=int, default=10, help='Seconds of readings per fog batch')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the fleet')
+    parser.add_argument('--json', action='store_true', help='Print raw results as JSON')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_layout(args)))
+        return
+
+    # Layouts are read at import time, so each one runs in its own interpreter
+    results = []
+    for layout in [args.layout] if args.layout else LAYOUTS:
+        environment = {**os.environ, **ENVIRONMENT, 'MEASUREMENT_LAYOUT': layout,
+                       'AWS_BACKEND': args.backend, 'LOCAL_BACKEND_PATH': args.db}
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', *sys.argv[1:]],
+            env=environment, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.users} users x {args.devices} devices, {args.minutes} min at 1 Hz, "
+              f"{args.interval} s batches, {args.backend} backend")
+        print()
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Fog Replay Benchmark
+Replays sensor traffic through the fog filter and reports what reaches the cloud.
+
+This script:
+1. Reads traffic recorded by the fog server (fog_server.py --record FILE, one
+   JSON message per line) or generates a synthetic recording with sleeping,
+   resting, active and episodic patients
+2. Replays it through FogProcessor on the recorded timestamps, once with a
+   fixed aggregation window (min = max) and once with adaptive windows,
+   sweeping silent devices for dropouts as the recorded time advances
+3. Reports, per device and in total, readings received, messages forwarded
+   by reason (critical, warning, anomaly, periodic summary) and the forward
+   ratio of each configuration
+
+Usage:
+    python benchmarks/fog_replay.py
+    python benchmarks/fog_replay.py --recording traffic.jsonl --min-window 5 --max-window 60
+    python benchmarks/fog_replay.py --minutes 120 --save traffic.jsonl
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+from datetime import datetime, timezone, timedelta
+
+FOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fog')
+
+# Synthetic patients: (profile, baseline BPM, noise, pull to baseline)
+PROFILES = [
+    ('sleeping', 60, 0.4, 0.2),
+    ('resting', 72, 1.0, 0.1),
+    ('active', 95, 4.0, 0.02),
+    ('episodic', 75, 1.2, 0.1)
+]
+REASONS = ['critical', 'warning', 'anomaly', 'periodic']
+
+
+def synthetic_recording(devices_per_profile: int, minutes: int, seed: int) -> list:
+    """
+    Generate 1 Hz traffic of several patients, interleaved as the fog receives it.
+
+    Returns:
+        List of raw JSON lines
+    """
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    devices = [(profile, f"{profile}-{n}", baseline, noise, pull)
+               for profile, baseline, noise, pull in PROFILES
+               for n in range(devices_per_profile)]
+    levels = {device_id: baseline for _, device_id, baseline, _, _ in devices}
+    episodes = {}
+
+    lines = []
+    for second in range(minutes * 60):
+        timestamp = (start + timedelta(seconds=second)).isoformat().replace('+00:00', 'Z')
+        for profile, device_id, baseline, noise, pull in devices:
+            levels[device_id] += rng.gauss(0, noise) + (baseline - levels[device_id]) * pull
+            bpm = levels[device_id]
+            if profile == 'episodic':
+                if device_id not in episodes and rng.random() < 1 / 900:
+                    episodes[device_id] = (rng.choice([45, 125, 160]), rng.randint(60, 300))
+                if device_id in episodes:
+                    target, remaining = episodes[device_id]
+                    bpm = target + rng.gauss(0, 2)
+                    episodes[device_id] = (target, remaining - 1)
+                    if remaining <= 1:
+                        del episodes[device_id]
+            lines.append(json.dumps({
+                'user_id': f"user-{device_id}",
+                'device_id': device_id,
+                'timestamp': timestamp,
+                'bpm': max(30, min(200, round(bpm)))
+            }))
+    return lines
+
+
+def reason_of(processed: dict) -> str:
+    """Classify why a forwarded message was sent."""
+    risk_level = processed.get('risk_level')
+    if risk_level in ('critical_low', 'critical_high'):
+        return 'critical'
+    if risk_level in ('warning_low', 'warning_high'):
+        return 'warning'
+    if processed.get('anomalies'):
+        return 'anomaly'
+    return 'periodic'
+
+
+def replay(lines: list, min_window: float, max_window: float) -> dict:
+    """
+    Replay recorded lines through a FogProcessor on their own timestamps.
+
+    Returns:
+        Dict of device_id to counters (received, forwarded per reason, window)
+    """
+    import fog_server
+
+    now = [0.0]
+    processor = fog_server.FogProcessor(min_window=min_window, max_window=max_window, clock=lambda: now[0])
+    devices = {}
+    swept = None
+
+    for line in lines:
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        device_id = data.get('device_id', 'unknown')
+        counters = devices.setdefault(device_id, {'received': 0, **{reason: 0 for reason in REASONS}})
+        counters['received'] += 1
+
+        now[0] = fog_server.reading_time(data)
+        # The server sweeps silent devices periodically; here, as the recorded time advances
+        if swept is None or now[0] - swept >= fog_server.ANOMALY_DROPOUT_SWEEP_SECONDS:
+            for reading in processor.sweep_dropouts():
+                if processor.should_send_to_cloud(reading)[0]:
+                    devices[reading['device_id']]['anomaly'] += 1
+            swept = now[0]
+        processed = processor.preprocess(data)
+        processor.update_device_stats(device_id, processed)
+        should_send, _ = processor.should_send_to_cloud(processed)
+        if should_send:
+            counters[reason_of(processed)] += 1
+
+    for device_id, summary in processor.get_stats_summary().items():
+        devices[device_id]['window'] = summary['aggregation_window']
+    return devices
+
+
+def forwarded(counters: dict) -> int:
+    return sum(counters[reason] for reason in REASONS)
+
+
+def print_results(fixed: dict, adaptive: dict, min_window: float, max_window: float):
+    """Print per-device and total forward ratios of both configurations."""
+    print(f"{'device':<16}{'received':>9}{'fixed':>8}{'ratio':>8}{'adaptive':>10}{'ratio':>8}"
+          f"{'window s':>10}{'crit':>6}{'warn':>6}{'anom':>6}{'periodic':>10}")
+    totals = {'received': 0, 'fixed': 0, 'adaptive': 0}
+    for device_id in sorted(fixed):
+        f, a = fixed[device_id], adaptive[device_id]
+        totals['received'] += f['received']
+        totals['fixed'] += forwarded(f)
+        totals['adaptive'] += forwarded(a)
+        print(f"{device_id:<16}{f['received']:>9}{forwarded(f):>8}{forwarded(f) / f['received']:>8.1%}"
+              f"{forwarded(a):>10}{forwarded(a) / a['received']:>8.1%}{a['window']:>10.1f}"
+              f"{a['critical']:>6}{a['warning']:>6}{a['anomaly']:>6}{a['periodic']:>10}")
+    print()
+    print(f"Forward ratio, fixed {min_window:g} s window:      "
+          f"{totals['fixed'] / totals['received']:.2%} ({totals['fixed']} messages)")
+    print(f"Forward ratio, adaptive {min_window:g}-{max_window:g} s windows: "
+          f"{totals['adaptive'] / totals['received']:.2%} ({totals['adaptive']} messages)")
+    if totals['fixed']:
+        print(f"Cloud messages: {totals['adaptive'] / totals['fixed'] - 1:+.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay sensor traffic through the fog filter')
+    parser.add_argument('--recording', help='Traffic recorded with fog_server.py --record (default: synthetic)')
+    parser.add_argument('--devices', type=int, default=2, help='Synthetic devices per profile')
+    parser.add_argument('--minutes', type=int, default=60, help='Minutes of synthetic 1 Hz traffic')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the synthetic traffic')
+    parser.add_argument('--save', help='Write the synthetic traffic to this file')
+    parser.add_argument('--min-window', type=float, help='Adaptive minimum window (default: fog default)')
+    parser.add_argument('--max-window', type=float, help='Adaptive maximum window (default: fog default)')
+    args = parser.parse_args()
+
+    sys.path.insert(0, FOG)
+    import fog_server
+
+    min_window = args.min_window if args.min_window is not None else fog_server.AGGREGATION_WINDOW_MIN
+    max_window = args.max_window if args.max_window is not None else fog_server.AGGREGATION_WINDOW_MAX
+
+    if args.recording:
+        with open(args.recording, encoding='utf-8') as recording:
+            lines = [line.strip() for line in recording if line.strip()]
+        source = args.recording
+    else:
+        lines = synthetic_recording(args.devices, args.minutes, args.seed)
+        source = f"synthetic, {args.devices} devices per profile, {args.minutes} min at 1 Hz"
+        if args.save:
+            with open(args.save, 'w', encoding='utf-8') as recording:
+                recording.write(''.join(f"{line}\n" for line in lines))
+
+    # The fog prints nothing during a replay, but keep stdout clean regardless
+    with contextlib.redirect_stdout(io.StringIO()):
+        fixed = replay(lines, min_window, min_window)
+        adaptive = replay(lines, min_window, max_window)
+
+    print(f"Traffic: {source} ({len(lines)} messages)")
+    print()
+    print_results(fixed, adaptive, min_window, max_window)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Lambda Startup Benchmark
+Measures init time and warm per-invocation overhead of the Lambda handlers.
+
+This script:
+1. Imports each handler module in fresh interpreters and times the import
+   (the Lambda init phase) and the first request
+2. Times warm api_handler requests that need no AWS call (profile, 404,
+   CORS preflight), i.e. logging, routing and response overhead
+3. Times warm bpm_processor invocations against moto, when it is installed
+
+Run it against an older revision to compare, e.g.:
+    git worktree add /tmp/before <rev>
+    python benchmarks/lambda_startup.py --src /tmp/before/cloud/infrastructure/modules/lambda/src
+    python benchmarks/lambda_startup.py
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cloud',
+                           'infrastructure', 'modules', 'lambda', 'src')
+
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'DYNAMODB_TABLE_NAME': 'bench-measurements',
+    'USER_STATE_TABLE_NAME': 'bench-user-state',
+    'DEVICES_TABLE_NAME': 'bench-devices',
+    'S3_BUCKET_NAME': 'bench-archive'
+}
+
+# Runs in a fresh interpreter: import time and first request in ms
+COLD_SCRIPT = """
+import json, logging, os, sys, time
+logging.basicConfig(stream=open(os.devnull, 'w'))
+sys.path.insert(0, sys.argv[1])
+began = time.perf_counter()
+module = __import__(sys.argv[2])
+imported = time.perf_counter()
+if sys.argv[2] == 'api_handler':
+    module.lambda_handler(json.loads(sys.argv[3]), None)
+first = time.perf_counter()
+print(json.dumps({'init': (imported - began) * 1000, 'first': (first - imported) * 1000}))
+"""
+
+
+def api_event(path: str, method: str = 'GET') -> dict:
+    """Build an authenticated API Gateway event."""
+    return {
+        'httpMethod': method,
+        'path': path,
+        'headers': {'Accept-Encoding': 'gzip'},
+        'queryStringParameters': None,
+        'requestContext': {'authorizer': {'claims': {
+            'sub': '3f1c2a9e-5b7d-4c8e-9a1f-2b3c4d5e6f70',
+            'email': 'user@example.com',
+            'cognito:groups': 'patients'
+        }}}
+    }
+
+
+def measure_cold(src: str, module: str, runs: int) -> dict:
+    """Import a module in fresh interpreters and return median timings."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', COLD_SCRIPT, src, module, json.dumps(api_event('/user/profile'))],
+            env={**os.environ, **ENVIRONMENT}, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(output))
+    return {key: statistics.median(s[key] for s in samples) for key in ('init', 'first')}
+
+
+def time_calls(call, iterations: int) -> float:
+    """Return the median time of a call in microseconds."""
+    import time
+
+    samples = []
+    for _ in range(iterations):
+        began = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - began) * 1e6)
+    return statistics.median(samples)
+
+
+def measure_api_warm(iterations: int) -> dict:
+    """Time warm api_handler requests that touch no AWS service."""
+    import api_handler
+
+    return {
+        name: time_calls(lambda: api_handler.lambda_handler(event, None), iterations)
+        for name, event in (
+            ('GET /user/profile', api_event('/user/profile')),
+            ('GET /unknown (404)', api_event('/unknown')),
+            ('OPTIONS /bpm/history', api_event('/bpm/history', 'OPTIONS'))
+        )
+    }
+
+
+def measure_processor_warm(iterations: int) -> dict:
+    """Time warm bpm_processor invocations against moto (if installed)."""
+    try:
+        from moto import mock_aws
+    except ImportError:
+        return {}
+    import boto3
+
+    with mock_aws():
+        dynamodb = boto3.client('dynamodb')
+        for name, hash_key, range_key in (
+            (ENVIRONMENT['DYNAMODB_TABLE_NAME'], 'user_id', 'timestamp_device'),
+            (ENVIRONMENT['USER_STATE_TABLE_NAME'], 'user_id', 'state_key'),
+            (ENVIRONMENT['DEVICES_TABLE_NAME'], 'user_id', 'device_id')
+        ):
+            dynamodb.create_table(
+                TableName=name,
+                KeySchema=[{'AttributeName': hash_key, 'KeyType': 'HASH'},
+                           {'AttributeName': range_key, 'KeyType': 'RANGE'}],
+                AttributeDefinitions=[{'AttributeName': hash_key, 'AttributeType': 'S'},
+                                      {'AttributeName': range_key, 'AttributeType': 'S'}],
+                BillingMode='PAY_PER_REQUEST'
+            )
+        boto3.client('s3').create_bucket(Bucket=ENVIRONMENT['S3_BUCKET_NAME'])
+        os.environ['SNS_TOPIC_ARN'] = boto3.client('sns').create_topic(Name='bench')['TopicArn']
+
+        import bpm_processor
+
+        counter = iter(range(10 ** 9))
+
+        def batch(size):
+            return [{
+                'user_id': 'u1',
+                'device_id': 'bpm-device-001',
+                'timestamp': f"2025-01-01T00:00:00.{next(counter):06d}Z",
+                'bpm': 72
+            } for _ in range(size)]
+
+        return {
+            f"{size} readings": time_calls(lambda: bpm_processor.lambda_handler(batch(size), None), iterations)
+            for size in (1, 25)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Lambda init and warm overhead')
+    parser.add_argument('--src', default=DEFAULT_SRC, help='Lambda source directory to benchmark')
+    parser.add_argument('--runs', type=int, default=7, help='Fresh interpreters per module')
+    parser.add_argument('--iterations', type=int, default=2000, help='Warm API requests per case')
+    args = parser.parse_args()
+
+    src = os.path.abspath(args.src)
+    os.environ.update(ENVIRONMENT)
+    sys.path.insert(0, src)
+
+    import logging
+    logging.basicConfig(stream=open(os.devnull, 'w'))
+
+    print(f"Source: {src}")
+    print('Cold start (median ms)')
+    for module in ('api_handler', 'bpm_processor'):
+        cold = measure_cold(src, module, args.runs)
+        first = f"{cold['first']:>8.1f}" if module == 'api_handler' else f"{'-':>8}"
+        print(f"  {module:<16} init {cold['init']:>8.1f}   first request {first}")
+
+    print('Warm api_handler (median us per request)')
+    for name, micros in measure_api_warm(args.iterations).items():
+        print(f"  {name:<24}{micros:>10.1f}")
+
+    processor = measure_processor_warm(max(1, args.iterations // 20))
+    if processor:
+        print('Warm bpm_processor against moto (median us per invocation)')
+        for name, micros in processor.items():
+            print(f"  {name:<24}{micros:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Measurement Layout Benchmark
+Compares the per-reading and bucket layouts of the measurements table.
+
+This script:
+1. Models the DynamoDB item size of both layouts for one device at 1 Hz
+2. Derives write units, read units, storage and on-demand cost per device
+   for several batch sizes (readings of a device per invocation)
+3. Times packing and unpacking on this machine
+4. Optionally writes and reads one hour of readings against DynamoDB Local
+   (--endpoint-url) to measure real request throughput
+
+Usage:
+    python benchmarks/measurement_layout.py
+    python benchmarks/measurement_layout.py --endpoint-url http://localhost:8000
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'cloud', 'infrastructure',
+                                'modules', 'lambda', 'src'))
+
+from local_backend import item_size  # noqa: E402
+from measurement_layout import (  # noqa: E402
+    bucket_start,
+    bucket_update,
+    format_timestamp,
+    unpack_item
+)
+
+READINGS_PER_DAY = 86400
+BUCKET_SECONDS = 60
+BATCH_SIZES = [1, 10, 60]
+
+# On-demand prices (us-east-1, USD)
+PRICE_PER_MILLION_WRU = 1.25
+PRICE_PER_MILLION_RRU = 0.25
+PRICE_PER_GB_MONTH = 0.25
+
+
+def make_readings(start: datetime, count: int) -> list:
+    """Build classified 1 Hz measurements as bpm_processor does."""
+    readings = []
+    for i in range(count):
+        bpm = 60 + (i * 7) % 45
+        severity = 'normal' if bpm < 100 else 'warning_high'
+        readings.append({
+            'user_id': '3f1c2a9e-5b7d-4c8e-9a1f-2b3c4d5e6f70',
+            'device_id': 'bpm-device-001',
+            'timestamp': format_timestamp(start + timedelta(seconds=i, microseconds=123456)),
+            'bpm': bpm,
+            'classification': {'status': severity.split('_')[0], 'severity': severity}
+        })
+    return readings
+
+
+def per_reading_item(measurement: dict) -> dict:
+    """Build the item store_in_dynamodb writes."""
+    return {
+        'user_id': measurement['user_id'],
+        'timestamp_device': f"{measurement['timestamp']}#{measurement['device_id']}",
+        'device_id': measurement['device_id'],
+        'timestamp': measurement['timestamp'],
+        'measurement_date': measurement['timestamp'][:10],
+        'bpm': Decimal(str(measurement['bpm'])),
+        'status': measurement['classification']['status'],
+        'severity': measurement['classification']['severity'],
+        'ttl': 1767225600,
+        'created_at': datetime.now(timezone.utc).isoformat()
+    }
+
+
+def bucket_item(measurements: list) -> dict:
+    """Build the final bucket item for the readings of one bucket."""
+    start = bucket_start(datetime.fromisoformat(measurements[0]['timestamp'].replace('Z', '+00:00')),
+                         BUCKET_SECONDS)
+    update = bucket_update(measurements[0]['user_id'], measurements[0]['device_id'], start,
+                           measurements, 1767225600, BUCKET_SECONDS)
+    values = update['ExpressionAttributeValues']
+    return {
+        **update['Key'],
+        'offsets': values[':offsets'],
+        'bpms': values[':bpms'],
+        'codes': values[':codes'],
+        'device_id': values[':device_id'],
+        'timestamp': values[':ts'],
+        'measurement_date': values[':date'],
+        'bucket_seconds': values[':seconds'],
+        'ttl': values[':ttl'],
+        'reading_count': values[':count']
+    }
+
+
+def cost_model():
+    """Print units, storage and cost per device and day for both layouts."""
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    bucket = make_readings(start, BUCKET_SECONDS)
+
+    item_bytes = item_size(per_reading_item(bucket[0]))
+    item_wcu_day = READINGS_PER_DAY * math.ceil(item_bytes / 1024)
+    item_storage_day = READINGS_PER_DAY * (item_bytes + 100)  # +100 B index overhead per item
+    item_rru_day = math.ceil(READINGS_PER_DAY * item_bytes / 4096) / 2
+
+    rows = [('item', 1, item_bytes, item_wcu_day, item_storage_day, item_rru_day)]
+
+    buckets_per_day = READINGS_PER_DAY // BUCKET_SECONDS
+    bucket_bytes = item_size(bucket_item(bucket))
+    for batch in BATCH_SIZES:
+        # UpdateItem is billed on the larger of the item before and after
+        wcu_per_bucket = sum(
+            math.ceil(item_size(bucket_item(bucket[:appended])) / 1024)
+            for appended in range(batch, BUCKET_SECONDS + 1, batch)
+        )
+        rows.append((
+            'bucket', batch, bucket_bytes, buckets_per_day * wcu_per_bucket,
+            buckets_per_day * (bucket_bytes + 100),
+            math.ceil(buckets_per_day * bucket_bytes / 4096) / 2
+        ))
+
+    print(f"One device at 1 Hz ({READINGS_PER_DAY} readings/day), {BUCKET_SECONDS} s buckets")
+    print(f"{'layout':<8}{'batch':>6}{'item B':>9}{'WRU/day':>10}{'MB/day':>9}"
+          f"{'RRU/day read':>14}{'USD/month':>11}")
+    for layout, batch, size, wcu, storage, rru in rows:
+        # Writes for 30 days, one full-day read per day, 90 days of storage
+        monthly = (
+            wcu * 30 * PRICE_PER_MILLION_WRU / 1e6
+            + rru * 30 * PRICE_PER_MILLION_RRU / 1e6
+            + storage * 90 / 1e9 * PRICE_PER_GB_MONTH
+        )
+        print(f"{layout:<8}{batch:>6}{size:>9}{wcu:>10}{storage / 1e6:>9.1f}{rru:>14.1f}{monthly:>11.3f}")
+    print()
+
+
+def cpu_throughput():
+    """Time packing and unpacking one day of readings."""
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    readings = make_readings(start, READINGS_PER_DAY)
+
+    began = time.perf_counter()
+    items = [per_reading_item(m) for m in readings]
+    item_seconds = time.perf_counter() - began
+
+    began = time.perf_counter()
+    buckets = [bucket_item(readings[i:i + BUCKET_SECONDS])
+               for i in range(0, len(readings), BUCKET_SECONDS)]
+    pack_seconds = time.perf_counter() - began
+
+    began = time.perf_counter()
+    unpacked = sum(len(unpack_item(item)) for item in buckets)
+    unpack_seconds = time.perf_counter() - began
+
+    assert unpacked == len(items)
+    print('CPU (one day of readings)')
+    print(f"  build per-reading items   {len(items) / item_seconds:>12,.0f} readings/s")
+    print(f"  pack bucket items         {len(readings) / pack_seconds:>12,.0f} readings/s")
+    print(f"  unpack bucket items       {unpacked / unpack_seconds:>12,.0f} readings/s")
+    print()
+
+
+def dynamodb_local(endpoint_url: str, batch: int):
+    """Write and read one hour of readings in both layouts against DynamoDB Local."""
+    import boto3
+
+    dynamodb = boto3.resource('dynamodb', endpoint_url=endpoint_url, region_name='us-east-1')
+    table_name = f"bench-measurements-{int(time.time())}"
+    table = dynamodb.create_table(
+        TableName=table_name,
+        KeySchema=[
+            {'AttributeName': 'user_id', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp_device', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'user_id', 'AttributeType': 'S'},
+            {'AttributeName': 'timestamp_device', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.wait_until_exists()
+
+    try:
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        readings = make_readings(start, 3600)
+
+        began = time.perf_counter()
+        for measurement in readings:
+            table.put_item(Item=per_reading_item(measurement))
+        item_write = time.perf_counter() - began
+
+        packed = [{**m, 'user_id': 'packed'} for m in readings]
+        began = time.perf_counter()
+        for i in range(0, len(packed), batch):
+            chunk = packed[i:i + batch]
+            chunk_start = bucket_start(start + timedelta(seconds=i), BUCKET_SECONDS)
+            # A batch never spans two buckets when it divides the bucket length
+            table.update_item(**bucket_update('packed', chunk[0]['device_id'], chunk_start,
+                                              chunk, 1767225600, BUCKET_SECONDS))
+        bucket_write = time.perf_counter() - began
+
+        def read_all(user_id):
+            began = time.perf_counter()
+            params = {'KeyConditionExpression': boto3.dynamodb.conditions.Key('user_id').eq(user_id)}
+            count = 0
+            while True:
+                response = table.query(**params)
+                count += sum(len(unpack_item(item)) for item in response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    return count, time.perf_counter() - began
+                params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        item_count, item_read = read_all(readings[0]['user_id'])
+        bucket_count, bucket_read = read_all('packed')
+
+        print(f"DynamoDB Local ({endpoint_url}), one hour, bucket batch {batch}")
+        print(f"  item   write {len(readings) / item_write:>9,.0f} readings/s"
+              f"   read {item_count / item_read:>11,.0f} readings/s")
+        print(f"  bucket write {len(readings) / bucket_write:>9,.0f} readings/s"
+              f"   read {bucket_count / bucket_read:>11,.0f} readings/s")
+    finally:
+        table.delete()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the measurements table layouts')
+    parser.add_argument('--endpoint-url', help='DynamoDB Local endpoint for the request benchmark')
+    parser.add_argument('--batch', type=int, default=10, choices=BATCH_SIZES,
+                        help='Readings per bucket append in the request benchmark')
+    args = parser.parse_args()
+
+    cost_model()
+    cpu_throughput()
+    if args.endpoint_url:
+        dynamodb_local(args.endpoint_url, args.batch)
+
+
+if __name__ == '__main__':
+    main()
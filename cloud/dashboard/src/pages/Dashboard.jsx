@@ -1,4 +1,4 @@
-import { useState, useEffect, useCallback } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
 import {
   Heart,
   Activity,
@@ -20,7 +20,18 @@ import {
 } from 'recharts';
 import { format } from 'date-fns';
 import { es } from 'date-fns/locale';
-import { getCurrentStatus, getBpmHistory, getBpmStatistics } from '../services/api';
+import {
+  getCurrentStatus,
+  getBpmHistory,
+  getBpmStatistics,
+  waitForStatusChange,
+} from '../services/api';
+
+// Used as `since` until the first reading exists
+const NO_READING_SINCE = '1970-01-01T00:00:00Z';
+const POLL_RETRY_DELAY_MS = 5000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
 
 export default function Dashboard() {
   const [currentStatus, setCurrentStatus] = useState(null);
@@ -30,16 +41,19 @@ export default function Dashboard() {
   const [error, setError] = useState(null);
   const [lastUpdate, setLastUpdate] = useState(null);
   const [autoRefresh, setAutoRefresh] = useState(true);
+  const latestTimestamp = useRef(null);
 
-  const fetchData = useCallback(async () => {
+  // `knownStatus` is the fresh status returned by a long poll, if any
+  const fetchData = useCallback(async (knownStatus = null) => {
     try {
       const [statusRes, historyRes, statsRes] = await Promise.all([
-        getCurrentStatus(),
+        knownStatus || getCurrentStatus(),
         getBpmHistory({ limit: 50 }),
         getBpmStatistics('day'),
       ]);
 
       setCurrentStatus(statusRes);
+      latestTimestamp.current = statusRes.timestamp || null;
       setHistory(historyRes.measurements || []);
       setStatistics(statsRes);
       setLastUpdate(new Date());
@@ -56,12 +70,29 @@ export default function Dashboard() {
     fetchData();
   }, [fetchData]);
 
-  // Auto-refresh every 10 seconds
+  // Live updates: long-poll /bpm/current and reload once a new reading exists
   useEffect(() => {
     if (!autoRefresh) return;
 
-    const interval = setInterval(fetchData, 10000);
-    return () => clearInterval(interval);
+    let cancelled = false;
+    const poll = async () => {
+      while (!cancelled) {
+        try {
+          const status = await waitForStatusChange(latestTimestamp.current || NO_READING_SINCE);
+          if (!cancelled && status.changed) {
+            await fetchData(status);
+          }
+        } catch (err) {
+          console.error('Error waiting for updates:', err);
+          await sleep(POLL_RETRY_DELAY_MS);
+        }
+      }
+    };
+
+    poll();
+    return () => {
+      cancelled = true;
+    };
   }, [autoRefresh, fetchData]);
 
   const getStatusColor = (status) => {
@@ -143,7 +174,7 @@ export default function Dashboard() {
             Auto-actualizar
           </label>
           <button
-            onClick={fetchData}
+            onClick={() => fetchData()}
             className="btn btn-secondary flex items-center gap-2"
           >
             <RefreshCw className="w-4 h-4" />
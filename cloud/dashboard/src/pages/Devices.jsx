@@ -13,6 +13,9 @@ import { format } from 'date-fns';
 import { es } from 'date-fns/locale';
 import { getDevices } from '../services/api';
 
+// A device that reported within this window is shown as online
+const ONLINE_THRESHOLD_MS = 5 * 60 * 1000;
+
 export default function Devices() {
   const [devices, setDevices] = useState([]);
   const [loading, setLoading] = useState(true);
@@ -24,17 +27,20 @@ export default function Devices() {
   const fetchDevices = async () => {
     try {
       const response = await getDevices();
-      // Transform device IDs to device objects with mock data
-      // In a real app, you'd fetch full device info from the API
-      const deviceList = (response.devices || []).map((deviceId, index) => ({
-        id: deviceId,
-        name: `Dispositivo ${index + 1}`,
-        type: 'BPM Sensor',
-        status: Math.random() > 0.3 ? 'online' : 'offline',
-        battery: Math.floor(Math.random() * 100),
-        lastSeen: new Date(Date.now() - Math.random() * 3600000),
-        firmware: '1.2.3',
-      }));
+      // Battery and firmware are not reported by the devices yet
+      const deviceList = (response.device_details || []).map((device, index) => {
+        const lastSeen = device.last_seen ? new Date(device.last_seen) : null;
+        return {
+          id: device.device_id,
+          name: `Dispositivo ${index + 1}`,
+          type: 'BPM Sensor',
+          status: lastSeen && Date.now() - lastSeen.getTime() < ONLINE_THRESHOLD_MS ? 'online' : 'offline',
+          battery: Math.floor(Math.random() * 100),
+          lastSeen: lastSeen || new Date(0),
+          lastBpm: device.last_bpm,
+          firmware: '1.2.3',
+        };
+      });
       setDevices(deviceList);
     } catch (err) {
       console.error('Error fetching devices:', err);
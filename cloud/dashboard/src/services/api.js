@@ -63,6 +63,15 @@ export async function getCurrentStatus() {
   return response.data;
 }
 
+/**
+ * Wait for a reading newer than `since` (long poll, held up to `wait` seconds)
+ */
+export async function waitForStatusChange(since, wait = 20) {
+  const client = getApiClient();
+  const response = await client.get('/bpm/current', { params: { since, wait } });
+  return response.data;
+}
+
 /**
  * Get BPM history
  */
@@ -84,13 +84,20 @@ module "lambda" {
   runtime         = var.lambda_runtime
   memory_size     = var.lambda_memory_size
   timeout         = var.lambda_timeout
+  numpy_layer_arn = var.lambda_numpy_layer_arn
+  
+  ingest_queue_enabled = var.ingest_queue_enabled
   
   # Dependencies
-  dynamodb_table_name = module.dynamodb.table_name
-  dynamodb_table_arn  = module.dynamodb.table_arn
-  s3_bucket_name      = module.s3.bucket_name
-  s3_bucket_arn       = module.s3.bucket_arn
-  sns_topic_arn       = module.sns.topic_arn
+  dynamodb_table_name   = module.dynamodb.table_name
+  dynamodb_table_arn    = module.dynamodb.table_arn
+  user_state_table_name = module.dynamodb.user_state_table_name
+  user_state_table_arn  = module.dynamodb.user_state_table_arn
+  devices_table_name    = module.dynamodb.devices_table_name
+  devices_table_arn     = module.dynamodb.devices_table_arn
+  s3_bucket_name        = module.s3.bucket_name
+  s3_bucket_arn         = module.s3.bucket_arn
+  sns_topic_arn         = module.sns.topic_arn
   
   # BPM Thresholds
   bpm_critical_low  = var.bpm_critical_low
@@ -111,6 +118,10 @@ module "iot_core" {
   name_prefix         = local.name_prefix
   lambda_function_arn = module.lambda.processor_function_arn
   
+  ingest_queue_enabled = var.ingest_queue_enabled
+  ingest_queue_url     = module.lambda.ingest_queue_url
+  ingest_queue_arn     = module.lambda.ingest_queue_arn
+  
   tags = local.common_tags
 }
 
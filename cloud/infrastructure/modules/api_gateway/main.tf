@@ -62,6 +62,10 @@ resource "aws_api_gateway_rest_api" "main" {
     types = ["REGIONAL"]
   }
 
+  # Lets the API handler return gzip bodies flagged as base64. The CORS
+  # mock integrations convert requests to text so their templates still apply.
+  binary_media_types = ["*/*"]
+
   tags = merge(var.tags, {
     Name = "${var.name_prefix}-api"
   })
@@ -115,6 +119,20 @@ resource "aws_api_gateway_resource" "bpm_statistics" {
   path_part   = "statistics"
 }
 
+# /bpm/report
+resource "aws_api_gateway_resource" "bpm_report" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  parent_id   = aws_api_gateway_resource.bpm.id
+  path_part   = "report"
+}
+
+# /bpm/export
+resource "aws_api_gateway_resource" "bpm_export" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  parent_id   = aws_api_gateway_resource.bpm.id
+  path_part   = "export"
+}
+
 # /devices
 resource "aws_api_gateway_resource" "devices" {
   rest_api_id = aws_api_gateway_rest_api.main.id
@@ -136,6 +154,20 @@ resource "aws_api_gateway_resource" "user_profile" {
   path_part   = "profile"
 }
 
+# /patients
+resource "aws_api_gateway_resource" "patients" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  parent_id   = aws_api_gateway_rest_api.main.root_resource_id
+  path_part   = "patients"
+}
+
+# /patients/status
+resource "aws_api_gateway_resource" "patients_status" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  parent_id   = aws_api_gateway_resource.patients.id
+  path_part   = "status"
+}
+
 # Health Check Method (No Auth)
 
 resource "aws_api_gateway_method" "health_get" {
@@ -168,6 +200,8 @@ resource "aws_api_gateway_method" "bpm_history_get" {
     "method.request.querystring.start_date" = false
     "method.request.querystring.end_date"   = false
     "method.request.querystring.limit"      = false
+    "method.request.querystring.cursor"     = false
+    "method.request.querystring.format"     = false
   }
 }
 
@@ -188,6 +222,12 @@ resource "aws_api_gateway_method" "bpm_current_get" {
   http_method   = "GET"
   authorization = "COGNITO_USER_POOLS"
   authorizer_id = aws_api_gateway_authorizer.cognito.id
+
+  request_parameters = {
+    "method.request.querystring.device_id" = false
+    "method.request.querystring.since"     = false
+    "method.request.querystring.wait"      = false
+  }
 }
 
 resource "aws_api_gateway_integration" "bpm_current_get" {
@@ -209,7 +249,10 @@ resource "aws_api_gateway_method" "bpm_statistics_get" {
   authorizer_id = aws_api_gateway_authorizer.cognito.id
 
   request_parameters = {
-    "method.request.querystring.period" = false
+    "method.request.querystring.period"     = false
+    "method.request.querystring.start_date" = false
+    "method.request.querystring.end_date"   = false
+    "method.request.querystring.device_id"  = false
   }
 }
 
@@ -222,6 +265,49 @@ resource "aws_api_gateway_integration" "bpm_statistics_get" {
   uri                     = "arn:aws:apigateway:${var.aws_region}:lambda:path/2015-03-31/functions/${var.lambda_api_handler_arn}/invocations"
 }
 
+# BPM Report Methods
+
+resource "aws_api_gateway_method" "bpm_report_get" {
+  rest_api_id   = aws_api_gateway_rest_api.main.id
+  resource_id   = aws_api_gateway_resource.bpm_report.id
+  http_method   = "GET"
+  authorization = "COGNITO_USER_POOLS"
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+
+  request_parameters = {
+    "method.request.querystring.date"    = false
+    "method.request.querystring.user_id" = false
+  }
+}
+
+resource "aws_api_gateway_integration" "bpm_report_get" {
+  rest_api_id             = aws_api_gateway_rest_api.main.id
+  resource_id             = aws_api_gateway_resource.bpm_report.id
+  http_method             = aws_api_gateway_method.bpm_report_get.http_method
+  type                    = "AWS_PROXY"
+  integration_http_method = "POST"
+  uri                     = "arn:aws:apigateway:${var.aws_region}:lambda:path/2015-03-31/functions/${var.lambda_api_handler_arn}/invocations"
+}
+
+# BPM Export Methods
+
+resource "aws_api_gateway_method" "bpm_export_post" {
+  rest_api_id   = aws_api_gateway_rest_api.main.id
+  resource_id   = aws_api_gateway_resource.bpm_export.id
+  http_method   = "POST"
+  authorization = "COGNITO_USER_POOLS"
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "bpm_export_post" {
+  rest_api_id             = aws_api_gateway_rest_api.main.id
+  resource_id             = aws_api_gateway_resource.bpm_export.id
+  http_method             = aws_api_gateway_method.bpm_export_post.http_method
+  type                    = "AWS_PROXY"
+  integration_http_method = "POST"
+  uri                     = "arn:aws:apigateway:${var.aws_region}:lambda:path/2015-03-31/functions/${var.lambda_api_handler_arn}/invocations"
+}
+
 # Devices Methods
 
 resource "aws_api_gateway_method" "devices_get" {
@@ -260,6 +346,25 @@ resource "aws_api_gateway_integration" "user_profile_get" {
   uri                     = "arn:aws:apigateway:${var.aws_region}:lambda:path/2015-03-31/functions/${var.lambda_api_handler_arn}/invocations"
 }
 
+# Patients Status Methods (clinician roles, checked by the API handler)
+
+resource "aws_api_gateway_method" "patients_status_post" {
+  rest_api_id   = aws_api_gateway_rest_api.main.id
+  resource_id   = aws_api_gateway_resource.patients_status.id
+  http_method   = "POST"
+  authorization = "COGNITO_USER_POOLS"
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "patients_status_post" {
+  rest_api_id             = aws_api_gateway_rest_api.main.id
+  resource_id             = aws_api_gateway_resource.patients_status.id
+  http_method             = aws_api_gateway_method.patients_status_post.http_method
+  type                    = "AWS_PROXY"
+  integration_http_method = "POST"
+  uri                     = "arn:aws:apigateway:${var.aws_region}:lambda:path/2015-03-31/functions/${var.lambda_api_handler_arn}/invocations"
+}
+
 # CORS Configuration
 
 # CORS for /bpm/history
@@ -276,6 +381,8 @@ resource "aws_api_gateway_integration" "bpm_history_options" {
   http_method = aws_api_gateway_method.bpm_history_options.http_method
   type        = "MOCK"
 
+  content_handling = "CONVERT_TO_TEXT"
+
   request_templates = {
     "application/json" = "{\"statusCode\": 200}"
   }
@@ -301,7 +408,7 @@ resource "aws_api_gateway_integration_response" "bpm_history_options" {
   status_code = aws_api_gateway_method_response.bpm_history_options.status_code
 
   response_parameters = {
-    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization'"
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization,If-None-Match'"
     "method.response.header.Access-Control-Allow-Methods" = "'GET,OPTIONS'"
     "method.response.header.Access-Control-Allow-Origin"  = "'*'"
   }
@@ -323,6 +430,8 @@ resource "aws_api_gateway_integration" "bpm_current_options" {
   http_method = aws_api_gateway_method.bpm_current_options.http_method
   type        = "MOCK"
 
+  content_handling = "CONVERT_TO_TEXT"
+
   request_templates = {
     "application/json" = "{\"statusCode\": 200}"
   }
@@ -348,7 +457,7 @@ resource "aws_api_gateway_integration_response" "bpm_current_options" {
   status_code = aws_api_gateway_method_response.bpm_current_options.status_code
 
   response_parameters = {
-    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization'"
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization,If-None-Match'"
     "method.response.header.Access-Control-Allow-Methods" = "'GET,OPTIONS'"
     "method.response.header.Access-Control-Allow-Origin"  = "'*'"
   }
@@ -370,6 +479,8 @@ resource "aws_api_gateway_integration" "bpm_statistics_options" {
   http_method = aws_api_gateway_method.bpm_statistics_options.http_method
   type        = "MOCK"
 
+  content_handling = "CONVERT_TO_TEXT"
+
   request_templates = {
     "application/json" = "{\"statusCode\": 200}"
   }
@@ -395,7 +506,7 @@ resource "aws_api_gateway_integration_response" "bpm_statistics_options" {
   status_code = aws_api_gateway_method_response.bpm_statistics_options.status_code
 
   response_parameters = {
-    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization'"
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization,If-None-Match'"
     "method.response.header.Access-Control-Allow-Methods" = "'GET,OPTIONS'"
     "method.response.header.Access-Control-Allow-Origin"  = "'*'"
   }
@@ -403,6 +514,153 @@ resource "aws_api_gateway_integration_response" "bpm_statistics_options" {
   depends_on = [aws_api_gateway_integration.bpm_statistics_options]
 }
 
+# CORS for /bpm/report
+resource "aws_api_gateway_method" "bpm_report_options" {
+  rest_api_id   = aws_api_gateway_rest_api.main.id
+  resource_id   = aws_api_gateway_resource.bpm_report.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "bpm_report_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.bpm_report.id
+  http_method = aws_api_gateway_method.bpm_report_options.http_method
+  type        = "MOCK"
+
+  content_handling = "CONVERT_TO_TEXT"
+
+  request_templates = {
+    "application/json" = "{\"statusCode\": 200}"
+  }
+}
+
+resource "aws_api_gateway_method_response" "bpm_report_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.bpm_report.id
+  http_method = aws_api_gateway_method.bpm_report_options.http_method
+  status_code = "200"
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true
+    "method.response.header.Access-Control-Allow-Methods" = true
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+}
+
+resource "aws_api_gateway_integration_response" "bpm_report_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.bpm_report.id
+  http_method = aws_api_gateway_method.bpm_report_options.http_method
+  status_code = aws_api_gateway_method_response.bpm_report_options.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization,If-None-Match'"
+    "method.response.header.Access-Control-Allow-Methods" = "'GET,OPTIONS'"
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'"
+  }
+
+  depends_on = [aws_api_gateway_integration.bpm_report_options]
+}
+
+# CORS for /bpm/export
+resource "aws_api_gateway_method" "bpm_export_options" {
+  rest_api_id   = aws_api_gateway_rest_api.main.id
+  resource_id   = aws_api_gateway_resource.bpm_export.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "bpm_export_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.bpm_export.id
+  http_method = aws_api_gateway_method.bpm_export_options.http_method
+  type        = "MOCK"
+
+  content_handling = "CONVERT_TO_TEXT"
+
+  request_templates = {
+    "application/json" = "{\"statusCode\": 200}"
+  }
+}
+
+resource "aws_api_gateway_method_response" "bpm_export_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.bpm_export.id
+  http_method = aws_api_gateway_method.bpm_export_options.http_method
+  status_code = "200"
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true
+    "method.response.header.Access-Control-Allow-Methods" = true
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+}
+
+resource "aws_api_gateway_integration_response" "bpm_export_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.bpm_export.id
+  http_method = aws_api_gateway_method.bpm_export_options.http_method
+  status_code = aws_api_gateway_method_response.bpm_export_options.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization'"
+    "method.response.header.Access-Control-Allow-Methods" = "'POST,OPTIONS'"
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'"
+  }
+
+  depends_on = [aws_api_gateway_integration.bpm_export_options]
+}
+
+# CORS for /patients/status
+resource "aws_api_gateway_method" "patients_status_options" {
+  rest_api_id   = aws_api_gateway_rest_api.main.id
+  resource_id   = aws_api_gateway_resource.patients_status.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "patients_status_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.patients_status.id
+  http_method = aws_api_gateway_method.patients_status_options.http_method
+  type        = "MOCK"
+
+  content_handling = "CONVERT_TO_TEXT"
+
+  request_templates = {
+    "application/json" = "{\"statusCode\": 200}"
+  }
+}
+
+resource "aws_api_gateway_method_response" "patients_status_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.patients_status.id
+  http_method = aws_api_gateway_method.patients_status_options.http_method
+  status_code = "200"
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true
+    "method.response.header.Access-Control-Allow-Methods" = true
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+}
+
+resource "aws_api_gateway_integration_response" "patients_status_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.patients_status.id
+  http_method = aws_api_gateway_method.patients_status_options.http_method
+  status_code = aws_api_gateway_method_response.patients_status_options.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization'"
+    "method.response.header.Access-Control-Allow-Methods" = "'POST,OPTIONS'"
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'"
+  }
+
+  depends_on = [aws_api_gateway_integration.patients_status_options]
+}
+
 # CORS for /devices
 resource "aws_api_gateway_method" "devices_options" {
   rest_api_id   = aws_api_gateway_rest_api.main.id
@@ -417,6 +675,8 @@ resource "aws_api_gateway_integration" "devices_options" {
   http_method = aws_api_gateway_method.devices_options.http_method
   type        = "MOCK"
 
+  content_handling = "CONVERT_TO_TEXT"
+
   request_templates = {
     "application/json" = "{\"statusCode\": 200}"
   }
@@ -442,7 +702,7 @@ resource "aws_api_gateway_integration_response" "devices_options" {
   status_code = aws_api_gateway_method_response.devices_options.status_code
 
   response_parameters = {
-    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization'"
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization,If-None-Match'"
     "method.response.header.Access-Control-Allow-Methods" = "'GET,OPTIONS'"
     "method.response.header.Access-Control-Allow-Origin"  = "'*'"
   }
@@ -464,6 +724,8 @@ resource "aws_api_gateway_integration" "user_profile_options" {
   http_method = aws_api_gateway_method.user_profile_options.http_method
   type        = "MOCK"
 
+  content_handling = "CONVERT_TO_TEXT"
+
   request_templates = {
     "application/json" = "{\"statusCode\": 200}"
   }
@@ -489,7 +751,7 @@ resource "aws_api_gateway_integration_response" "user_profile_options" {
   status_code = aws_api_gateway_method_response.user_profile_options.status_code
 
   response_parameters = {
-    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization'"
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type,Authorization,If-None-Match'"
     "method.response.header.Access-Control-Allow-Methods" = "'GET,OPTIONS'"
     "method.response.header.Access-Control-Allow-Origin"  = "'*'"
   }
@@ -519,30 +781,46 @@ resource "aws_api_gateway_deployment" "main" {
       aws_api_gateway_resource.bpm_history.id,
       aws_api_gateway_resource.bpm_current.id,
       aws_api_gateway_resource.bpm_statistics.id,
+      aws_api_gateway_resource.bpm_report.id,
+      aws_api_gateway_resource.bpm_export.id,
       aws_api_gateway_resource.devices.id,
+      aws_api_gateway_resource.patients.id,
+      aws_api_gateway_resource.patients_status.id,
       aws_api_gateway_resource.user_profile.id,
       aws_api_gateway_method.health_get.id,
       aws_api_gateway_method.bpm_history_get.id,
       aws_api_gateway_method.bpm_current_get.id,
       aws_api_gateway_method.bpm_statistics_get.id,
+      aws_api_gateway_method.bpm_report_get.id,
+      aws_api_gateway_method.bpm_export_post.id,
       aws_api_gateway_method.devices_get.id,
+      aws_api_gateway_method.patients_status_post.id,
       aws_api_gateway_method.user_profile_get.id,
       aws_api_gateway_integration.health_get.id,
       aws_api_gateway_integration.bpm_history_get.id,
       aws_api_gateway_integration.bpm_current_get.id,
       aws_api_gateway_integration.bpm_statistics_get.id,
+      aws_api_gateway_integration.bpm_report_get.id,
+      aws_api_gateway_integration.bpm_export_post.id,
       aws_api_gateway_integration.devices_get.id,
+      aws_api_gateway_integration.patients_status_post.id,
       aws_api_gateway_integration.user_profile_get.id,
       # CORS OPTIONS methods
       aws_api_gateway_method.bpm_history_options.id,
       aws_api_gateway_method.bpm_current_options.id,
       aws_api_gateway_method.bpm_statistics_options.id,
+      aws_api_gateway_method.bpm_report_options.id,
+      aws_api_gateway_method.bpm_export_options.id,
       aws_api_gateway_method.devices_options.id,
+      aws_api_gateway_method.patients_status_options.id,
       aws_api_gateway_method.user_profile_options.id,
       aws_api_gateway_integration.bpm_history_options.id,
       aws_api_gateway_integration.bpm_current_options.id,
       aws_api_gateway_integration.bpm_statistics_options.id,
+      aws_api_gateway_integration.bpm_report_options.id,
+      aws_api_gateway_integration.bpm_export_options.id,
       aws_api_gateway_integration.devices_options.id,
+      aws_api_gateway_integration.patients_status_options.id,
       aws_api_gateway_integration.user_profile_options.id,
       # Force redeploy
       timestamp(),
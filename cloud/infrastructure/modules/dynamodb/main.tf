@@ -85,6 +85,11 @@ resource "aws_dynamodb_table" "bpm_measurements" {
 
 # DynamoDB Table - User State (Current Status)
 
+# Schema Design:
+# - Partition Key: user_id (String)
+# - Sort Key: state_key (String) - Kind of state item, e.g. "alert",
+#   "latest", "rollup#hour#2024-01-31T10"
+
 
 resource "aws_dynamodb_table" "user_state" {
   name         = "${var.name_prefix}-user-state"
@@ -94,13 +99,19 @@ resource "aws_dynamodb_table" "user_state" {
   write_capacity = var.billing_mode == "PROVISIONED" ? var.write_capacity : null
 
   # Primary key
-  hash_key = "user_id"
+  hash_key  = "user_id"
+  range_key = "state_key"
 
   attribute {
     name = "user_id"
     type = "S"
   }
 
+  attribute {
+    name = "state_key"
+    type = "S"
+  }
+
   # Point-in-time recovery
   point_in_time_recovery {
     enabled = true
@@ -111,6 +122,12 @@ resource "aws_dynamodb_table" "user_state" {
     enabled = true
   }
 
+  # TTL for short-lived state items (e.g. minute rollups)
+  ttl {
+    attribute_name = "ttl"
+    enabled        = true
+  }
+
   tags = merge(var.tags, {
     Name = "${var.name_prefix}-user-state"
   })
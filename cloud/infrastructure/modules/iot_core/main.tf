@@ -76,8 +76,21 @@ resource "aws_iot_topic_rule" "bpm_measurements" {
   sql         = "SELECT * FROM 'bpm/+/+/measurements'"
   sql_version = "2016-03-23"
 
-  lambda {
-    function_arn = var.lambda_function_arn
+  dynamic "lambda" {
+    for_each = var.ingest_queue_enabled ? [] : [1]
+    content {
+      function_arn = var.lambda_function_arn
+    }
+  }
+
+  # With the ingest queue the Lambda consumes batches of messages
+  dynamic "sqs" {
+    for_each = var.ingest_queue_enabled ? [1] : []
+    content {
+      queue_url  = var.ingest_queue_url
+      role_arn   = aws_iam_role.iot_rule_role.arn
+      use_base64 = true
+    }
   }
 
   # Error action - log to CloudWatch
@@ -137,6 +150,24 @@ resource "aws_iam_role_policy" "iot_rule_lambda" {
   })
 }
 
+resource "aws_iam_role_policy" "iot_rule_sqs" {
+  count = var.ingest_queue_enabled ? 1 : 0
+
+  name = "${var.name_prefix}-iot-sqs-policy"
+  role = aws_iam_role.iot_rule_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = "sqs:SendMessage"
+        Resource = var.ingest_queue_arn
+      }
+    ]
+  })
+}
+
 resource "aws_iam_role_policy" "iot_rule_logs" {
   name = "${var.name_prefix}-iot-logs-policy"
   role = aws_iam_role.iot_rule_role.id
@@ -10,6 +10,24 @@ variable "lambda_function_arn" {
   type        = string
 }
 
+variable "ingest_queue_enabled" {
+  description = "Send measurements to the ingest queue instead of invoking the Lambda directly"
+  type        = bool
+  default     = false
+}
+
+variable "ingest_queue_url" {
+  description = "URL of the ingest queue (when enabled)"
+  type        = string
+  default     = null
+}
+
+variable "ingest_queue_arn" {
+  description = "ARN of the ingest queue (when enabled)"
+  type        = string
+  default     = null
+}
+
 variable "tags" {
   description = "Tags to apply to resources"
   type        = map(string)
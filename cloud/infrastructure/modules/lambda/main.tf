@@ -67,7 +67,9 @@ resource "aws_iam_role_policy" "lambda_dynamodb" {
         ]
         Resource = [
           var.dynamodb_table_arn,
-          "${var.dynamodb_table_arn}/index/*"
+          "${var.dynamodb_table_arn}/index/*",
+          var.user_state_table_arn,
+          var.devices_table_arn
         ]
       }
     ]
@@ -88,7 +90,9 @@ resource "aws_iam_role_policy" "lambda_s3" {
         Action = [
           "s3:PutObject",
           "s3:GetObject",
-          "s3:ListBucket"
+          "s3:DeleteObject",
+          "s3:ListBucket",
+          "s3:AbortMultipartUpload"
         ]
         Resource = [
           var.s3_bucket_arn,
@@ -128,6 +132,16 @@ data "archive_file" "bpm_processor" {
     content  = file("${path.module}/src/bpm_processor.py")
     filename = "bpm_processor.py"
   }
+
+  source {
+    content  = file("${path.module}/src/measurement_layout.py")
+    filename = "measurement_layout.py"
+  }
+
+  source {
+    content  = file("${path.module}/src/aws_clients.py")
+    filename = "aws_clients.py"
+  }
 }
 
 resource "aws_lambda_function" "bpm_processor" {
@@ -146,13 +160,24 @@ resource "aws_lambda_function" "bpm_processor" {
 
   environment {
     variables = {
-      DYNAMODB_TABLE_NAME = var.dynamodb_table_name
-      S3_BUCKET_NAME      = var.s3_bucket_name
-      SNS_TOPIC_ARN       = var.sns_topic_arn
-      BPM_CRITICAL_LOW    = tostring(var.bpm_critical_low)
-      BPM_WARNING_LOW     = tostring(var.bpm_warning_low)
-      BPM_WARNING_HIGH    = tostring(var.bpm_warning_high)
-      BPM_CRITICAL_HIGH   = tostring(var.bpm_critical_high)
+      DYNAMODB_TABLE_NAME             = var.dynamodb_table_name
+      USER_STATE_TABLE_NAME           = var.user_state_table_name
+      DEVICES_TABLE_NAME              = var.devices_table_name
+      S3_BUCKET_NAME                  = var.s3_bucket_name
+      SNS_TOPIC_ARN                   = var.sns_topic_arn
+      BPM_CRITICAL_LOW                = tostring(var.bpm_critical_low)
+      BPM_WARNING_LOW                 = tostring(var.bpm_warning_low)
+      BPM_WARNING_HIGH                = tostring(var.bpm_warning_high)
+      BPM_CRITICAL_HIGH               = tostring(var.bpm_critical_high)
+      ALERT_RENOTIFY_WARNING_SECONDS  = tostring(var.alert_renotify_warning_seconds)
+      ALERT_RENOTIFY_CRITICAL_SECONDS = tostring(var.alert_renotify_critical_seconds)
+      ALERT_NOTIFY_RECOVERY           = tostring(var.alert_notify_recovery)
+      SINK_MAX_WORKERS                = tostring(var.processor_sink_workers)
+      MEASUREMENT_LAYOUT              = var.measurement_layout
+      MEASUREMENT_BUCKET_SECONDS      = tostring(var.measurement_bucket_seconds)
+      LOG_LEVEL                       = var.log_level
+      EVENT_LOG_SAMPLE_RATE           = tostring(var.event_log_sample_rate)
+      METRICS_NAMESPACE               = var.metrics_namespace
     }
   }
 
@@ -173,6 +198,37 @@ resource "aws_cloudwatch_log_group" "bpm_processor" {
   tags = var.tags
 }
 
+# CloudWatch Dashboard - End-to-end latency
+# Percentiles of the per-stage latencies bpm_processor writes as embedded metrics
+
+resource "aws_cloudwatch_dashboard" "latency" {
+  dashboard_name = "${var.name_prefix}-latency"
+
+  dashboard_body = jsonencode({
+    widgets = [
+      for index, metric in ["SensorToFogLatency", "FogToLambdaLatency", "LambdaToStoreLatency", "LambdaToAlertLatency"] : {
+        type   = "metric"
+        x      = (index % 2) * 12
+        y      = floor(index / 2) * 6
+        width  = 12
+        height = 6
+        properties = {
+          title  = metric
+          region = data.aws_region.current.name
+          period = 300
+          view   = "timeSeries"
+          metrics = [
+            for stat in ["p50", "p90", "p99"] : [
+              var.metrics_namespace, metric, "FunctionName", aws_lambda_function.bpm_processor.function_name,
+              { stat = stat, label = stat }
+            ]
+          ]
+        }
+      }
+    ]
+  })
+}
+
 # Lambda Function - API Handler
 # This function handles REST API requests via API Gateway
 
@@ -184,6 +240,32 @@ data "archive_file" "api_handler" {
     content  = file("${path.module}/src/api_handler.py")
     filename = "api_handler.py"
   }
+
+  source {
+    content  = file("${path.module}/src/downsampling.py")
+    filename = "downsampling.py"
+  }
+
+  source {
+    content  = file("${path.module}/src/measurement_layout.py")
+    filename = "measurement_layout.py"
+  }
+
+  source {
+    content  = file("${path.module}/src/aws_clients.py")
+    filename = "aws_clients.py"
+  }
+
+  # Archive readers used by bulk exports
+  source {
+    content  = file("${path.module}/src/archive_query.py")
+    filename = "archive_query.py"
+  }
+
+  source {
+    content  = file("${path.module}/src/archive_compactor.py")
+    filename = "archive_compactor.py"
+  }
 }
 
 resource "aws_lambda_function" "api_handler" {
@@ -196,14 +278,35 @@ resource "aws_lambda_function" "api_handler" {
   handler = "api_handler.lambda_handler"
   runtime = var.runtime
 
+  # NumPy for chart downsampling (/bpm/history?points=N)
+  layers = var.numpy_layer_arn != "" ? [var.numpy_layer_arn] : []
+
   role        = aws_iam_role.lambda_execution.arn
   memory_size = var.memory_size
   timeout     = var.timeout
 
   environment {
     variables = {
-      DYNAMODB_TABLE_NAME = var.dynamodb_table_name
-      S3_BUCKET_NAME      = var.s3_bucket_name
+      DYNAMODB_TABLE_NAME        = var.dynamodb_table_name
+      USER_STATE_TABLE_NAME      = var.user_state_table_name
+      DEVICES_TABLE_NAME         = var.devices_table_name
+      S3_BUCKET_NAME             = var.s3_bucket_name
+      CACHE_TTL_CURRENT          = tostring(var.api_cache_ttl_current)
+      CACHE_TTL_STATISTICS       = tostring(var.api_cache_ttl_statistics)
+      CACHE_TTL_DEVICES          = tostring(var.api_cache_ttl_devices)
+      CACHE_STALE_SECONDS        = tostring(var.api_cache_stale_seconds)
+      EXPORT_FUNCTION_NAME       = aws_lambda_function.exporter.function_name
+      EXPORT_MAX_DAYS            = tostring(var.export_max_days)
+      EXPORT_URL_EXPIRES_SECONDS = tostring(var.export_url_expires_seconds)
+      ARCHIVE_QUERY_WORKERS      = tostring(var.archive_query_workers)
+      ARCHIVE_STATS_MAX_DAYS     = tostring(var.archive_stats_max_days)
+      PATIENT_BATCH_MAX          = tostring(var.patient_batch_max)
+      PATIENT_BATCH_CONCURRENCY  = tostring(var.patient_batch_concurrency)
+      LONG_POLL_MAX_SECONDS      = tostring(var.long_poll_max_seconds)
+      MEASUREMENT_LAYOUT         = var.measurement_layout
+      MEASUREMENT_BUCKET_SECONDS = tostring(var.measurement_bucket_seconds)
+      LOG_LEVEL                  = var.log_level
+      EVENT_LOG_SAMPLE_RATE      = tostring(var.event_log_sample_rate)
     }
   }
 
@@ -224,6 +327,258 @@ resource "aws_cloudwatch_log_group" "api_handler" {
   tags = var.tags
 }
 
+# Lambda Function - Exporter
+# Runs bulk exports started by POST /bpm/export (same package as the API handler)
+
+resource "aws_lambda_function" "exporter" {
+  function_name = "${var.name_prefix}-exporter"
+  description   = "Streams BPM exports to S3"
+
+  filename         = data.archive_file.api_handler.output_path
+  source_code_hash = data.archive_file.api_handler.output_base64sha256
+
+  handler = "api_handler.export_handler"
+  runtime = var.runtime
+
+  role        = aws_iam_role.lambda_execution.arn
+  memory_size = var.export_memory_size
+  timeout     = var.export_timeout
+
+  environment {
+    variables = {
+      DYNAMODB_TABLE_NAME        = var.dynamodb_table_name
+      S3_BUCKET_NAME             = var.s3_bucket_name
+      ARCHIVE_QUERY_WORKERS      = tostring(var.archive_query_workers)
+      MEASUREMENT_LAYOUT         = var.measurement_layout
+      MEASUREMENT_BUCKET_SECONDS = tostring(var.measurement_bucket_seconds)
+    }
+  }
+
+  tracing_config {
+    mode = "Active"
+  }
+
+  tags = merge(var.tags, {
+    Name = "${var.name_prefix}-exporter"
+  })
+}
+
+# CloudWatch Log Group for Exporter
+resource "aws_cloudwatch_log_group" "exporter" {
+  name              = "/aws/lambda/${aws_lambda_function.exporter.function_name}"
+  retention_in_days = 30
+
+  tags = var.tags
+}
+
+# IAM Policy - Start exports from the API handler
+
+resource "aws_iam_role_policy" "lambda_invoke_exporter" {
+  name = "${var.name_prefix}-lambda-invoke-exporter-policy"
+  role = aws_iam_role.lambda_execution.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = "lambda:InvokeFunction"
+        Resource = aws_lambda_function.exporter.arn
+      }
+    ]
+  })
+}
+
+# Lambda Function - Archive Compactor
+# This function compacts the per-reading S3 archive into daily files
+
+data "archive_file" "archive_compactor" {
+  type        = "zip"
+  output_path = "${path.module}/files/archive_compactor.zip"
+
+  source {
+    content  = file("${path.module}/src/archive_compactor.py")
+    filename = "archive_compactor.py"
+  }
+}
+
+resource "aws_lambda_function" "archive_compactor" {
+  function_name = "${var.name_prefix}-archive-compactor"
+  description   = "Compacts archived BPM readings into daily indexed files"
+
+  filename         = data.archive_file.archive_compactor.output_path
+  source_code_hash = data.archive_file.archive_compactor.output_base64sha256
+
+  handler = "archive_compactor.lambda_handler"
+  runtime = var.runtime
+
+  role        = aws_iam_role.lambda_execution.arn
+  memory_size = var.compaction_memory_size
+  timeout     = var.compaction_timeout
+
+  environment {
+    variables = {
+      S3_BUCKET_NAME            = var.s3_bucket_name
+      COMPACTION_SETTLE_HOURS   = tostring(var.compaction_settle_hours)
+      COMPACTION_DELETE_SOURCES = tostring(var.compaction_delete_sources)
+      COMPACTION_LATE_DAYS      = tostring(var.compaction_late_days)
+      COMPACTION_FETCH_WORKERS  = tostring(var.compaction_fetch_workers)
+    }
+  }
+
+  tracing_config {
+    mode = "Active"
+  }
+
+  tags = merge(var.tags, {
+    Name = "${var.name_prefix}-archive-compactor"
+  })
+}
+
+# CloudWatch Log Group for Archive Compactor
+resource "aws_cloudwatch_log_group" "archive_compactor" {
+  name              = "/aws/lambda/${aws_lambda_function.archive_compactor.function_name}"
+  retention_in_days = 30
+
+  tags = var.tags
+}
+
+# Daily schedule for Archive Compactor
+
+resource "aws_cloudwatch_event_rule" "archive_compactor" {
+  name                = "${var.name_prefix}-archive-compactor"
+  description         = "Runs the archive compactor once a day"
+  schedule_expression = var.compaction_schedule
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "archive_compactor" {
+  rule = aws_cloudwatch_event_rule.archive_compactor.name
+  arn  = aws_lambda_function.archive_compactor.arn
+}
+
+resource "aws_lambda_permission" "events_invoke_compactor" {
+  statement_id  = "AllowEventBridgeInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.archive_compactor.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.archive_compactor.arn
+}
+
+# Lambda Function - Daily Analytics
+# Writes the daily report of every user (served by GET /bpm/report); needs NumPy
+
+data "archive_file" "daily_analytics" {
+  type        = "zip"
+  output_path = "${path.module}/files/daily_analytics.zip"
+
+  source {
+    content  = file("${path.module}/src/daily_analytics.py")
+    filename = "daily_analytics.py"
+  }
+
+  source {
+    content  = file("${path.module}/src/downsampling.py")
+    filename = "downsampling.py"
+  }
+
+  source {
+    content  = file("${path.module}/src/aws_clients.py")
+    filename = "aws_clients.py"
+  }
+
+  source {
+    content  = file("${path.module}/src/archive_query.py")
+    filename = "archive_query.py"
+  }
+
+  source {
+    content  = file("${path.module}/src/archive_compactor.py")
+    filename = "archive_compactor.py"
+  }
+}
+
+resource "aws_lambda_function" "daily_analytics" {
+  count = var.numpy_layer_arn != "" ? 1 : 0
+
+  function_name = "${var.name_prefix}-daily-analytics"
+  description   = "Computes the daily BPM report of every user"
+
+  filename         = data.archive_file.daily_analytics.output_path
+  source_code_hash = data.archive_file.daily_analytics.output_base64sha256
+
+  handler = "daily_analytics.lambda_handler"
+  runtime = var.runtime
+
+  layers = [var.numpy_layer_arn]
+
+  role        = aws_iam_role.lambda_execution.arn
+  memory_size = var.analytics_memory_size
+  timeout     = var.analytics_timeout
+
+  environment {
+    variables = {
+      USER_STATE_TABLE_NAME         = var.user_state_table_name
+      DEVICES_TABLE_NAME            = var.devices_table_name
+      S3_BUCKET_NAME                = var.s3_bucket_name
+      BPM_CRITICAL_LOW              = tostring(var.bpm_critical_low)
+      BPM_WARNING_LOW               = tostring(var.bpm_warning_low)
+      BPM_WARNING_HIGH              = tostring(var.bpm_warning_high)
+      BPM_CRITICAL_HIGH             = tostring(var.bpm_critical_high)
+      ANALYTICS_EPISODE_MIN_MINUTES = tostring(var.analytics_episode_min_minutes)
+      LOG_LEVEL                     = var.log_level
+    }
+  }
+
+  tracing_config {
+    mode = "Active"
+  }
+
+  tags = merge(var.tags, {
+    Name = "${var.name_prefix}-daily-analytics"
+  })
+}
+
+# CloudWatch Log Group for Daily Analytics
+resource "aws_cloudwatch_log_group" "daily_analytics" {
+  count = var.numpy_layer_arn != "" ? 1 : 0
+
+  name              = "/aws/lambda/${aws_lambda_function.daily_analytics[0].function_name}"
+  retention_in_days = 30
+
+  tags = var.tags
+}
+
+# Daily schedule for Daily Analytics (reports on the previous UTC day)
+
+resource "aws_cloudwatch_event_rule" "daily_analytics" {
+  count = var.numpy_layer_arn != "" ? 1 : 0
+
+  name                = "${var.name_prefix}-daily-analytics"
+  description         = "Generates the daily BPM reports once a day"
+  schedule_expression = var.analytics_schedule
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "daily_analytics" {
+  count = var.numpy_layer_arn != "" ? 1 : 0
+
+  rule = aws_cloudwatch_event_rule.daily_analytics[0].name
+  arn  = aws_lambda_function.daily_analytics[0].arn
+}
+
+resource "aws_lambda_permission" "events_invoke_analytics" {
+  count = var.numpy_layer_arn != "" ? 1 : 0
+
+  statement_id  = "AllowEventBridgeInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.daily_analytics[0].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.daily_analytics[0].arn
+}
+
 # Lambda Permission for IoT Core
 
 resource "aws_lambda_permission" "iot_invoke" {
@@ -233,6 +588,70 @@ resource "aws_lambda_permission" "iot_invoke" {
   principal     = "iot.amazonaws.com"
 }
 
+# Ingest Queue (optional buffer between IoT Core and the processor)
+
+resource "aws_sqs_queue" "ingest_dlq" {
+  count = var.ingest_queue_enabled ? 1 : 0
+
+  name                      = "${var.name_prefix}-ingest-dlq"
+  message_retention_seconds = 1209600
+
+  tags = var.tags
+}
+
+resource "aws_sqs_queue" "ingest" {
+  count = var.ingest_queue_enabled ? 1 : 0
+
+  name = "${var.name_prefix}-ingest"
+  # At least six times the function timeout, as recommended for Lambda consumers
+  visibility_timeout_seconds = var.timeout * 6 + var.ingest_batching_window_seconds
+  message_retention_seconds  = 345600
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.ingest_dlq[0].arn
+    maxReceiveCount     = var.ingest_max_receive_count
+  })
+
+  tags = var.tags
+}
+
+resource "aws_lambda_event_source_mapping" "ingest" {
+  count = var.ingest_queue_enabled ? 1 : 0
+
+  event_source_arn                   = aws_sqs_queue.ingest[0].arn
+  function_name                      = aws_lambda_function.bpm_processor.arn
+  batch_size                         = var.ingest_batch_size
+  maximum_batching_window_in_seconds = var.ingest_batching_window_seconds
+
+  # Only the records listed in batchItemFailures are retried
+  function_response_types = ["ReportBatchItemFailures"]
+
+  depends_on = [aws_iam_role_policy.lambda_sqs]
+}
+
+resource "aws_iam_role_policy" "lambda_sqs" {
+  count = var.ingest_queue_enabled ? 1 : 0
+
+  name = "${var.name_prefix}-lambda-sqs-policy"
+  role = aws_iam_role.lambda_execution.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes",
+          "sqs:ChangeMessageVisibility"
+        ]
+        Resource = aws_sqs_queue.ingest[0].arn
+      }
+    ]
+  })
+}
+
 # Lambda Permission for X-Ray
 
 resource "aws_iam_role_policy" "lambda_xray" {
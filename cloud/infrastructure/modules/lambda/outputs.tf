@@ -18,7 +18,32 @@ output "api_handler_function_name" {
   value       = aws_lambda_function.api_handler.function_name
 }
 
+output "archive_compactor_function_name" {
+  description = "Archive Compactor Lambda function name"
+  value       = aws_lambda_function.archive_compactor.function_name
+}
+
+output "daily_analytics_function_name" {
+  description = "Daily Analytics Lambda function name (null without the NumPy layer)"
+  value       = var.numpy_layer_arn != "" ? aws_lambda_function.daily_analytics[0].function_name : null
+}
+
+output "exporter_function_name" {
+  description = "Exporter Lambda function name"
+  value       = aws_lambda_function.exporter.function_name
+}
+
 output "lambda_execution_role_arn" {
   description = "Lambda execution role ARN"
   value       = aws_iam_role.lambda_execution.arn
 }
+
+output "ingest_queue_url" {
+  description = "URL of the ingest queue (null when disabled)"
+  value       = var.ingest_queue_enabled ? aws_sqs_queue.ingest[0].url : null
+}
+
+output "ingest_queue_arn" {
+  description = "ARN of the ingest queue (null when disabled)"
+  value       = var.ingest_queue_enabled ? aws_sqs_queue.ingest[0].arn : null
+}
@@ -9,26 +9,135 @@ This function:
 4. Enforces role-based access control
 """
 
+import base64
+import csv
+import gzip
+import hashlib
+import io
 import json
 import os
+import random
+import time
 import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from decimal import Decimal
-import boto3
 from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
+from aws_clients import get_client, get_resource, get_table
+from archive_query import iter_archive_range, archive_statistics, record_key
+from measurement_layout import (
+    PACKED_ATTRIBUTES,
+    floor_sort_key,
+    is_packed,
+    packed_layout_enabled,
+    parse_timestamp,
+    unpack_item
+)
 
 # Configure logging
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+# Fraction of requests whose full event is logged at INFO level (with
+# LOG_LEVEL=DEBUG every event is)
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get('EVENT_LOG_SAMPLE_RATE', 0))
 
-# Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.client('s3')
+# AWS clients are created on first use (aws_clients), so routes that only
+# read the token or the response cache never build one
 
 # Environment variables
 DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
+USER_STATE_TABLE_NAME = os.environ.get('USER_STATE_TABLE_NAME')
+DEVICES_TABLE_NAME = os.environ.get('DEVICES_TABLE_NAME')
 S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+EXPORT_FUNCTION_NAME = os.environ.get('EXPORT_FUNCTION_NAME')
+
+# Latest-reading and alert items maintained by bpm_processor in the user state table
+LATEST_STATE_KEY = 'latest'
+ALERT_STATE_KEY = 'alert'
+DATA_VERSION_STATE_KEY = 'version'
+# Daily report items written by daily_analytics (report#YYYY-MM-DD)
+REPORT_KEY_PREFIX = 'report#'
+BATCH_GET_MAX_KEYS = 100
+# Unprocessed keys (throttling) are retried with full jitter backoff
+BATCH_GET_MAX_ATTEMPTS = 5
+BATCH_GET_BACKOFF_SECONDS = 0.05
+BATCH_GET_BACKOFF_MAX_SECONDS = 1.0
+HISTORY_MAX_LIMIT = 1000
+# Queries one history page may issue to fill itself (Limit counts items before
+# the device-index filter, so a page of the GSI can come back short or empty)
+HISTORY_MAX_QUERIES_PER_PAGE = 10
+DOWNSAMPLE_MAX_POINTS = 5000
+# Upper bound for the device part of the timestamp#device_id sort key
+SORT_KEY_MAX_SUFFIX = '#\uffff'
+
+# Long polling of /bpm/current?since=...: the latest item is read every
+# interval until a newer reading exists or the wait ends (kept below the
+# 29 s API Gateway limit)
+LONG_POLL_MAX_SECONDS = int(os.environ.get('LONG_POLL_MAX_SECONDS', 20))
+LONG_POLL_INTERVAL_SECONDS = float(os.environ.get('LONG_POLL_INTERVAL_SECONDS', 1))
+
+# Multi-patient status (clinician roles only)
+CLINICIAN_GROUPS = {'doctors', 'administrators'}
+CLINICIAN_ROLES = {'doctor', 'admin', 'administrator'}
+PATIENT_BATCH_MAX = int(os.environ.get('PATIENT_BATCH_MAX', 200))
+PATIENT_BATCH_CONCURRENCY = int(os.environ.get('PATIENT_BATCH_CONCURRENCY', 16))
+PATIENT_WINDOW_MAX_MINUTES = 24 * 60
+# Ward view order: most severe first, patients without data last
+STATUS_SORT_ORDER = {'critical': 0, 'warning': 1, 'normal': 2}
+
+# Rollups maintained by bpm_processor: sort key format and bucket length
+ROLLUP_GRANULARITIES = {
+    'minute': ('%Y-%m-%dT%H:%M', timedelta(minutes=1)),
+    'hour': ('%Y-%m-%dT%H', timedelta(hours=1)),
+    'day': ('%Y-%m-%d', timedelta(days=1))
+}
+STATISTICS_PERIODS = {
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+    'month': timedelta(days=30)
+}
+
+# Columnar history format: status names by their code
+STATUS_CODES = ['normal', 'warning', 'critical']
+STATUS_CODE_BY_NAME = {name: code for code, name in enumerate(STATUS_CODES)}
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', 1024))
+
+# Response cache: per-route TTLs in seconds (routes not listed are not cached)
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+CACHE_TTL_SECONDS = {
+    '/bpm/current': int(os.environ.get('CACHE_TTL_CURRENT', 5)),
+    '/bpm/statistics': int(os.environ.get('CACHE_TTL_STATISTICS', 30)),
+    '/devices': int(os.environ.get('CACHE_TTL_DEVICES', 60))
+}
+# Extra seconds an expired entry may be served while it is refreshed (0 disables)
+CACHE_STALE_SECONDS = int(os.environ.get('CACHE_STALE_SECONDS', 0))
+# Cache shared between containers, consulted on local misses ('' disables,
+# 'memory' selects the in-process stand-in used for tests and local runs)
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', '')
+
+# Bulk exports: written under exports/user_id/export_id/ in the archive bucket
+EXPORT_PREFIX = 'exports/'
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv')
+}
+EXPORT_COLUMNS = ['timestamp', 'device_id', 'bpm', 'status', 'severity']
+EXPORT_MAX_DAYS = int(os.environ.get('EXPORT_MAX_DAYS', 366))
+EXPORT_URL_EXPIRES_SECONDS = int(os.environ.get('EXPORT_URL_EXPIRES_SECONDS', 3600))
+# Multipart parts must be at least 5 MB (except the last one)
+EXPORT_PART_BYTES = 8 * 1024 * 1024
+
+# DynamoDB expires readings 90 days after ingest; older ones are read
+# from the S3 archive (one day of margin for late expiry and clock skew)
+HOT_RETENTION = timedelta(days=89)
+ARCHIVE_QUERY_WORKERS = int(os.environ.get('ARCHIVE_QUERY_WORKERS', 8))
+# Longer statistics ranges read too many partitions for one request
+ARCHIVE_STATS_MAX_DAYS = int(os.environ.get('ARCHIVE_STATS_MAX_DAYS', 93))
 
 
 class DecimalEncoder(json.JSONEncoder):
@@ -56,15 +165,69 @@ def create_response(status_code: int, body: dict, headers: dict = None) -> dict:
         'headers': {
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-            'Access-Control-Allow-Methods': 'GET,POST,PUT,DELETE,OPTIONS'
+            'Access-Control-Allow-Headers': 'Content-Type,Authorization,If-None-Match',
+            'Access-Control-Allow-Methods': 'GET,POST,PUT,DELETE,OPTIONS',
+            'Access-Control-Expose-Headers': 'ETag,X-Cache'
         },
-        'body': json.dumps(body, cls=DecimalEncoder)
+        # 304 Not Modified responses carry no body
+        'body': '' if status_code == 304 else json.dumps(body, cls=DecimalEncoder)
     }
     
     if headers:
         response['headers'].update(headers)
+        if 'ETag' in headers:
+            # Let browsers keep the response and revalidate it every time
+            response['headers']['Cache-Control'] = 'private, no-cache'
+    
+    return response
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Check whether an Accept-Encoding header allows gzip.
+    
+    A coding with a malformed q value (e.g. gzip;q=abc) is treated as not
+    acceptable rather than failing the request.
+    """
+    for coding in (accept_encoding or '').split(','):
+        name, *params = coding.split(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    return False
+                return 0 < q <= 1
+        return True
+    return False
+
+
+def compress_response(response: dict, accept_encoding: str) -> dict:
+    """
+    Gzip a response body when the client accepts it and it is large enough.
+    
+    API Gateway returns the body as binary because the API declares
+    binary media types and the body is flagged as base64.
+    
+    Args:
+        response: Response from create_response
+        accept_encoding: Accept-Encoding request header
+        
+    Returns:
+        The response, compressed if applicable
+    """
+    body = response.get('body') or ''
+    if len(body) < GZIP_MIN_BYTES or not accepts_gzip(accept_encoding):
+        return response
     
+    compressed = gzip.compress(body.encode('utf-8'), compresslevel=5)
+    response['body'] = base64.b64encode(compressed).decode('ascii')
+    response['isBase64Encoded'] = True
+    response['headers']['Content-Encoding'] = 'gzip'
+    response['headers']['Vary'] = 'Accept-Encoding'
     return response
 
 
@@ -88,57 +251,554 @@ def get_user_from_context(event: dict) -> dict:
     }
 
 
+def is_clinician(user: dict) -> bool:
+    """Check whether a user may read other users' data (doctors, administrators)."""
+    return bool(CLINICIAN_GROUPS.intersection(user['groups'])) or user['role'] in CLINICIAN_ROLES
+
+
+class CacheBackend:
+    """
+    Interface of a cache shared between containers (e.g. Redis).
+    
+    Values are route results (JSON-compatible dicts that may hold Decimals).
+    """
+    
+    def get(self, key: str):
+        """Return the cached value or None."""
+        raise NotImplementedError
+    
+    def set(self, key: str, value: dict, ttl: int):
+        """Store a value for ttl seconds."""
+        raise NotImplementedError
+    
+    def delete_prefix(self, prefix: str):
+        """Delete every key starting with prefix."""
+        raise NotImplementedError
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """Local stand-in for a shared cache backend, for tests and local runs."""
+    
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+    
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                self.entries.pop(key, None)
+                return None
+            return json.loads(entry[0])
+    
+    def set(self, key: str, value: dict, ttl: int):
+        with self.lock:
+            self.entries[key] = (json.dumps(value, cls=DecimalEncoder), time.time() + ttl)
+    
+    def delete_prefix(self, prefix: str):
+        with self.lock:
+            for key in [k for k in self.entries if k.startswith(prefix)]:
+                del self.entries[key]
+
+
+class ResponseCache:
+    """
+    Bounded per-container LRU cache of route results.
+    
+    Entries expire after the TTL of their route. With stale_seconds set,
+    an expired entry is still served for that long while a background
+    refresh runs (stale-while-revalidate). An optional shared backend is
+    consulted on local misses and filled on loads.
+    """
+    
+    def __init__(self, max_entries: int, stale_seconds: int = 0,
+                 backend: CacheBackend = None):
+        self.max_entries = max_entries
+        self.stale_seconds = stale_seconds
+        self.backend = backend
+        self.entries = OrderedDict()  # key -> (value, expires_at)
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.counters = {'hits': 0, 'stale_hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0}
+    
+    @staticmethod
+    def make_key(route: str, user_id: str, params: dict = None) -> str:
+        """Build a cache key from the user, route and route parameters."""
+        query = '&'.join(f"{k}={v}" for k, v in sorted((params or {}).items()) if v is not None)
+        return f"{user_id}|{route}|{query}"
+    
+    def get_or_load(self, key: str, ttl: int, loader):
+        """
+        Return a cached result, or load, cache and return it.
+        
+        Only successful results are cached.
+        
+        Args:
+            key: Cache key from make_key
+            ttl: Seconds the result stays fresh
+            loader: Callable returning the route result
+            
+        Returns:
+            Tuple of (result, cache status: HIT, STALE, SHARED or MISS)
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if now < expires_at:
+                    self.entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return value, 'HIT'
+                if now < expires_at + self.stale_seconds:
+                    self.entries.move_to_end(key)
+                    self.counters['stale_hits'] += 1
+                    self._refresh_in_background(key, ttl, loader)
+                    return value, 'STALE'
+        
+        if self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self._store(key, value, ttl)
+                with self.lock:
+                    self.counters['shared_hits'] += 1
+                return value, 'SHARED'
+        
+        with self.lock:
+            self.counters['misses'] += 1
+        value = self._load(key, ttl, loader)
+        return value, 'MISS'
+    
+    def invalidate(self, user_id: str, route: str = None):
+        """Drop the cached results of a user, optionally for one route only."""
+        prefix = f"{user_id}|{route}|" if route else f"{user_id}|"
+        with self.lock:
+            for key in [k for k in self.entries if k.startswith(prefix)]:
+                del self.entries[key]
+        if self.backend is not None:
+            self.backend.delete_prefix(prefix)
+    
+    def stats(self) -> dict:
+        """Return hit/miss counters and the number of entries."""
+        with self.lock:
+            return {**self.counters, 'entries': len(self.entries)}
+    
+    def _load(self, key: str, ttl: int, loader):
+        value = loader()
+        if value.get('success'):
+            self._store(key, value, ttl)
+            if self.backend is not None:
+                self.backend.set(key, value, ttl)
+        return value
+    
+    def _store(self, key: str, value: dict, ttl: int):
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+    
+    def _refresh_in_background(self, key: str, ttl: int, loader):
+        # Called with the lock held. The refresh may finish during a later
+        # invocation, since Lambda freezes the container between requests.
+        if key in self.refreshing:
+            return
+        self.refreshing.add(key)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache')
+        
+        def refresh():
+            try:
+                self._load(key, ttl, loader)
+            except Exception as e:
+                logger.error(f"Error refreshing cache entry {key}: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+        
+        self.executor.submit(refresh)
+
+
+CACHE_BACKENDS = {
+    'memory': InMemoryCacheBackend
+}
+
+
+def make_cache_backend(name: str) -> CacheBackend:
+    """
+    Create the shared cache backend selected by name.
+    
+    Args:
+        name: Key of CACHE_BACKENDS, or '' for no shared backend
+        
+    Returns:
+        The backend, or None
+    """
+    if not name:
+        return None
+    if name not in CACHE_BACKENDS:
+        raise ValueError(f"Unknown CACHE_BACKEND: {name} (expected one of {', '.join(CACHE_BACKENDS)})")
+    return CACHE_BACKENDS[name]()
+
+
+# Response cache shared by warm invocations of this container
+response_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_STALE_SECONDS, make_cache_backend(CACHE_BACKEND))
+
+
+def cached_route(route: str, user_id: str, params: dict, loader) -> tuple:
+    """
+    Serve a route result through the response cache.
+    
+    Args:
+        route: Route path (a key of CACHE_TTL_SECONDS)
+        user_id: User identifier
+        params: Route parameters that change the result
+        loader: Callable returning the route result
+        
+    Returns:
+        Tuple of (result, cache status)
+    """
+    key = ResponseCache.make_key(route, user_id, params)
+    return response_cache.get_or_load(key, CACHE_TTL_SECONDS[route], loader)
+
+
+def get_request_header(event: dict, name: str) -> str:
+    """Return a request header value, matching the name case-insensitively."""
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def make_etag(*parts) -> str:
+    """Build a strong ETag from the values that determine a response."""
+    raw = json.dumps(parts, separators=(',', ':'), cls=DecimalEncoder)
+    return '"' + hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag.
+    
+    Uses the weak comparison that RFC 9110 specifies for If-None-Match.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return any(tag.removeprefix('W/') == etag for tag in candidates)
+
+
+def get_data_version(user_id: str) -> str:
+    """
+    Get a cheap version marker of a user's stored readings.
+    
+    It is the ingest counter bpm_processor advances for every reading it
+    stores, read with a single projected GetItem. Late readings inside a
+    past range advance it too, so responses derived from the readings can
+    be validated against it without running their queries.
+    
+    Args:
+        user_id: User identifier
+        
+    Returns:
+        Version string, or None if it is not available
+    """
+    try:
+        table = get_table(USER_STATE_TABLE_NAME)
+        response = table.get_item(
+            Key={'user_id': user_id, 'state_key': DATA_VERSION_STATE_KEY},
+            ProjectionExpression='ingest_count'
+        )
+    except ClientError as e:
+        # Without a version the response is simply served without an ETag
+        logger.error(f"Error getting data version: {e}")
+        return None
+    
+    item = response.get('Item')
+    if not item:
+        return None
+    return str(item['ingest_count'])
+
+
+def encode_cursor(last_evaluated_key: dict) -> str:
+    """Encode a LastEvaluatedKey as an opaque continuation cursor."""
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, separators=(',', ':'), cls=DecimalEncoder)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str, user_id: str) -> dict:
+    """
+    Decode a continuation cursor into an ExclusiveStartKey.
+    
+    Args:
+        cursor: Cursor returned by a previous page
+        user_id: User the cursor must belong to
+        
+    Returns:
+        ExclusiveStartKey dict
+        
+    Raises:
+        ValueError: If the cursor is malformed or belongs to another user
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+    
+    if not isinstance(key, dict) or key.get('user_id') != user_id:
+        raise ValueError('Invalid cursor')
+    return key
+
+
+def iso_to_epoch_ms(timestamp: str) -> int:
+    """Convert an ISO 8601 timestamp to epoch milliseconds."""
+    return int(datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp() * 1000)
+
+
+def parse_iso(timestamp: str) -> datetime:
+    """
+    Parse an ISO 8601 query timestamp as a UTC datetime.
+    
+    Raises:
+        ValueError: If the timestamp is malformed
+    """
+    try:
+        parsed = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid timestamp: {timestamp}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def hot_cutoff(now: datetime = None) -> datetime:
+    """Return the oldest time still guaranteed to be in the measurements table."""
+    return (now or datetime.now(timezone.utc)) - HOT_RETENTION
+
+
+def to_columnar(items: list) -> dict:
+    """
+    Convert measurement items into parallel arrays.
+    
+    Timestamps become epoch milliseconds, statuses a code from STATUS_CODES
+    and devices an index into a device list. Numbers are converted in a
+    single flat pass instead of through the JSON encoder fallback.
+    
+    Args:
+        items: Measurement items with timestamp, bpm, status and device_id
+        
+    Returns:
+        Dict of columns
+    """
+    devices = {}
+    return {
+        'timestamps': [iso_to_epoch_ms(item['timestamp']) for item in items],
+        'bpm': [int(item['bpm']) for item in items],
+        'status': [STATUS_CODE_BY_NAME.get(item.get('status'), 0) for item in items],
+        'device': [devices.setdefault(item['device_id'], len(devices)) for item in items],
+        'devices': list(devices),
+        'status_codes': STATUS_CODES
+    }
+
+
+def history_key_condition(hash_key: str, hash_value: str,
+                          start_date: str = None, end_date: str = None):
+    """
+    Build a key condition on the timestamp#device_id sort key.
+    
+    Args:
+        hash_key: Partition key name (user_id or device_id)
+        hash_value: Partition key value
+        start_date: Optional inclusive start (ISO format)
+        end_date: Optional inclusive end (ISO format)
+        
+    Returns:
+        boto3 key condition
+    """
+    condition = Key(hash_key).eq(hash_value)
+    
+    if start_date and packed_layout_enabled():
+        # Include the bucket item the start falls in; readers trim it
+        start_date = floor_sort_key(start_date)
+    
+    if start_date and end_date:
+        return condition & Key('timestamp_device').between(start_date, end_date + SORT_KEY_MAX_SUFFIX)
+    if start_date:
+        return condition & Key('timestamp_device').gte(start_date)
+    if end_date:
+        return condition & Key('timestamp_device').lte(end_date + SORT_KEY_MAX_SUFFIX)
+    return condition
+
+
+def item_readings(item: dict, start: datetime = None, end: datetime = None) -> list:
+    """
+    Expand a measurement item into its readings within [start, end].
+    
+    Bucket items are unpacked; per-reading items are only checked against
+    the range when key conditions may have been widened to a bucket start.
+    
+    Args:
+        item: Measurement table item of either layout
+        start: Optional inclusive start
+        end: Optional inclusive end
+        
+    Returns:
+        Readings in time order
+    """
+    if not is_packed(item) and not packed_layout_enabled():
+        return [item]
+    
+    return [
+        reading for reading in unpack_item(item)
+        if (start is None or parse_timestamp(reading['timestamp']) >= start)
+        and (end is None or parse_timestamp(reading['timestamp']) <= end)
+    ]
+
+
 def get_bpm_history(user_id: str, device_id: str = None, 
                     start_date: str = None, end_date: str = None,
-                    limit: int = 100) -> dict:
+                    limit: int = 100, cursor: str = None,
+                    response_format: str = None) -> dict:
     """
     Get BPM history for a user.
     
+    Date ranges are part of the key condition, so only the requested items
+    are read. Device-scoped queries go to the device-index GSI, filtered to
+    the user; as DynamoDB applies Limit before the filter, the table is read
+    again from where it stopped until the page is full (up to
+    HISTORY_MAX_QUERIES_PER_PAGE queries). Readings
+    older than the table retention are served from the S3 archive: a range
+    that starts before it continues into the archive once the table part
+    is exhausted.
+    
     Args:
         user_id: User identifier
         device_id: Optional device filter
         start_date: Optional start date filter (ISO format)
         end_date: Optional end date filter (ISO format)
         limit: Maximum number of records to return
+        cursor: Optional continuation cursor from a previous page
+        response_format: 'columnar' for parallel arrays instead of items
         
     Returns:
-        Dict with measurements list
+        Dict with measurements list (or columns) and next_cursor (None on
+        the last page)
     """
+    cutoff = hot_cutoff()
+    start_key = decode_cursor(cursor, user_id) if cursor else None
+    
+    if start_key and 'archive_before' in start_key:
+        return get_archive_history(user_id, device_id, start_date, end_date, limit,
+                                   start_key['archive_before'], response_format)
+    if end_date and parse_iso(end_date) < cutoff:
+        return get_archive_history(user_id, device_id, start_date, end_date, limit,
+                                   None, response_format)
+    
+    # The part of the range older than the retention is read afterwards
+    reaches_archive = bool(start_date) and parse_iso(start_date) < cutoff
+    if reaches_archive:
+        start_date = cutoff.isoformat().replace('+00:00', 'Z')
+    
+    # A page can end inside a bucket item: resume from that item, skipping
+    # the readings already returned
+    key_end_date = end_date
+    skip = 0
+    if start_key and 'bucket_key' in start_key:
+        key_end_date = start_key['bucket_key']
+        skip = int(start_key.get('skip', 0))
+        start_key = None
+    
     try:
-        table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-        
-        # Build key condition
-        key_condition = Key('user_id').eq(user_id)
-        
-        # Build filter expression
-        filter_expression = None
-        if device_id:
-            filter_expression = Attr('device_id').eq(device_id)
-        
-        if start_date:
-            date_filter = Attr('timestamp').gte(start_date)
-            filter_expression = date_filter if not filter_expression else filter_expression & date_filter
-        
-        if end_date:
-            date_filter = Attr('timestamp').lte(end_date)
-            filter_expression = date_filter if not filter_expression else filter_expression & date_filter
+        table = get_table(DYNAMODB_TABLE_NAME)
+        limit = max(1, min(limit, HISTORY_MAX_LIMIT))
         
         # Query parameters
         query_params = {
-            'KeyConditionExpression': key_condition,
             'Limit': limit,
             'ScanIndexForward': False  # Newest first
         }
         
-        if filter_expression:
-            query_params['FilterExpression'] = filter_expression
+        if device_id:
+            query_params['IndexName'] = 'device-index'
+            query_params['KeyConditionExpression'] = history_key_condition(
+                'device_id', device_id, start_date, key_end_date
+            )
+            # The index is keyed by device; keep only the caller's items
+            query_params['FilterExpression'] = Attr('user_id').eq(user_id)
+        else:
+            query_params['KeyConditionExpression'] = history_key_condition(
+                'user_id', user_id, start_date, key_end_date
+            )
         
-        response = table.query(**query_params)
+        if start_key:
+            query_params['ExclusiveStartKey'] = start_key
+        
+        if response_format == 'columnar':
+            # Fetch only the attributes the columns (and cursor) need
+            query_params['ProjectionExpression'] = (
+                f"#ts, bpm, #status, device_id, timestamp_device, {PACKED_ATTRIBUTES}"
+            )
+            query_params['ExpressionAttributeNames'] = {'#ts': 'timestamp', '#status': 'status'}
+        
+        start = parse_iso(start_date) if start_date else None
+        end = parse_iso(end_date) if end_date else None
+        items = []
+        next_key = None
+        queries = 0
+        while True:
+            response = table.query(**query_params)
+            queries += 1
+            for item in response.get('Items', []):
+                readings = item_readings(item, start, end)[::-1][skip:]
+                room = limit - len(items)
+                items.extend(readings[:room])
+                if len(readings) > room:
+                    next_key = {
+                        'user_id': user_id,
+                        'bucket_key': item['timestamp_device'],
+                        'skip': skip + room
+                    }
+                    break
+                skip = 0
+            
+            if next_key is not None:
+                break
+            next_key = response.get('LastEvaluatedKey')
+            if not next_key or len(items) >= limit or queries >= HISTORY_MAX_QUERIES_PER_PAGE:
+                break
+            # Short page (filtered items, readings outside the range): read on
+            query_params['ExclusiveStartKey'] = next_key
+            next_key = None
+        
+        if next_key and next_key.get('user_id') != user_id:
+            # The device index stopped on another user's item: resume from its
+            # position (it is filtered out again) without exposing its key
+            next_key = {'user_id': user_id, 'bucket_key': next_key['timestamp_device'], 'skip': 0}
+        
+        if not next_key and reaches_archive:
+            next_key = {'user_id': user_id, 'archive_before': start_date}
+        
+        if response_format == 'columnar':
+            return {
+                'success': True,
+                'format': 'columnar',
+                **to_columnar(items),
+                'count': len(items),
+                'next_cursor': encode_cursor(next_key)
+            }
         
         return {
             'success': True,
-            'measurements': response.get('Items', []),
-            'count': len(response.get('Items', []))
+            'measurements': items,
+            'count': len(items),
+            'next_cursor': encode_cursor(next_key)
         }
         
     except ClientError as e:
@@ -149,144 +809,655 @@ def get_bpm_history(user_id: str, device_id: str = None,
         }
 
 
-def get_user_devices(user_id: str) -> dict:
+def get_archive_history(user_id: str, device_id: str, start_date: str, end_date: str,
+                        limit: int, before: str = None, response_format: str = None) -> dict:
     """
-    Get list of devices for a user.
+    Get a page of BPM history older than the table retention from S3.
     
     Args:
         user_id: User identifier
+        device_id: Optional device filter
+        start_date: Start date (ISO format, required for archived ranges)
+        end_date: Optional end date (ISO format)
+        limit: Maximum number of records to return
+        before: Optional 'timestamp#device_id' the page must end before
+        response_format: 'columnar' for parallel arrays instead of items
         
     Returns:
-        Dict with devices list
+        Dict with measurements list (or columns) and next_cursor
+        
+    Raises:
+        ValueError: If start_date is missing
     """
+    if not start_date:
+        raise ValueError('start_date is required for ranges older than the retention')
+    
+    start = parse_iso(start_date)
+    end = min(parse_iso(end_date) if end_date else datetime.now(timezone.utc),
+              hot_cutoff() - timedelta(microseconds=1))
+    before_key = None
+    if before:
+        before_ts, _, before_device = before.partition('#')
+        before_key = (parse_iso(before_ts), before_device)
+        end = min(end, before_key[0])
+    
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    items = []
+    
     try:
-        # Query devices table (would need to be created)
-        # For now, we'll extract unique devices from measurements
-        table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-        
-        response = table.query(
-            KeyConditionExpression=Key('user_id').eq(user_id),
-            ProjectionExpression='device_id',
-            Limit=1000
-        )
-        
-        # Extract unique device IDs
-        devices = list(set(item['device_id'] for item in response.get('Items', [])))
-        
-        return {
-            'success': True,
-            'devices': devices,
-            'count': len(devices)
-        }
+        readings = iter_archive_range(get_client('s3'), S3_BUCKET_NAME, user_id, start, end, device_id,
+                                      newest_first=True, max_workers=ARCHIVE_QUERY_WORKERS)
+        for measurement in readings:
+            if before_key and record_key(measurement) >= before_key:
+                continue
+            items.append(export_record(measurement))
+            if len(items) == limit:
+                break
+        readings.close()
         
     except ClientError as e:
-        logger.error(f"Error querying devices: {e}")
+        logger.error(f"Error reading S3 archive: {e}")
         return {
             'success': False,
             'error': str(e)
         }
+    
+    next_key = None
+    if len(items) == limit:
+        next_key = {
+            'user_id': user_id,
+            'archive_before': f"{items[-1]['timestamp']}#{items[-1]['device_id']}"
+        }
+    
+    if response_format == 'columnar':
+        return {
+            'success': True,
+            'format': 'columnar',
+            'source': 'archive',
+            **to_columnar(items),
+            'count': len(items),
+            'next_cursor': encode_cursor(next_key)
+        }
+    
+    return {
+        'success': True,
+        'source': 'archive',
+        'measurements': items,
+        'count': len(items),
+        'next_cursor': encode_cursor(next_key)
+    }
 
 
-def get_current_status(user_id: str) -> dict:
+def iter_history_pages(user_id: str, device_id: str = None,
+                       start_date: str = None, end_date: str = None,
+                       projection: str = None):
     """
-    Get the current BPM status for a user.
+    Stream the measurement pages of a range, oldest first.
     
     Args:
         user_id: User identifier
+        device_id: Optional device filter
+        start_date: Optional start date filter (ISO format)
+        end_date: Optional end date filter (ISO format)
+        projection: Optional ProjectionExpression (may use #ts and #status)
         
-    Returns:
-        Dict with current status
+    Yields:
+        Lists of readings, one per DynamoDB page (bucket items unpacked)
     """
-    try:
-        table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-        
-        # Get the most recent measurement
-        response = table.query(
-            KeyConditionExpression=Key('user_id').eq(user_id),
-            Limit=1,
-            ScanIndexForward=False  # Newest first
+    table = get_table(DYNAMODB_TABLE_NAME)
+    query_params = {'ScanIndexForward': True}
+    start = parse_iso(start_date) if start_date else None
+    end = parse_iso(end_date) if end_date else None
+    
+    if device_id:
+        query_params['IndexName'] = 'device-index'
+        query_params['KeyConditionExpression'] = history_key_condition(
+            'device_id', device_id, start_date, end_date
         )
-        
+        query_params['FilterExpression'] = Attr('user_id').eq(user_id)
+    else:
+        query_params['KeyConditionExpression'] = history_key_condition(
+            'user_id', user_id, start_date, end_date
+        )
+    
+    if projection:
+        query_params['ProjectionExpression'] = f"{projection}, {PACKED_ATTRIBUTES}"
+        query_params['ExpressionAttributeNames'] = {
+            name: attribute
+            for name, attribute in (('#ts', 'timestamp'), ('#status', 'status'))
+            if name in projection
+        }
+    
+    while True:
+        response = table.query(**query_params)
         items = response.get('Items', [])
+        readings = [reading for item in items for reading in item_readings(item, start, end)]
+        if any(is_packed(item) for item in items):
+            # Buckets of several devices share a start; interleave their readings
+            readings.sort(key=lambda r: parse_timestamp(r['timestamp']))
+        yield readings
+        if 'LastEvaluatedKey' not in response:
+            return
+        query_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def get_bpm_history_downsampled(user_id: str, points: int, device_id: str = None,
+                                start_date: str = None, end_date: str = None) -> dict:
+    """
+    Get a chart-sized BPM history for a range of any length.
+    
+    The range is streamed page by page into a MinMaxLTTB downsampler, so
+    memory and response size depend on `points` only. A min/max envelope
+    per time bucket is returned alongside the selected points.
+    
+    Args:
+        user_id: User identifier
+        points: Number of points to return
+        device_id: Optional device filter
+        start_date: Optional start (ISO format, defaults to 24 hours ago)
+        end_date: Optional end (ISO format, defaults to now)
         
-        if not items:
-            return {
-                'success': True,
-                'status': 'no_data',
-                'message': 'No measurements found'
-            }
+    Returns:
+        Dict with downsampled timestamps (epoch ms), bpm and envelope
+    """
+    try:
+        import downsampling  # NumPy is only loaded for chart queries
+    except ImportError as e:
+        logger.error(f"Downsampling unavailable: {e}")
+        return {
+            'success': False,
+            'error': 'Downsampling is not available'
+        }
+    
+    try:
+        now = datetime.now(timezone.utc)
+        end_date = end_date or now.isoformat().replace('+00:00', 'Z')
+        start_date = start_date or (now - timedelta(days=1)).isoformat().replace('+00:00', 'Z')
+        points = max(3, min(points, DOWNSAMPLE_MAX_POINTS))
         
-        latest = items[0]
+        pages = iter_history_pages(user_id, device_id, start_date, end_date, '#ts, bpm')
+        result = downsampling.downsample_pages(
+            pages, iso_to_epoch_ms(start_date), iso_to_epoch_ms(end_date), points
+        )
         
         return {
             'success': True,
-            'current_bpm': latest.get('bpm'),
-            'status': latest.get('status'),
-            'severity': latest.get('severity'),
-            'device_id': latest.get('device_id'),
-            'timestamp': latest.get('timestamp')
+            'format': 'downsampled',
+            'points': len(result['timestamps']),
+            **result,
+            'start_date': start_date,
+            'end_date': end_date
         }
         
     except ClientError as e:
-        logger.error(f"Error getting current status: {e}")
+        logger.error(f"Error querying DynamoDB: {e}")
         return {
             'success': False,
             'error': str(e)
         }
 
 
-def get_statistics(user_id: str, period: str = 'day') -> dict:
+def get_user_devices(user_id: str) -> dict:
     """
-    Get BPM statistics for a user.
+    Get list of devices for a user.
+    
+    Reads the devices table that bpm_processor keeps up to date on ingest.
     
     Args:
         user_id: User identifier
-        period: Time period (day, week, month)
         
     Returns:
-        Dict with statistics
+        Dict with device IDs and device details
     """
     try:
-        table = dynamodb.Table(DYNAMODB_TABLE_NAME)
+        table = get_table(DEVICES_TABLE_NAME)
         
-        # Calculate start date based on period
-        now = datetime.now(timezone.utc)
-        if period == 'day':
-            start_date = (now - timedelta(days=1)).isoformat()
-        elif period == 'week':
-            start_date = (now - timedelta(weeks=1)).isoformat()
-        elif period == 'month':
-            start_date = (now - timedelta(days=30)).isoformat()
-        else:
-            start_date = (now - timedelta(days=1)).isoformat()
-        
-        # Query measurements
-        response = table.query(
-            KeyConditionExpression=Key('user_id').eq(user_id),
-            FilterExpression=Attr('timestamp').gte(start_date)
-        )
+        query_params = {'KeyConditionExpression': Key('user_id').eq(user_id)}
+        items = []
+        while True:
+            response = table.query(**query_params)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
         
-        items = response.get('Items', [])
+        return {
+            'success': True,
+            'devices': [item['device_id'] for item in items],
+            'device_details': [
+                {
+                    'device_id': item['device_id'],
+                    'first_seen': item.get('first_seen'),
+                    'last_seen': item.get('last_seen'),
+                    'last_bpm': item.get('last_bpm'),
+                    'last_status': item.get('last_status')
+                }
+                for item in items
+            ],
+            'count': len(items)
+        }
+        
+    except ClientError as e:
+        logger.error(f"Error querying devices: {e}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+
+def latest_state_key(device_id: str = None) -> str:
+    """Return the user state sort key of the latest reading of a user or device."""
+    return f"{LATEST_STATE_KEY}#{device_id}" if device_id else LATEST_STATE_KEY
+
+
+def format_current_status(latest: dict) -> dict:
+    """
+    Format a latest-reading item as a current status response.
+    
+    Args:
+        latest: Latest-reading item, or None
+        
+    Returns:
+        Dict with current status
+    """
+    if not latest:
+        return {
+            'success': True,
+            'status': 'no_data',
+            'message': 'No measurements found'
+        }
+    
+    return {
+        'success': True,
+        'current_bpm': latest.get('bpm'),
+        'status': latest.get('status'),
+        'severity': latest.get('severity'),
+        'device_id': latest.get('device_id'),
+        'timestamp': latest.get('timestamp')
+    }
+
+
+def get_current_status(user_id: str, device_id: str = None) -> dict:
+    """
+    Get the current BPM status for a user.
+    
+    Reads the latest-reading item that bpm_processor maintains on ingest,
+    so the result is a single GetItem whatever the number of devices.
+    
+    Args:
+        user_id: User identifier
+        device_id: Optional device to get the latest reading of
+        
+    Returns:
+        Dict with current status
+    """
+    try:
+        table = get_table(USER_STATE_TABLE_NAME)
+        
+        response = table.get_item(
+            Key={'user_id': user_id, 'state_key': latest_state_key(device_id)}
+        )
+        
+        latest = response.get('Item')
+        if latest is None and device_id is None:
+            # Users without a latest item yet (data ingested before it existed)
+            latest = query_latest_measurement(user_id)
+        
+        return format_current_status(latest)
+        
+    except ClientError as e:
+        logger.error(f"Error getting current status: {e}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+
+def wait_for_current_status(user_id: str, since: str, wait: int,
+                            device_id: str = None) -> dict:
+    """
+    Long-poll the current BPM status until a reading newer than `since`.
+    
+    Only the latest-reading item is polled (one small GetItem per
+    interval), never the measurements table. The response is returned as
+    soon as a newer reading exists, or with changed=False once the wait
+    is over.
+    
+    Args:
+        user_id: User identifier
+        since: Timestamp of the newest reading the client already has
+        wait: Seconds to wait at most (capped at LONG_POLL_MAX_SECONDS)
+        device_id: Optional device to watch
         
-        if not items:
+    Returns:
+        Dict with current status and whether it changed since `since`
+    """
+    since_time = parse_iso(since)  # Malformed timestamps fail before holding the request
+    deadline = time.monotonic() + max(0, min(wait, LONG_POLL_MAX_SECONDS))
+    
+    try:
+        table = get_table(USER_STATE_TABLE_NAME)
+        key = {'user_id': user_id, 'state_key': latest_state_key(device_id)}
+        
+        while True:
+            latest = table.get_item(Key=key).get('Item')
+            changed = bool(latest) and parse_iso(latest['timestamp']) > since_time
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return {**format_current_status(latest), 'changed': changed}
+            time.sleep(min(LONG_POLL_INTERVAL_SECONDS, remaining))
+        
+    except ClientError as e:
+        logger.error(f"Error getting current status: {e}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+
+def query_latest_measurement(user_id: str) -> dict:
+    """
+    Get the most recent measurement of a user from the measurements table.
+    
+    Args:
+        user_id: User identifier
+        
+    Returns:
+        Measurement item, or None
+    """
+    table = get_table(DYNAMODB_TABLE_NAME)
+    
+    response = table.query(
+        KeyConditionExpression=Key('user_id').eq(user_id),
+        Limit=1,
+        ScanIndexForward=False  # Newest first
+    )
+    
+    items = response.get('Items', [])
+    return unpack_item(items[0])[-1] if items else None
+
+
+def batch_get_state_items(user_ids: list, state_keys: list) -> dict:
+    """
+    Read several state items of several users from the user state table.
+    
+    Uses BatchGetItem, 100 keys per request. Unprocessed keys are retried
+    up to BATCH_GET_MAX_ATTEMPTS times with exponential backoff and full
+    jitter, so a throttled table is not hammered by a tight loop.
+    
+    Args:
+        user_ids: User identifiers (without duplicates)
+        state_keys: State keys to read for every user
+        
+    Returns:
+        Tuple of (dict keyed by (user_id, state_key) with the items found,
+        set of (user_id, state_key) that could not be read)
+    """
+    keys = [
+        {'user_id': user_id, 'state_key': state_key}
+        for user_id in user_ids
+        for state_key in state_keys
+    ]
+    found = {}
+    unfetched = set()
+    
+    for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+        request = {USER_STATE_TABLE_NAME: {'Keys': keys[start:start + BATCH_GET_MAX_KEYS]}}
+        
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(random.uniform(0, min(BATCH_GET_BACKOFF_MAX_SECONDS,
+                                                 BATCH_GET_BACKOFF_SECONDS * 2 ** attempt)))
+            response = get_resource('dynamodb').batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(USER_STATE_TABLE_NAME, []):
+                found[(item['user_id'], item['state_key'])] = item
+            request = response.get('UnprocessedKeys')
+            if not request:
+                break
+        
+        if request:
+            logger.warning(f"{len(request[USER_STATE_TABLE_NAME]['Keys'])} state items left unread after "
+                           f"{BATCH_GET_MAX_ATTEMPTS} attempts")
+            unfetched.update((key['user_id'], key['state_key']) for key in request[USER_STATE_TABLE_NAME]['Keys'])
+    
+    return found, unfetched
+
+
+def get_current_status_batch(user_ids: list) -> dict:
+    """
+    Get the current BPM status of several users.
+    
+    Uses BatchGetItem on the latest-reading items. Users whose item could
+    not be read under throttling are listed as unavailable, not as no_data.
+    
+    Args:
+        user_ids: User identifiers
+        
+    Returns:
+        Dict with a statuses dict keyed by user_id and the unavailable users
+    """
+    try:
+        unique_ids = list(dict.fromkeys(user_ids))
+        found, unfetched = batch_get_state_items(unique_ids, [LATEST_STATE_KEY])
+        unavailable = [user_id for user_id in unique_ids if (user_id, LATEST_STATE_KEY) in unfetched]
+        
+        return {
+            'success': True,
+            'statuses': {
+                user_id: format_current_status(found.get((user_id, LATEST_STATE_KEY)))
+                for user_id in unique_ids
+                if user_id not in unavailable
+            },
+            'unavailable': unavailable,
+            'count': len(unique_ids)
+        }
+        
+    except ClientError as e:
+        logger.error(f"Error getting current status batch: {e}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+
+def floor_time(ts: datetime, granularity: str) -> datetime:
+    """Truncate a datetime to the start of its minute, hour or day."""
+    if granularity == 'minute':
+        return ts.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def ceil_time(ts: datetime, granularity: str) -> datetime:
+    """Round a datetime up to the next minute, hour or day boundary."""
+    floored = floor_time(ts, granularity)
+    return floored if floored == ts else floored + ROLLUP_GRANULARITIES[granularity][1]
+
+
+def plan_rollup_ranges(start: datetime, end: datetime) -> list:
+    """
+    Cover [start, end) with the fewest rollup ranges.
+    
+    Whole days use day rollups, the hours around them hour rollups and the
+    remaining edges minute rollups, so any period needs at most five
+    contiguous ranges.
+    
+    Args:
+        start: Inclusive start, aligned to a minute
+        end: Exclusive end, aligned to a minute
+        
+    Returns:
+        List of (granularity, range_start, range_end) tuples
+    """
+    ranges = []
+    
+    def add(granularity, range_start, range_end):
+        if range_start < range_end:
+            ranges.append((granularity, range_start, range_end))
+    
+    hour_start = min(ceil_time(start, 'hour'), end)
+    hour_end = max(floor_time(end, 'hour'), hour_start)
+    day_start = min(ceil_time(hour_start, 'day'), hour_end)
+    day_end = max(floor_time(hour_end, 'day'), day_start)
+    
+    add('minute', start, hour_start)
+    add('hour', hour_start, day_start)
+    add('day', day_start, day_end)
+    add('hour', day_end, hour_end)
+    add('minute', hour_end, end)
+    return ranges
+
+
+def query_rollups(table, user_id: str, granularity: str,
+                  range_start: datetime, range_end: datetime) -> list:
+    """
+    Query the rollup items of one granularity covering [range_start, range_end).
+    
+    Args:
+        table: User state table
+        user_id: User identifier
+        granularity: minute, hour or day
+        range_start: Inclusive start, aligned to the granularity
+        range_end: Exclusive end, aligned to the granularity
+        
+    Returns:
+        List of rollup items
+    """
+    key_format, step = ROLLUP_GRANULARITIES[granularity]
+    first_key = f"rollup#{granularity}#{range_start.strftime(key_format)}"
+    last_key = f"rollup#{granularity}#{(range_end - step).strftime(key_format)}"
+    
+    query_params = {
+        'KeyConditionExpression': Key('user_id').eq(user_id) & Key('state_key').between(first_key, last_key)
+    }
+    
+    items = []
+    while True:
+        response = table.query(**query_params)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        query_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def combine_rollups(items: list) -> dict:
+    """
+    Combine rollup items into one set of statistics.
+    
+    Args:
+        items: Rollup items
+        
+    Returns:
+        Dict with count, min/max/avg/std and histogram, or None if empty
+    """
+    count = 0
+    total = 0
+    total_sq = 0
+    values = set()
+    histogram = {}
+    
+    for item in items:
+        count += int(item.get('count', 0))
+        total += int(item.get('sum', 0))
+        total_sq += int(item.get('sum_sq', 0))
+        values.update(int(v) for v in item.get('bpm_values', ()))
+        for name, bucket_count in item.items():
+            if name.startswith('hist_'):
+                bucket = name[len('hist_'):]
+                histogram[bucket] = histogram.get(bucket, 0) + int(bucket_count)
+    
+    if count == 0:
+        return None
+    
+    mean = total / count
+    variance = max(total_sq / count - mean * mean, 0.0)
+    
+    return {
+        'count': count,
+        'min_bpm': min(values),
+        'max_bpm': max(values),
+        'avg_bpm': round(mean, 2),
+        'std_bpm': round(variance ** 0.5, 2),
+        'histogram': dict(sorted(histogram.items(), key=lambda kv: int(kv[0])))
+    }
+
+
+def rollup_statistics(table, user_id: str, start: datetime, end: datetime) -> dict:
+    """
+    Combine the rollups of a user covering a minute-aligned [start, end).
+    
+    Args:
+        table: User state table
+        user_id: User identifier
+        start: Inclusive start, aligned to a minute
+        end: Exclusive end, aligned to a minute
+        
+    Returns:
+        Statistics dict, or None if there is no reading in the window
+    """
+    items = []
+    for granularity, range_start, range_end in plan_rollup_ranges(start, end):
+        items.extend(query_rollups(table, user_id, granularity, range_start, range_end))
+    return combine_rollups(items)
+
+
+def statistics_window(period: str, now: datetime = None) -> tuple:
+    """
+    Get the minute-aligned [start, end) window of a statistics period.
+    
+    The current minute is still filling up and is included.
+    
+    Args:
+        period: Time period (day, week, month)
+        now: Current time (defaults to utcnow)
+        
+    Returns:
+        Tuple of (start, end) datetimes
+    """
+    now = now or datetime.now(timezone.utc)
+    end = floor_time(now, 'minute') + timedelta(minutes=1)
+    start = end - STATISTICS_PERIODS.get(period, STATISTICS_PERIODS['day'])
+    return start, end
+
+
+def get_statistics(user_id: str, period: str = 'day', now: datetime = None) -> dict:
+    """
+    Get BPM statistics for a user.
+    
+    Combines the minute/hour/day rollups maintained by bpm_processor, so
+    the cost is a handful of small queries whatever the number of readings.
+    
+    Args:
+        user_id: User identifier
+        period: Time period (day, week, month)
+        now: Current time (defaults to utcnow)
+        
+    Returns:
+        Dict with statistics
+    """
+    try:
+        table = get_table(USER_STATE_TABLE_NAME)
+        
+        # Calculate the window based on period
+        start, end = statistics_window(period, now)
+        start_date = start.isoformat()
+        
+        stats = rollup_statistics(table, user_id, start, end)
+        
+        if not stats:
             return {
                 'success': True,
                 'period': period,
                 'message': 'No data for the specified period'
             }
         
-        # Calculate statistics
-        bpm_values = [float(item['bpm']) for item in items]
-        
         return {
             'success': True,
             'period': period,
-            'count': len(bpm_values),
-            'min_bpm': min(bpm_values),
-            'max_bpm': max(bpm_values),
-            'avg_bpm': round(sum(bpm_values) / len(bpm_values), 2),
+            **stats,
             'start_date': start_date,
-            'end_date': now.isoformat()
+            'end_date': end.isoformat()
         }
         
     except ClientError as e:
@@ -297,6 +1468,490 @@ def get_statistics(user_id: str, period: str = 'day') -> dict:
         }
 
 
+def get_patients_status(user_ids: list, window_minutes: int = 60, now: datetime = None) -> dict:
+    """
+    Get the current status, alert state and recent statistics of patients.
+    
+    Latest-reading and alert items of all patients come from BatchGetItem;
+    the window statistics are combined from rollups for several patients
+    at a time, at most PATIENT_BATCH_CONCURRENCY in parallel. Patients whose
+    items could not be read under throttling get the status unavailable.
+    
+    Args:
+        user_ids: Patient user identifiers
+        window_minutes: Length of the statistics window
+        now: Current time (defaults to now)
+        
+    Returns:
+        Dict with patients sorted by severity (most severe first)
+        
+    Raises:
+        ValueError: If the patient list or window is invalid
+    """
+    if not isinstance(user_ids, list) or not all(isinstance(u, str) and u for u in user_ids):
+        raise ValueError('user_ids must be a list of user identifiers')
+    unique_ids = list(dict.fromkeys(user_ids))
+    if not unique_ids or len(unique_ids) > PATIENT_BATCH_MAX:
+        raise ValueError(f"Between 1 and {PATIENT_BATCH_MAX} patients per request")
+    if not 1 <= window_minutes <= PATIENT_WINDOW_MAX_MINUTES:
+        raise ValueError(f"window_minutes must be between 1 and {PATIENT_WINDOW_MAX_MINUTES}")
+    
+    now = now or datetime.now(timezone.utc)
+    end = floor_time(now, 'minute') + timedelta(minutes=1)
+    start = end - timedelta(minutes=window_minutes)
+    
+    try:
+        found, unfetched = batch_get_state_items(unique_ids, [LATEST_STATE_KEY, ALERT_STATE_KEY])
+        
+        table = get_table(USER_STATE_TABLE_NAME)
+        workers = min(PATIENT_BATCH_CONCURRENCY, len(unique_ids))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            windows = list(executor.map(
+                lambda user_id: rollup_statistics(table, user_id, start, end), unique_ids
+            ))
+        
+    except ClientError as e:
+        logger.error(f"Error getting patients status: {e}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
+    
+    patients = []
+    for user_id, window in zip(unique_ids, windows):
+        if (user_id, LATEST_STATE_KEY) in unfetched or (user_id, ALERT_STATE_KEY) in unfetched:
+            patients.append({'user_id': user_id, 'status': 'unavailable', 'window': window})
+            continue
+        status = format_current_status(found.get((user_id, LATEST_STATE_KEY)))
+        status.pop('success')
+        alert = found.get((user_id, ALERT_STATE_KEY))
+        patients.append({
+            'user_id': user_id,
+            **status,
+            'alert': {
+                'status': alert.get('status'),
+                'last_alert_at': alert.get('last_alert_at')
+            } if alert else None,
+            'window': window
+        })
+    
+    # Newest reading first within a severity, then most severe first
+    patients.sort(key=lambda p: p.get('timestamp') or '', reverse=True)
+    patients.sort(key=lambda p: STATUS_SORT_ORDER.get(p['status'], len(STATUS_SORT_ORDER)))
+    
+    counts = {}
+    for patient in patients:
+        counts[patient['status']] = counts.get(patient['status'], 0) + 1
+    
+    return {
+        'success': True,
+        'patients': patients,
+        'count': len(patients),
+        'counts_by_status': counts,
+        'window_minutes': window_minutes,
+        'window_start': start.isoformat(),
+        'window_end': end.isoformat()
+    }
+
+
+def get_archive_statistics(user_id: str, start_date: str, end_date: str = None,
+                           device_id: str = None) -> dict:
+    """
+    Get BPM statistics for an arbitrary range from the S3 archive.
+    
+    Every reading is archived, so this covers ranges the rollups no longer
+    (or never) held, optionally for a single device.
+    
+    Args:
+        user_id: User identifier
+        start_date: Range start (ISO format)
+        end_date: Optional range end (ISO format, defaults to now)
+        device_id: Optional device filter
+        
+    Returns:
+        Dict with statistics
+        
+    Raises:
+        ValueError: If the range is invalid or longer than ARCHIVE_STATS_MAX_DAYS
+    """
+    start = parse_iso(start_date)
+    end = parse_iso(end_date) if end_date else datetime.now(timezone.utc)
+    if start >= end:
+        raise ValueError('start_date must be before end_date')
+    if end - start > timedelta(days=ARCHIVE_STATS_MAX_DAYS):
+        raise ValueError(f"Statistics ranges are limited to {ARCHIVE_STATS_MAX_DAYS} days, "
+                         f"use POST /bpm/export for longer ones")
+    
+    try:
+        result = archive_statistics(get_client('s3'), S3_BUCKET_NAME, user_id, start, end,
+                                    device_id, max_workers=ARCHIVE_QUERY_WORKERS)
+        
+    except ClientError as e:
+        logger.error(f"Error reading S3 archive: {e}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
+    
+    response = {
+        'success': True,
+        'source': 'archive',
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'partitions': result['partitions']
+    }
+    if not result['statistics']:
+        response['message'] = 'No data for the specified period'
+        return response
+    
+    return {**response, **result['statistics']}
+
+
+def get_daily_report(user_id: str, report_date: str = None) -> dict:
+    """
+    Get the daily report of a user, as written by daily_analytics.
+    
+    Args:
+        user_id: User identifier
+        report_date: Day of the report (YYYY-MM-DD, defaults to yesterday UTC)
+        
+    Returns:
+        Dict with the report, or found=False if it was not generated
+        
+    Raises:
+        ValueError: If the date is malformed
+    """
+    if report_date:
+        try:
+            day = datetime.strptime(report_date, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f"Invalid date: {report_date}")
+    else:
+        day = datetime.now(timezone.utc).date() - timedelta(days=1)
+    
+    try:
+        table = get_table(USER_STATE_TABLE_NAME)
+        response = table.get_item(
+            Key={'user_id': user_id, 'state_key': f"{REPORT_KEY_PREFIX}{day.isoformat()}"}
+        )
+        
+    except ClientError as e:
+        logger.error(f"Error reading daily report: {e}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
+    
+    report = response.get('Item')
+    if not report:
+        return {'success': True, 'found': False, 'date': day.isoformat()}
+    
+    report.pop('state_key', None)
+    return {'success': True, 'found': True, **report}
+
+
+def export_keys(user_id: str, export_id: str, export_format: str) -> tuple:
+    """Return the (data_key, status_key) of an export."""
+    prefix = f"{EXPORT_PREFIX}{user_id}/{export_id}/"
+    extension = EXPORT_FORMATS[export_format][1]
+    return f"{prefix}bpm-export.{extension}.gz", f"{prefix}status.json"
+
+
+def export_record(item: dict) -> dict:
+    """
+    Normalize a DynamoDB item or an archived measurement into an export row.
+    
+    Archived measurements keep the classification nested as written by
+    bpm_processor; DynamoDB items have it flattened.
+    """
+    classification = item.get('classification') or item
+    return {
+        'timestamp': item['timestamp'],
+        'device_id': item.get('device_id'),
+        'bpm': int(item['bpm']),
+        'status': classification.get('status'),
+        'severity': classification.get('severity')
+    }
+
+
+def iter_export_records(user_id: str, start: datetime, end: datetime,
+                        device_id: str = None, now: datetime = None):
+    """
+    Stream the readings of a range in time order for an export.
+    
+    The part of the range older than the DynamoDB retention is read from
+    the S3 archive, the rest from the measurements table, page by page.
+    
+    Args:
+        user_id: User identifier
+        start: Range start (UTC)
+        end: Range end (UTC)
+        device_id: Optional device filter
+        now: Current time (defaults to now)
+        
+    Yields:
+        Export rows
+    """
+    cutoff = hot_cutoff(now)
+    
+    if start < cutoff:
+        archive_end = min(end, cutoff - timedelta(microseconds=1))
+        for measurement in iter_archive_range(get_client('s3'), S3_BUCKET_NAME, user_id,
+                                              start, archive_end, device_id,
+                                              max_workers=ARCHIVE_QUERY_WORKERS):
+            yield export_record(measurement)
+    
+    if end >= cutoff:
+        hot_start = max(start, cutoff)
+        pages = iter_history_pages(
+            user_id, device_id,
+            hot_start.isoformat().replace('+00:00', 'Z'),
+            end.isoformat().replace('+00:00', 'Z'),
+            '#ts, device_id, bpm, #status, severity'
+        )
+        for items in pages:
+            for item in items:
+                yield export_record(item)
+
+
+def iter_export_lines(records, export_format: str):
+    """
+    Serialize export rows into encoded lines.
+    
+    Args:
+        records: Iterable of export rows
+        export_format: 'ndjson' or 'csv'
+        
+    Yields:
+        Encoded lines (a header first for CSV)
+    """
+    if export_format == 'ndjson':
+        for record in records:
+            yield (json.dumps(record) + '\n').encode('utf-8')
+        return
+    
+    line = io.StringIO()
+    writer = csv.DictWriter(line, fieldnames=EXPORT_COLUMNS, lineterminator='\n')
+    writer.writeheader()
+    yield line.getvalue().encode('utf-8')
+    line.seek(0)
+    line.truncate()
+    for record in records:
+        writer.writerow(record)
+        yield line.getvalue().encode('utf-8')
+        line.seek(0)
+        line.truncate()
+
+
+def upload_gzip_stream(lines, bucket: str, key: str, content_type: str) -> dict:
+    """
+    Gzip a stream of lines into an S3 object with a multipart upload.
+    
+    Compressed bytes are buffered until a part is full, so memory stays
+    bounded by EXPORT_PART_BYTES whatever the size of the export.
+    
+    Args:
+        lines: Iterable of encoded lines
+        bucket: Destination bucket
+        key: Destination key
+        content_type: Content type of the uncompressed data
+        
+    Returns:
+        Dict with lines and compressed size
+    """
+    s3 = get_client('s3')
+    upload = s3.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)
+    upload_id = upload['UploadId']
+    parts = []
+    buffer = io.BytesIO()
+    stats = {'lines': 0, 'size': 0}
+    
+    def flush_part():
+        body = buffer.getvalue()
+        response = s3.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id,
+            PartNumber=len(parts) + 1, Body=body
+        )
+        parts.append({'PartNumber': len(parts) + 1, 'ETag': response['ETag']})
+        stats['size'] += len(body)
+        buffer.seek(0)
+        buffer.truncate()
+    
+    try:
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as compressor:
+            for line in lines:
+                compressor.write(line)
+                stats['lines'] += 1
+                if buffer.tell() >= EXPORT_PART_BYTES:
+                    flush_part()
+        flush_part()
+        
+        s3.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+        return stats
+        
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+
+def write_export_status(status_key: str, status: dict):
+    """Write the status document polled by clients while an export runs."""
+    get_client('s3').put_object(
+        Bucket=S3_BUCKET_NAME,
+        Key=status_key,
+        Body=json.dumps(status),
+        ContentType='application/json',
+        CacheControl='no-cache'
+    )
+
+
+def presign_export(key: str, filename: str = None) -> str:
+    """Create a presigned GET URL for an export object."""
+    params = {'Bucket': S3_BUCKET_NAME, 'Key': key}
+    if filename:
+        params['ResponseContentDisposition'] = f'attachment; filename="{filename}"'
+    return get_client('s3').generate_presigned_url(
+        'get_object', Params=params, ExpiresIn=EXPORT_URL_EXPIRES_SECONDS
+    )
+
+
+def start_export(user_id: str, start_date: str, end_date: str = None,
+                 export_format: str = 'ndjson', device_id: str = None) -> dict:
+    """
+    Validate an export request and hand it to the exporter function.
+    
+    The export runs asynchronously; clients poll the status URL and
+    download the file from the data URL once the status is 'complete'.
+    
+    Args:
+        user_id: User identifier
+        start_date: Range start (ISO format)
+        end_date: Optional range end (ISO format, defaults to now)
+        export_format: 'ndjson' or 'csv'
+        device_id: Optional device filter
+        
+    Returns:
+        Dict with export_id and the presigned status and data URLs
+        
+    Raises:
+        ValueError: If the request is invalid
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid format: {export_format}")
+    if not start_date:
+        raise ValueError('start_date is required')
+    
+    start = parse_iso(start_date)
+    end = parse_iso(end_date) if end_date else datetime.now(timezone.utc)
+    if start >= end:
+        raise ValueError('start_date must be before end_date')
+    if end - start > timedelta(days=EXPORT_MAX_DAYS):
+        raise ValueError(f"Exports are limited to {EXPORT_MAX_DAYS} days")
+    
+    export_id = uuid.uuid4().hex
+    data_key, status_key = export_keys(user_id, export_id, export_format)
+    job = {
+        'export_id': export_id,
+        'user_id': user_id,
+        'device_id': device_id,
+        'start_date': start.isoformat().replace('+00:00', 'Z'),
+        'end_date': end.isoformat().replace('+00:00', 'Z'),
+        'format': export_format
+    }
+    
+    try:
+        write_export_status(status_key, {**job, 'status': 'pending'})
+        get_client('lambda').invoke(
+            FunctionName=EXPORT_FUNCTION_NAME,
+            InvocationType='Event',
+            Payload=json.dumps({'export_job': job})
+        )
+        
+        return {
+            'success': True,
+            **job,
+            'status': 'pending',
+            'status_url': presign_export(status_key),
+            'download_url': presign_export(data_key, data_key.rsplit('/', 1)[1]),
+            'expires_in': EXPORT_URL_EXPIRES_SECONDS
+        }
+        
+    except ClientError as e:
+        logger.error(f"Error starting export: {e}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+
+def run_export(job: dict) -> dict:
+    """
+    Run an export job: stream the range into a gzipped S3 object.
+    
+    Args:
+        job: Job created by start_export
+        
+    Returns:
+        Final status document
+    """
+    data_key, status_key = export_keys(job['user_id'], job['export_id'], job['format'])
+    write_export_status(status_key, {**job, 'status': 'running'})
+    
+    try:
+        records = iter_export_records(
+            job['user_id'], parse_iso(job['start_date']), parse_iso(job['end_date']),
+            job.get('device_id')
+        )
+        stats = upload_gzip_stream(
+            iter_export_lines(records, job['format']),
+            S3_BUCKET_NAME, data_key, EXPORT_FORMATS[job['format']][0]
+        )
+        count = stats['lines'] - (1 if job['format'] == 'csv' else 0)
+        status = {**job, 'status': 'complete', 'count': count, 'size': stats['size']}
+        logger.info(f"Exported {count} readings to {data_key}")
+        
+    except Exception as e:
+        logger.error(f"Error running export {job['export_id']}: {e}")
+        status = {**job, 'status': 'failed', 'error': str(e)}
+    
+    status['finished_at'] = datetime.now(timezone.utc).isoformat()
+    write_export_status(status_key, status)
+    return status
+
+
+def export_handler(event, context):
+    """
+    Lambda handler of the exporter function (invoked by start_export).
+    
+    Args:
+        event: {'export_job': job}
+        context: Lambda context object
+        
+    Returns:
+        Final status document
+    """
+    return run_export(event['export_job'])
+
+
+def log_event(event: dict):
+    """
+    Log an incoming request without serializing the whole event.
+    
+    The full event is only dumped at DEBUG level or for a sampled fraction
+    of requests (EVENT_LOG_SAMPLE_RATE).
+    
+    Args:
+        event: API Gateway event
+    """
+    if logger.isEnabledFor(logging.DEBUG) or random.random() < EVENT_LOG_SAMPLE_RATE:
+        logger.info(f"Received event: {json.dumps(event, default=str)}")
+    else:
+        logger.info(f"Received {event.get('httpMethod', 'GET')} {event.get('path', '/')}")
+
+
 def lambda_handler(event, context):
     """
     Main Lambda handler for API requests.
@@ -308,8 +1963,277 @@ def lambda_handler(event, context):
     Returns:
         API Gateway response
     """
-    logger.info(f"Received event: {json.dumps(event)}")
+    log_event(event)
+    
+    response = route_request(event)
+    return compress_response(response, get_request_header(event, 'Accept-Encoding'))
+
+
+def parse_json_body(event: dict) -> dict:
+    """
+    Parse the JSON body of a request.
+    
+    Args:
+        event: API Gateway event
+        
+    Returns:
+        Parsed body (empty dict if there is none)
+        
+    Raises:
+        ValueError: If the body is not valid JSON
+    """
+    try:
+        return json.loads(event.get('body') or '{}')
+    except json.JSONDecodeError:
+        raise ValueError('Invalid JSON body')
+
+
+def handle_health(event: dict, user: dict, query_params: dict) -> dict:
+    """GET /health"""
+    return create_response(200, {'status': 'healthy', 'cache': response_cache.stats()})
+
+
+def handle_history(event: dict, user: dict, query_params: dict) -> dict:
+    """GET /bpm/history"""
+    history_params = {
+        'device_id': query_params.get('device_id'),
+        'start_date': query_params.get('start_date'),
+        'end_date': query_params.get('end_date'),
+        'limit': int(query_params.get('limit', 100)),
+        'cursor': query_params.get('cursor'),
+        'response_format': query_params.get('format')
+    }
+    points = query_params.get('points')
+    
+    # The page only changes when a reading of the user is stored; a
+    # downsampled range that ends "now" also moves with the clock
+    version = None
+    if not points or (history_params['start_date'] and history_params['end_date']):
+        version = get_data_version(user['user_id'])
+    etag = make_etag('history', user['user_id'], history_params, points, version)
+    if version and etag_matches(get_request_header(event, 'If-None-Match'), etag):
+        return create_response(304, None, {'ETag': etag})
+    
+    if points:
+        result = get_bpm_history_downsampled(
+            user_id=user['user_id'],
+            points=int(points),
+            device_id=history_params['device_id'],
+            start_date=history_params['start_date'],
+            end_date=history_params['end_date']
+        )
+    else:
+        result = get_bpm_history(user_id=user['user_id'], **history_params)
+    
+    if result['success']:
+        return create_response(200, result, {'ETag': etag} if version else None)
+    else:
+        return create_response(500, result)
+
+
+def handle_current(event: dict, user: dict, query_params: dict) -> dict:
+    """GET /bpm/current (long poll with since=...)"""
+    device_id = query_params.get('device_id')
+    
+    if query_params.get('since'):
+        # Long poll: held until a newer reading exists, never cached
+        result = wait_for_current_status(
+            user_id=user['user_id'],
+            since=query_params['since'],
+            wait=int(query_params.get('wait', LONG_POLL_MAX_SECONDS)),
+            device_id=device_id
+        )
+        
+        if result['success']:
+            return create_response(200, result)
+        else:
+            return create_response(500, result)
+    
+    result, cache_status = cached_route(
+        '/bpm/current', user['user_id'], {'device_id': device_id},
+        lambda: get_current_status(user_id=user['user_id'], device_id=device_id)
+    )
+    
+    if result['success']:
+        etag = make_etag('current', result)
+        if etag_matches(get_request_header(event, 'If-None-Match'), etag):
+            return create_response(304, None, {'ETag': etag, 'X-Cache': cache_status})
+        return create_response(200, result, {'ETag': etag, 'X-Cache': cache_status})
+    else:
+        return create_response(500, result)
+
+
+def handle_statistics(event: dict, user: dict, query_params: dict) -> dict:
+    """GET /bpm/statistics (archive ranges with start_date=...)"""
+    if query_params.get('start_date'):
+        # Arbitrary (typically archived) ranges are answered from S3
+        result = get_archive_statistics(
+            user_id=user['user_id'],
+            start_date=query_params['start_date'],
+            end_date=query_params.get('end_date'),
+            device_id=query_params.get('device_id')
+        )
+        
+        if result['success']:
+            return create_response(200, result)
+        else:
+            return create_response(500, result)
+    
+    period = query_params.get('period', 'day')
+    now = datetime.now(timezone.utc)
+    _, window_end = statistics_window(period, now)
+    
+    # Statistics change with new readings and when the window moves
+    version = get_data_version(user['user_id'])
+    etag = make_etag('statistics', user['user_id'], period, version, window_end.isoformat())
+    if version and etag_matches(get_request_header(event, 'If-None-Match'), etag):
+        return create_response(304, None, {'ETag': etag})
+    
+    # Keying the cache by version and window keeps it exact
+    result, cache_status = cached_route(
+        '/bpm/statistics', user['user_id'],
+        {'period': period, 'version': version, 'window': window_end.isoformat()},
+        lambda: get_statistics(user_id=user['user_id'], period=period, now=now)
+    )
+    
+    if result['success']:
+        headers = {'X-Cache': cache_status}
+        if version:
+            headers['ETag'] = etag
+        return create_response(200, result, headers)
+    else:
+        return create_response(500, result)
+
+
+def handle_report(event: dict, user: dict, query_params: dict) -> dict:
+    """GET /bpm/report (clinicians may pass user_id=...)"""
+    user_id = query_params.get('user_id') or user['user_id']
+    if user_id != user['user_id'] and not is_clinician(user):
+        return create_response(403, {'error': 'Forbidden'})
+    
+    result = get_daily_report(user_id, query_params.get('date'))
+    
+    if not result['success']:
+        return create_response(500, result)
+    if not result['found']:
+        return create_response(404, {'error': f"No report for {result['date']}"})
+    
+    # Reports only change when daily_analytics regenerates them
+    etag = make_etag('report', user_id, result['date'], result['generated_at'])
+    if etag_matches(get_request_header(event, 'If-None-Match'), etag):
+        return create_response(304, None, {'ETag': etag})
+    return create_response(200, result, {'ETag': etag})
+
+
+def handle_devices(event: dict, user: dict, query_params: dict) -> dict:
+    """GET /devices"""
+    result, cache_status = cached_route(
+        '/devices', user['user_id'], {},
+        lambda: get_user_devices(user['user_id'])
+    )
+    
+    if result['success']:
+        return create_response(200, result, {'X-Cache': cache_status})
+    else:
+        return create_response(500, result)
+
+
+def handle_export(event: dict, user: dict, query_params: dict) -> dict:
+    """POST /bpm/export"""
+    body = parse_json_body(event)
+    
+    result = start_export(
+        user_id=user['user_id'],
+        start_date=body.get('start_date'),
+        end_date=body.get('end_date'),
+        export_format=body.get('format', 'ndjson'),
+        device_id=body.get('device_id')
+    )
+    
+    if result['success']:
+        return create_response(202, result)
+    else:
+        return create_response(500, result)
+
+
+def handle_patients_status(event: dict, user: dict, query_params: dict) -> dict:
+    """POST /patients/status (clinicians only)"""
+    if not is_clinician(user):
+        return create_response(403, {'error': 'Forbidden'})
+    
+    body = parse_json_body(event)
+    
+    result = get_patients_status(
+        user_ids=body.get('user_ids'),
+        window_minutes=int(body.get('window_minutes', 60))
+    )
+    
+    if result['success']:
+        return create_response(200, result)
+    else:
+        return create_response(500, result)
+
+
+def handle_profile(event: dict, user: dict, query_params: dict) -> dict:
+    """GET /user/profile"""
+    return create_response(200, {
+        'user_id': user['user_id'],
+        'email': user['email'],
+        'role': user['role'],
+        'groups': user['groups']
+    })
+
+
+# Route table: path -> (required method or None for any, handler)
+ROUTES = {
+    '/health': (None, handle_health),
+    '/bpm/history': (None, handle_history),
+    '/bpm/current': (None, handle_current),
+    '/bpm/statistics': (None, handle_statistics),
+    '/bpm/report': ('GET', handle_report),
+    '/devices': (None, handle_devices),
+    '/bpm/export': ('POST', handle_export),
+    '/patients/status': ('POST', handle_patients_status),
+    '/user/profile': (None, handle_profile)
+}
+# Paths also matched by prefix (e.g. /bpm/history/<device_id>)
+PREFIX_ROUTES = ['/bpm/history']
+
+
+def resolve_route(path: str, http_method: str):
+    """
+    Find the handler of a request path.
+    
+    Args:
+        path: Request path
+        http_method: HTTP method
+        
+    Returns:
+        Handler function, or None if no route matches
+    """
+    route = ROUTES.get(path)
+    if route is None:
+        prefix = next((p for p in PREFIX_ROUTES if path.startswith(p)), None)
+        route = ROUTES.get(prefix)
+    if route is None:
+        return None
     
+    method, handler = route
+    if method and method != http_method:
+        return None
+    return handler
+
+
+def route_request(event: dict) -> dict:
+    """
+    Route an API Gateway request to its handler.
+    
+    Args:
+        event: API Gateway event
+        
+    Returns:
+        API Gateway response
+    """
     # Handle OPTIONS requests (CORS preflight)
     http_method = event.get('httpMethod', 'GET')
     if http_method == 'OPTIONS':
@@ -321,67 +2245,16 @@ def lambda_handler(event, context):
     if not user['user_id']:
         return create_response(401, {'error': 'Unauthorized'})
     
-    # Parse path and query parameters
-    path = event.get('path', '/')
-    query_params = event.get('queryStringParameters') or {}
-    path_params = event.get('pathParameters') or {}
+    handler = resolve_route(event.get('path', '/'), http_method)
+    if handler is None:
+        return create_response(404, {'error': 'Not found'})
     
     try:
-        # Route requests
-        if path == '/health':
-            return create_response(200, {'status': 'healthy'})
-        
-        elif path == '/bpm/history' or path.startswith('/bpm/history'):
-            result = get_bpm_history(
-                user_id=user['user_id'],
-                device_id=query_params.get('device_id'),
-                start_date=query_params.get('start_date'),
-                end_date=query_params.get('end_date'),
-                limit=int(query_params.get('limit', 100))
-            )
-            
-            if result['success']:
-                return create_response(200, result)
-            else:
-                return create_response(500, result)
-        
-        elif path == '/bpm/current':
-            result = get_current_status(user['user_id'])
-            
-            if result['success']:
-                return create_response(200, result)
-            else:
-                return create_response(500, result)
-        
-        elif path == '/bpm/statistics':
-            result = get_statistics(
-                user_id=user['user_id'],
-                period=query_params.get('period', 'day')
-            )
-            
-            if result['success']:
-                return create_response(200, result)
-            else:
-                return create_response(500, result)
-        
-        elif path == '/devices':
-            result = get_user_devices(user['user_id'])
-            
-            if result['success']:
-                return create_response(200, result)
-            else:
-                return create_response(500, result)
-        
-        elif path == '/user/profile':
-            return create_response(200, {
-                'user_id': user['user_id'],
-                'email': user['email'],
-                'role': user['role'],
-                'groups': user['groups']
-            })
-        
-        else:
-            return create_response(404, {'error': 'Not found'})
+        return handler(event, user, event.get('queryStringParameters') or {})
+    
+    except ValueError as e:
+        # Malformed query parameters (limit, cursor, ...)
+        return create_response(400, {'error': str(e)})
     
     except Exception as e:
         logger.error(f"Error processing request: {e}")
@@ -0,0 +1,829 @@
+"""
+Archive Compactor Lambda Function
+Compacts the per-reading S3 archive into one object per device and day.
+
+This function:
+1. Lists only the day prefixes that can have changed since the last run:
+   the last COMPACTION_LATE_DAYS settled days (late arrivals) and the days
+   after the checkpoint of the last complete run
+2. Fetches the small JSON objects of each day concurrently and merges them,
+   in time order, with the day's existing compacted file
+3. Streams the merged readings into gzip members, one per minute, so ranges
+   stay readable, spooling the file to disk rather than memory
+4. Writes a sparse time index (byte offset per minute) next to each file
+5. Skips days whose sources have not changed since the last run, and stops
+   before the Lambda deadline so the next run resumes where it stopped
+
+A full run over the whole archive (or a prefix of it) is available for
+backfills, resumable with the marker it returns when it runs out of time.
+
+The compacted layout is:
+    compacted/user_id/device_id/year/month/day/data.ndjson.gz
+    compacted/user_id/device_id/year/month/day/index.json
+    compacted/_checkpoint.json
+
+It can also be run locally against any S3 compatible endpoint:
+    python archive_compactor.py --bucket my-bucket --endpoint-url http://localhost:9000
+    python archive_compactor.py --bucket my-bucket --full --endpoint-url http://localhost:9000
+"""
+
+import argparse
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import logging
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone, timedelta
+import boto3
+from botocore.exceptions import ClientError
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Environment variables
+S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+
+# Compaction settings
+COMPACTED_PREFIX = 'compacted/'
+DATA_FILENAME = 'data.ndjson.gz'
+INDEX_FILENAME = 'index.json'
+INDEX_VERSION = 1
+CHECKPOINT_KEY = f"{COMPACTED_PREFIX}_checkpoint.json"
+# Top-level prefixes that hold no raw readings (bulk exports are written by the API)
+NON_ARCHIVE_PREFIXES = (COMPACTED_PREFIX, 'exports/')
+# Days younger than this are still receiving readings and are left alone
+SETTLE_HOURS = int(os.environ.get('COMPACTION_SETTLE_HOURS', 2))
+# Settled days listed again by every run, for readings that arrive late
+LATE_DAYS = int(os.environ.get('COMPACTION_LATE_DAYS', 3))
+DELETE_SOURCES = os.environ.get('COMPACTION_DELETE_SOURCES', 'false').lower() == 'true'
+# Raw objects fetched concurrently (each reading is its own object)
+FETCH_WORKERS = int(os.environ.get('COMPACTION_FETCH_WORKERS', 32))
+# A run stops starting work when less time than this is left
+DEADLINE_MARGIN_SECONDS = int(os.environ.get('COMPACTION_DEADLINE_MARGIN_SECONDS', 60))
+# Compacted files larger than this are spooled to /tmp while they are written
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+
+class DeadlineReached(Exception):
+    """The run is about to exceed its time budget."""
+
+
+def check_deadline(time_left):
+    """
+    Raise DeadlineReached when the run is close to its time budget.
+
+    Args:
+        time_left: Callable returning the seconds left, or None for no limit
+    """
+    if time_left is not None and time_left() < DEADLINE_MARGIN_SECONDS:
+        raise DeadlineReached()
+
+
+def create_s3_client(endpoint_url: str = None):
+    """
+    Create an S3 client, optionally bound to a local S3 stand-in.
+
+    Args:
+        endpoint_url: Optional endpoint (MinIO, LocalStack, ...)
+
+    Returns:
+        boto3 S3 client
+    """
+    return boto3.client('s3', endpoint_url=endpoint_url or S3_ENDPOINT_URL)
+
+
+def parse_timestamp(timestamp: str) -> datetime:
+    """Parse an ISO 8601 timestamp as written by the devices."""
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+
+def day_prefix_of(key: str) -> str:
+    """
+    Return the user_id/device_id/year/month/day/ prefix of a raw archive key.
+
+    Args:
+        key: S3 object key
+
+    Returns:
+        The day prefix, or None if the key is not a raw reading
+    """
+    parts = key.split('/')
+    if len(parts) != 6 or not parts[5].endswith('.json'):
+        return None
+    return '/'.join(parts[:5]) + '/'
+
+
+def compacted_keys(day_prefix: str) -> tuple:
+    """
+    Return the (data_key, index_key) of the compacted file for a day.
+
+    Args:
+        day_prefix: user_id/device_id/year/month/day/ prefix
+
+    Returns:
+        Tuple of (data_key, index_key)
+    """
+    base = f"{COMPACTED_PREFIX}{day_prefix}"
+    return f"{base}{DATA_FILENAME}", f"{base}{INDEX_FILENAME}"
+
+
+def iter_day_groups(s3_client, bucket: str, prefix: str = '', start_after: str = None):
+    """
+    Stream the raw archive listing grouped by day prefix.
+
+    S3 lists keys in lexicographic order, so every object of a day prefix
+    is contiguous and a group can be yielded as soon as the prefix changes.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        prefix: Optional key prefix (e.g. a single user_id/)
+        start_after: Optional day prefix; listing resumes after its objects
+
+    Yields:
+        Tuples of (day_prefix, [object summaries])
+    """
+    paginator = s3_client.get_paginator('list_objects_v2')
+    current_prefix = None
+    current_objects = []
+    pagination = {'StartAfter': f"{start_after}~"} if start_after else {}
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, **pagination):
+        for obj in page.get('Contents', []):
+            if obj['Key'].startswith(COMPACTED_PREFIX):
+                continue
+
+            day_prefix = day_prefix_of(obj['Key'])
+            if day_prefix is None:
+                continue
+
+            if day_prefix != current_prefix:
+                if current_objects:
+                    yield current_prefix, current_objects
+                current_prefix = day_prefix
+                current_objects = []
+
+            current_objects.append(obj)
+
+    if current_objects:
+        yield current_prefix, current_objects
+
+
+def list_child_prefixes(s3_client, bucket: str, prefix: str) -> list:
+    """
+    List the prefixes one level below a prefix, without listing objects.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        prefix: Parent prefix ('' for the bucket root)
+
+    Returns:
+        List of child prefixes ending in '/'
+    """
+    children = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+        children.extend(common['Prefix'] for common in page.get('CommonPrefixes', []))
+    return children
+
+
+def list_device_prefixes(s3_client, bucket: str) -> list:
+    """
+    List the user_id/device_id/ prefixes of the raw archive.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+
+    Returns:
+        List of user_id/device_id/ prefixes
+    """
+    return [
+        device_prefix
+        for user_prefix in list_child_prefixes(s3_client, bucket, '')
+        if user_prefix not in NON_ARCHIVE_PREFIXES
+        for device_prefix in list_child_prefixes(s3_client, bucket, user_prefix)
+    ]
+
+
+def list_day_objects(s3_client, bucket: str, day_prefix: str) -> list:
+    """
+    List the raw objects of one day.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        day_prefix: user_id/device_id/year/month/day/ prefix
+
+    Returns:
+        Object summaries in key (time) order
+    """
+    paginator = s3_client.get_paginator('list_objects_v2')
+    return [
+        obj
+        for page in paginator.paginate(Bucket=bucket, Prefix=day_prefix)
+        for obj in page.get('Contents', [])
+        if day_prefix_of(obj['Key']) == day_prefix
+    ]
+
+
+def recent_days(now: datetime, completed_through: date = None) -> list:
+    """
+    List the settled days a run has to look at.
+
+    Args:
+        now: Current time
+        completed_through: Last day of the checkpoint, if any
+
+    Returns:
+        Dates from the oldest day to revisit to the last settled day
+    """
+    last = (now - timedelta(hours=SETTLE_HOURS)).date() - timedelta(days=1)
+    first = last - timedelta(days=LATE_DAYS - 1)
+    if completed_through is not None and completed_through < first - timedelta(days=1):
+        # An earlier run stopped early: resume after the last complete day
+        first = completed_through + timedelta(days=1)
+    return [first + timedelta(days=n) for n in range((last - first).days + 1)]
+
+
+def is_settled(day_prefix: str, now: datetime) -> bool:
+    """
+    Check whether a day is old enough to stop receiving readings.
+
+    Args:
+        day_prefix: user_id/device_id/year/month/day/ prefix
+        now: Current time
+
+    Returns:
+        True if the day ended at least SETTLE_HOURS ago
+    """
+    _, _, year, month, day = day_prefix.rstrip('/').split('/')
+    day_end = datetime(int(year), int(month), int(day), tzinfo=timezone.utc) + timedelta(days=1)
+    return now - day_end >= timedelta(hours=SETTLE_HOURS)
+
+
+def sources_fingerprint(objects: list) -> str:
+    """
+    Fingerprint the source objects of a day so reruns can be skipped.
+
+    Args:
+        objects: Object summaries from list_objects_v2
+
+    Returns:
+        Hex digest over the sorted keys and ETags
+    """
+    digest = hashlib.sha256()
+    for obj in sorted(objects, key=lambda o: o['Key']):
+        digest.update(obj['Key'].encode('utf-8'))
+        digest.update(obj.get('ETag', '').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_index(s3_client, bucket: str, index_key: str) -> dict:
+    """
+    Load the time index of a compacted day.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        index_key: Key of the index object
+
+    Returns:
+        Index dict, or None if the day has not been compacted
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=index_key)
+        return json.loads(response['Body'].read())
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+
+
+def fetch_source(s3_client, bucket: str, key: str) -> dict:
+    """Read the measurement stored in one raw object."""
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    return json.loads(response['Body'].read())
+
+
+def read_sources(s3_client, bucket: str, objects: list,
+                 max_workers: int = FETCH_WORKERS, time_left=None):
+    """
+    Stream the measurements stored in the raw objects of a day.
+
+    Objects are fetched by a thread pool and yielded in the given order; at
+    most max_workers of them are in flight or buffered at a time, as in
+    archive_query.iter_partition_lists.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        objects: Object summaries from list_objects_v2
+        max_workers: Objects fetched concurrently
+        time_left: Optional callable returning the seconds left in the run
+
+    Yields:
+        Measurement dicts
+
+    Raises:
+        DeadlineReached: If the run is about to run out of time
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    try:
+        for obj in objects:
+            pending.append(executor.submit(fetch_source, s3_client, bucket, obj['Key']))
+            if len(pending) >= max_workers:
+                check_deadline(time_left)
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def read_compacted(s3_client, bucket: str, data_key: str):
+    """
+    Stream every measurement of a compacted day file.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        data_key: Key of the compacted data object
+
+    Yields:
+        Measurement dicts
+    """
+    response = s3_client.get_object(Bucket=bucket, Key=data_key)
+    with gzip.GzipFile(fileobj=response['Body']) as stream:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def delete_objects(s3_client, bucket: str, objects: list):
+    """
+    Delete raw objects in batches of 1000 keys.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        objects: Object summaries from list_objects_v2
+    """
+    for start in range(0, len(objects), 1000):
+        batch = objects[start:start + 1000]
+        s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': o['Key']} for o in batch], 'Quiet': True}
+        )
+
+
+def merge_readings(*streams):
+    """
+    Merge time-ordered reading streams, dropping repeated readings.
+
+    Raw keys are named HHMMSSffffff.json, so a day's listing is in time order
+    (as archive_query.iter_raw_day relies on) and so is a compacted file. A
+    reading is repeated when a retry archived it twice or when it is both
+    compacted and still a raw object; the first stream's copy is kept.
+
+    Args:
+        streams: Iterables of measurement dicts, each in time order
+
+    Yields:
+        Measurement dicts in time order, unique on (timestamp, device_id)
+    """
+    current_time = None
+    seen = set()
+    for record in heapq.merge(*streams, key=lambda m: parse_timestamp(m['timestamp'])):
+        ts = parse_timestamp(record['timestamp'])
+        if ts != current_time:
+            current_time = ts
+            seen.clear()
+        key = (record['timestamp'], record.get('device_id'))
+        if key in seen:
+            continue
+        seen.add(key)
+        yield record
+
+
+def write_compacted_day(records, out) -> tuple:
+    """
+    Write a compacted day file and build its sparse minute index.
+
+    Each minute is written as an independent gzip member. Concatenated gzip
+    members are still one valid gzip stream, and any member can be fetched
+    with a ranged GET and decompressed on its own. Only the current minute
+    is held in memory.
+
+    Args:
+        records: Iterable of measurement dicts in time order
+        out: Binary file object the gzip members are written to
+
+    Returns:
+        Tuple of (list of minute index entries, summary with count,
+        first_timestamp and last_timestamp)
+    """
+    minutes = []
+    offset = 0
+    current_minute = None
+    current_lines = []
+    summary = {'count': 0, 'first_timestamp': None, 'last_timestamp': None}
+
+    def flush():
+        nonlocal offset
+        member = gzip.compress(''.join(current_lines).encode('utf-8'), mtime=0)
+        out.write(member)
+        minutes.append({
+            'minute': current_minute,
+            'offset': offset,
+            'length': len(member),
+            'count': len(current_lines)
+        })
+        offset += len(member)
+
+    for record in records:
+        minute = parse_timestamp(record['timestamp']).strftime('%H:%M')
+        if minute != current_minute:
+            if current_lines:
+                flush()
+            current_minute = minute
+            current_lines = []
+        current_lines.append(json.dumps(record, separators=(',', ':')) + '\n')
+
+        summary['count'] += 1
+        if summary['first_timestamp'] is None:
+            summary['first_timestamp'] = record['timestamp']
+        summary['last_timestamp'] = record['timestamp']
+
+    if current_lines:
+        flush()
+
+    return minutes, summary
+
+
+def compact_day(s3_client, bucket: str, day_prefix: str, objects: list,
+                delete_sources: bool = DELETE_SOURCES, time_left=None) -> str:
+    """
+    Compact the raw objects of one day into a data file and index.
+
+    Compaction is idempotent: a day whose sources are unchanged since the
+    previous run is skipped. Readings that arrive after a day was compacted
+    are merged into the existing file, so readings whose sources an earlier
+    run deleted are kept even when this run keeps its sources. A day that
+    runs out of time is left untouched, nothing is written for it.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        day_prefix: user_id/device_id/year/month/day/ prefix
+        objects: Raw object summaries of the day, in key order
+        delete_sources: Delete raw objects once the compacted file is written
+        time_left: Optional callable returning the seconds left in the run
+
+    Returns:
+        'skipped' or 'compacted'
+
+    Raises:
+        DeadlineReached: If the run ran out of time before writing the day
+    """
+    data_key, index_key = compacted_keys(day_prefix)
+    fingerprint = sources_fingerprint(objects)
+
+    index = load_index(s3_client, bucket, index_key)
+    if index and index.get('sources_fingerprint') == fingerprint:
+        if delete_sources:
+            # Compacted by an earlier run that kept its sources
+            index['sources_fingerprint'] = sources_fingerprint([])
+            index['sources_count'] = 0
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=index_key,
+                Body=json.dumps(index),
+                ContentType='application/json'
+            )
+            delete_objects(s3_client, bucket, objects)
+        return 'skipped'
+
+    streams = [read_sources(s3_client, bucket, objects, time_left=time_left)]
+    if index:
+        # An earlier run may have deleted its sources, whatever this run's
+        # setting: keep what was already compacted (duplicates are dropped)
+        streams.append(read_compacted(s3_client, bucket, data_key))
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as data:
+        minutes, summary = write_compacted_day(merge_readings(*streams), data)
+        size = data.tell()
+        data.seek(0)
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=data_key,
+            Body=data,
+            ContentType='application/x-ndjson',
+            ContentEncoding='gzip'
+        )
+
+    if delete_sources:
+        # Once the sources are gone the next run lists an empty day
+        fingerprint = sources_fingerprint([])
+
+    new_index = {
+        'version': INDEX_VERSION,
+        'day_prefix': day_prefix,
+        'data_key': data_key,
+        'size': size,
+        **summary,
+        'sources_fingerprint': fingerprint,
+        'sources_count': 0 if delete_sources else len(objects),
+        'minutes': minutes,
+        'compacted_at': datetime.now(timezone.utc).isoformat()
+    }
+
+    # The index is written last so readers never see it ahead of its data
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=index_key,
+        Body=json.dumps(new_index),
+        ContentType='application/json'
+    )
+
+    if delete_sources:
+        # A partial failure leaves sources behind; the next run sees a
+        # fingerprint mismatch and merges them again without duplicates.
+        delete_objects(s3_client, bucket, objects)
+
+    logger.info(f"Compacted {summary['count']} readings into {data_key}")
+    return 'compacted'
+
+
+def read_compacted_range(s3_client, bucket: str, day_prefix: str,
+                         start: datetime = None, end: datetime = None,
+                         index: dict = None):
+    """
+    Read the measurements of a compacted day within a time range.
+
+    Only the bytes of the minutes overlapping the range are fetched, with
+    a single ranged GET that is decompressed as it is streamed.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        day_prefix: user_id/device_id/year/month/day/ prefix
+        start: Optional inclusive start time
+        end: Optional inclusive end time
+        index: Optional index already loaded by the caller
+
+    Yields:
+        Measurement dicts in time order
+    """
+    data_key, index_key = compacted_keys(day_prefix)
+    if index is None:
+        index = load_index(s3_client, bucket, index_key)
+    if not index or not index.get('minutes'):
+        return
+
+    start_minute = start.strftime('%H:%M') if start else '00:00'
+    end_minute = end.strftime('%H:%M') if end else '23:59'
+    day = day_prefix.rstrip('/').split('/')[2:]
+    day_start = datetime(int(day[0]), int(day[1]), int(day[2]), tzinfo=timezone.utc)
+    if start and start < day_start:
+        start_minute = '00:00'
+    if end and end >= day_start + timedelta(days=1):
+        end_minute = '23:59'
+
+    selected = [m for m in index['minutes'] if start_minute <= m['minute'] <= end_minute]
+    if not selected:
+        return
+
+    first_byte = selected[0]['offset']
+    last_byte = selected[-1]['offset'] + selected[-1]['length'] - 1
+    response = s3_client.get_object(
+        Bucket=bucket,
+        Key=data_key,
+        Range=f"bytes={first_byte}-{last_byte}"
+    )
+
+    # Decompressed as it is read, so a whole day is never held in memory
+    with gzip.GzipFile(fileobj=response['Body']) as stream:
+        for line in stream:
+            record = json.loads(line)
+            ts = parse_timestamp(record['timestamp'])
+            if (start and ts < start) or (end and ts > end):
+                continue
+            yield record
+
+
+def load_checkpoint(s3_client, bucket: str) -> date:
+    """
+    Load the last day every device was compacted through.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+
+    Returns:
+        The date, or None before the first complete run
+    """
+    checkpoint = load_index(s3_client, bucket, CHECKPOINT_KEY)
+    if not checkpoint:
+        return None
+    return date.fromisoformat(checkpoint['completed_through'])
+
+
+def save_checkpoint(s3_client, bucket: str, completed_through: date):
+    """
+    Record the last day every device was compacted through.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        completed_through: Last complete day
+    """
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=CHECKPOINT_KEY,
+        Body=json.dumps({
+            'completed_through': completed_through.isoformat(),
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }),
+        ContentType='application/json'
+    )
+
+
+def compact_recent(s3_client, bucket: str, now: datetime = None,
+                   delete_sources: bool = DELETE_SOURCES, time_left=None) -> dict:
+    """
+    Compact the days that can have changed since the last run.
+
+    Only the day prefixes of recent_days are listed, so a run costs the same
+    however old the archive is; days before them are never read again. The
+    checkpoint advances past a day once every device of it is compacted, and
+    a run that stops early (time budget or errors) is resumed from there.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        now: Current time (defaults to utcnow)
+        delete_sources: Delete raw objects once compacted
+        time_left: Optional callable returning the seconds left in the run
+
+    Returns:
+        Dict with counts of compacted, skipped and failed days, whether the
+        run stopped early and the checkpoint it reached
+    """
+    now = now or datetime.now(timezone.utc)
+    summary = {'compacted': 0, 'skipped': 0, 'pending': 0, 'errors': 0, 'stopped': False}
+    completed_through = load_checkpoint(s3_client, bucket)
+    days = recent_days(now, completed_through)
+    device_prefixes = list_device_prefixes(s3_client, bucket)
+    # The checkpoint only moves over days without failures, in order
+    advancing = True
+
+    for day in days:
+        day_path = f"{day.year}/{day.month:02d}/{day.day:02d}/"
+        failed = False
+        for device_prefix in device_prefixes:
+            day_prefix = f"{device_prefix}{day_path}"
+            try:
+                check_deadline(time_left)
+                objects = list_day_objects(s3_client, bucket, day_prefix)
+                if not objects:
+                    continue
+                result = compact_day(s3_client, bucket, day_prefix, objects, delete_sources, time_left)
+                summary[result] += 1
+            except DeadlineReached:
+                logger.warning(f"Stopping before the deadline at {day_prefix}")
+                summary['stopped'] = True
+                break
+            except (ClientError, ValueError, KeyError) as e:
+                logger.error(f"Error compacting {day_prefix}: {e}")
+                summary['errors'] += 1
+                failed = True
+
+        if summary['stopped']:
+            break
+        advancing = advancing and not failed
+        if advancing and (completed_through is None or day > completed_through):
+            save_checkpoint(s3_client, bucket, day)
+            completed_through = day
+
+    summary['completed_through'] = completed_through.isoformat() if completed_through else None
+    return summary
+
+
+def compact_archive(s3_client, bucket: str, prefix: str = '', now: datetime = None,
+                    delete_sources: bool = DELETE_SOURCES, start_after: str = None,
+                    time_left=None) -> dict:
+    """
+    Compact every settled day in the archive, or under a prefix.
+
+    This lists the whole prefix and is meant for backfills and repairs; the
+    daily run is compact_recent. When time runs short the run stops and
+    returns the last day prefix it finished as 'resume_after'.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        prefix: Optional key prefix to limit the run
+        now: Current time (defaults to utcnow)
+        delete_sources: Delete raw objects once compacted
+        start_after: Optional 'resume_after' of an earlier run
+        time_left: Optional callable returning the seconds left in the run
+
+    Returns:
+        Dict with counts of compacted, skipped, pending and failed days,
+        whether the run stopped early and where to resume it
+    """
+    now = now or datetime.now(timezone.utc)
+    summary = {'compacted': 0, 'skipped': 0, 'pending': 0, 'errors': 0, 'stopped': False}
+    resume_after = start_after
+
+    for day_prefix, objects in iter_day_groups(s3_client, bucket, prefix, start_after):
+        if not is_settled(day_prefix, now):
+            summary['pending'] += 1
+            resume_after = day_prefix
+            continue
+
+        try:
+            check_deadline(time_left)
+            result = compact_day(s3_client, bucket, day_prefix, objects, delete_sources, time_left)
+            summary[result] += 1
+        except DeadlineReached:
+            logger.warning(f"Stopping before the deadline at {day_prefix}")
+            summary['stopped'] = True
+            break
+        except (ClientError, ValueError, KeyError) as e:
+            logger.error(f"Error compacting {day_prefix}: {e}")
+            summary['errors'] += 1
+        resume_after = day_prefix
+
+    if summary['stopped']:
+        summary['resume_after'] = resume_after
+    return summary
+
+
+def lambda_handler(event, context):
+    """
+    Scheduled Lambda handler for archive compaction.
+
+    Args:
+        event: Scheduled event. By default the recent days are compacted;
+            'full' (or a 'prefix') runs a full compaction, resumed with
+            'start_after'
+        context: Lambda context object
+
+    Returns:
+        Response dict with compaction summary
+    """
+    event = event or {}
+    time_left = (lambda: context.get_remaining_time_in_millis() / 1000) if context else None
+    s3_client = create_s3_client()
+    if event.get('full') or event.get('prefix'):
+        summary = compact_archive(s3_client, S3_BUCKET_NAME, event.get('prefix', ''),
+                                  start_after=event.get('start_after'), time_left=time_left)
+    else:
+        summary = compact_recent(s3_client, S3_BUCKET_NAME, time_left=time_left)
+
+    logger.info(f"Compaction complete: {summary}")
+    return {
+        'statusCode': 200,
+        'body': summary
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact the BPM S3 archive')
+    parser.add_argument('--bucket', default=S3_BUCKET_NAME,
+                        help='Archive bucket name')
+    parser.add_argument('--full', action='store_true',
+                        help='Compact every settled day, not only the recent ones')
+    parser.add_argument('--prefix', default='',
+                        help='Only compact keys under this prefix (implies --full)')
+    parser.add_argument('--start-after',
+                        help='Resume a full run after this day prefix (its resume_after)')
+    parser.add_argument('--endpoint-url', default=S3_ENDPOINT_URL,
+                        help='S3 endpoint (for a local S3 stand-in)')
+    parser.add_argument('--delete-sources', action='store_true',
+                        help='Delete raw objects after compaction')
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    s3_client = create_s3_client(args.endpoint_url)
+    delete_sources = args.delete_sources or DELETE_SOURCES
+    if args.full or args.prefix:
+        summary = compact_archive(s3_client, args.bucket, args.prefix, delete_sources=delete_sources,
+                                  start_after=args.start_after)
+    else:
+        summary = compact_recent(s3_client, args.bucket, delete_sources=delete_sources)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""
+Archive Query
+Answers history and statistics queries from the S3 archive.
+
+Measurements are archived by bpm_processor under
+user_id/device_id/year/month/day/ and compacted daily by archive_compactor
+into one indexed file per day. Queries:
+1. Prune the (device, day) partitions to read from the key layout alone
+2. Read a compacted day with one ranged GET of the minutes needed, and
+   fall back to the raw objects for days (or readings) not compacted yet
+3. Fetch partitions in parallel with a thread pool
+4. Merge or aggregate the readings as they stream in, so memory is
+   bounded by the partitions in flight, not by the length of the range
+
+It can also be run locally against any S3 compatible endpoint:
+    python archive_query.py --bucket my-bucket --user-id u1 --start 2024-01-01 --end 2024-02-01 --stats --endpoint-url http://localhost:9000
+"""
+
+import argparse
+import heapq
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from archive_compactor import (
+    COMPACTED_PREFIX,
+    compacted_keys,
+    create_s3_client,
+    load_index,
+    parse_timestamp,
+    read_compacted_range
+)
+
+# Partitions (device, day) fetched concurrently
+DEFAULT_MAX_WORKERS = 8
+# Same histogram buckets as the bpm_processor rollups
+HISTOGRAM_BUCKET_WIDTH = 10
+
+
+def list_device_ids(s3_client, bucket: str, user_id: str) -> list:
+    """
+    List the devices that have archived readings for a user.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        user_id: User identifier
+
+    Returns:
+        List of device IDs
+    """
+    devices = set()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for prefix in (f"{user_id}/", f"{COMPACTED_PREFIX}{user_id}/"):
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+            for common in page.get('CommonPrefixes', []):
+                devices.add(common['Prefix'][len(prefix):].rstrip('/'))
+    return sorted(devices)
+
+
+def day_prefixes(user_id: str, device_id: str, start: datetime, end: datetime) -> list:
+    """
+    List the day prefixes covering [start, end] without touching S3.
+
+    Args:
+        user_id: User identifier
+        device_id: Device identifier
+        start: Range start (UTC)
+        end: Range end (UTC)
+
+    Returns:
+        List of user_id/device_id/yyyy/mm/dd/ prefixes
+    """
+    prefixes = []
+    day = start.astimezone(timezone.utc).date()
+    last_day = end.astimezone(timezone.utc).date()
+    while day <= last_day:
+        prefixes.append(f"{user_id}/{device_id}/{day.year}/{day.month:02d}/{day.day:02d}/")
+        day += timedelta(days=1)
+    return prefixes
+
+
+def day_start_of(day_prefix: str) -> datetime:
+    """Return midnight UTC of a user_id/device_id/yyyy/mm/dd/ prefix."""
+    _, _, year, month, day = day_prefix.rstrip('/').split('/')
+    return datetime(int(year), int(month), int(day), tzinfo=timezone.utc)
+
+
+def iter_raw_day(s3_client, bucket: str, day_prefix: str, start: datetime, end: datetime):
+    """
+    Stream the raw (per-reading) objects of a day within [start, end].
+
+    Raw keys are named HHMMSSffffff.json, so the listing is in time order:
+    it starts at the range and stops past it without reading other keys.
+
+    Yields:
+        Measurement dicts in time order
+    """
+    day_start = day_start_of(day_prefix)
+    first_key = day_prefix
+    last_key = f"{day_prefix}~"
+    if start > day_start:
+        first_key += start.strftime('%H%M%S%f')
+    if end < day_start + timedelta(days=1):
+        last_key = f"{day_prefix}{end.strftime('%H%M%S%f')}~"
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=day_prefix, StartAfter=first_key):
+        for obj in page.get('Contents', []):
+            if obj['Key'] > last_key:
+                return
+            response = s3_client.get_object(Bucket=bucket, Key=obj['Key'])
+            record = json.loads(response['Body'].read())
+            if start <= parse_timestamp(record['timestamp']) <= end:
+                yield record
+
+
+def iter_device_day(s3_client, bucket: str, day_prefix: str, start: datetime, end: datetime):
+    """
+    Stream the readings of one device and day within [start, end].
+
+    The compacted file is used when the day has one. Raw objects are still
+    read for readings it cannot contain: everything when the day was never
+    compacted, late arrivals when its sources were deleted, and readings
+    after its last timestamp when the sources were kept.
+
+    Yields:
+        Measurement dicts in time order
+    """
+    _, index_key = compacted_keys(day_prefix)
+    index = load_index(s3_client, bucket, index_key)
+    if not index:
+        yield from iter_raw_day(s3_client, bucket, day_prefix, start, end)
+        return
+
+    compacted = read_compacted_range(s3_client, bucket, day_prefix, start, end, index=index)
+    raw_start = start
+    if index.get('sources_count') and index.get('last_timestamp'):
+        raw_start = max(start, parse_timestamp(index['last_timestamp']))
+    raw = iter_raw_day(s3_client, bucket, day_prefix, raw_start, end)
+
+    # Late arrivals can be older than compacted readings, and a reading can
+    # be both compacted and still present as a raw object
+    previous = None
+    for record in heapq.merge(compacted, raw, key=lambda r: parse_timestamp(r['timestamp'])):
+        if record['timestamp'] == previous:
+            continue
+        previous = record['timestamp']
+        yield record
+
+
+def record_key(record: dict) -> tuple:
+    """Sort key of a reading: (timestamp, device_id)."""
+    return parse_timestamp(record['timestamp']), record.get('device_id', '')
+
+
+def fetch_partition(s3_client, bucket: str, day_prefix: str,
+                    start: datetime, end: datetime) -> list:
+    """Read one (device, day) partition into a time-ordered list."""
+    return list(iter_device_day(s3_client, bucket, day_prefix, start, end))
+
+
+def plan_partitions(s3_client, bucket: str, user_id: str, start: datetime,
+                    end: datetime, device_id: str = None) -> list:
+    """
+    List the day prefixes to read, grouped by day.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        user_id: User identifier
+        start: Range start (UTC)
+        end: Range end (UTC)
+        device_id: Optional device filter
+
+    Returns:
+        List of days, each a list of day prefixes (one per device)
+    """
+    device_ids = [device_id] if device_id else list_device_ids(s3_client, bucket, user_id)
+    per_device = [day_prefixes(user_id, d, start, end) for d in device_ids]
+    return [list(day) for day in zip(*per_device)]
+
+
+def iter_partition_lists(s3_client, bucket: str, partitions: list, start: datetime,
+                         end: datetime, max_workers: int = DEFAULT_MAX_WORKERS):
+    """
+    Fetch partitions in parallel and yield their lists in the given order.
+
+    At most max_workers partitions are in flight or buffered at a time;
+    closing the generator early cancels the ones not started yet.
+
+    Yields:
+        Time-ordered reading lists, one per partition
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    try:
+        for day_prefix in partitions:
+            pending.append(executor.submit(fetch_partition, s3_client, bucket, day_prefix, start, end))
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_archive_range(s3_client, bucket: str, user_id: str,
+                       start: datetime, end: datetime, device_id: str = None,
+                       newest_first: bool = False, max_workers: int = DEFAULT_MAX_WORKERS):
+    """
+    Stream a user's archived readings within [start, end] in time order.
+
+    Partitions are fetched in parallel ahead of the reader, and the devices
+    of each day are merged as the day completes.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        user_id: User identifier
+        start: Range start (timezone aware)
+        end: Range end (timezone aware)
+        device_id: Optional device filter
+        newest_first: Yield readings in descending time order
+        max_workers: Partitions fetched concurrently
+
+    Yields:
+        Measurement dicts
+    """
+    start = start.astimezone(timezone.utc)
+    end = end.astimezone(timezone.utc)
+    days = plan_partitions(s3_client, bucket, user_id, start, end, device_id)
+    if newest_first:
+        days.reverse()
+
+    partitions = [day_prefix for day in days for day_prefix in day]
+    lists = iter_partition_lists(s3_client, bucket, partitions, start, end, max_workers)
+    for day in days:
+        device_lists = [next(lists) for _ in day]
+        merged = heapq.merge(*device_lists, key=record_key)
+        if newest_first:
+            merged = reversed(list(merged))
+        yield from merged
+
+
+class StatsAccumulator:
+    """
+    Streaming BPM statistics, mergeable across partitions.
+
+    Produces the same fields as the rollup statistics of the API handler.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.total_sq = 0
+        self.min_bpm = None
+        self.max_bpm = None
+        self.histogram = {}
+        self.status_counts = {}
+
+    def add(self, record: dict):
+        """Fold one reading into the statistics."""
+        bpm = int(record['bpm'])
+        self.count += 1
+        self.total += bpm
+        self.total_sq += bpm * bpm
+        self.min_bpm = bpm if self.min_bpm is None else min(self.min_bpm, bpm)
+        self.max_bpm = bpm if self.max_bpm is None else max(self.max_bpm, bpm)
+
+        bucket = bpm // HISTOGRAM_BUCKET_WIDTH * HISTOGRAM_BUCKET_WIDTH
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+        status = (record.get('classification') or record).get('status')
+        if status:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def merge(self, other: 'StatsAccumulator'):
+        """Fold another accumulator into this one."""
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min_bpm = other.min_bpm if self.min_bpm is None else min(self.min_bpm, other.min_bpm)
+        self.max_bpm = other.max_bpm if self.max_bpm is None else max(self.max_bpm, other.max_bpm)
+        for bucket, count in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+        for status, count in other.status_counts.items():
+            self.status_counts[status] = self.status_counts.get(status, 0) + count
+
+    def result(self) -> dict:
+        """
+        Return the statistics.
+
+        Returns:
+            Dict with count, min/max/avg/std, histogram and status counts,
+            or None if no reading was added
+        """
+        if self.count == 0:
+            return None
+
+        mean = self.total / self.count
+        variance = max(self.total_sq / self.count - mean * mean, 0.0)
+
+        return {
+            'count': self.count,
+            'min_bpm': self.min_bpm,
+            'max_bpm': self.max_bpm,
+            'avg_bpm': round(mean, 2),
+            'std_bpm': round(variance ** 0.5, 2),
+            'histogram': {str(b): c for b, c in sorted(self.histogram.items())},
+            'status_counts': self.status_counts
+        }
+
+
+def aggregate_partition(s3_client, bucket: str, day_prefix: str,
+                        start: datetime, end: datetime) -> StatsAccumulator:
+    """Aggregate one (device, day) partition without keeping its readings."""
+    stats = StatsAccumulator()
+    for record in iter_device_day(s3_client, bucket, day_prefix, start, end):
+        stats.add(record)
+    return stats
+
+
+def archive_statistics(s3_client, bucket: str, user_id: str, start: datetime,
+                       end: datetime, device_id: str = None,
+                       max_workers: int = DEFAULT_MAX_WORKERS) -> dict:
+    """
+    Compute BPM statistics over an archived range.
+
+    Every partition is aggregated by a worker as it streams in; only the
+    per-partition accumulators are combined. At most max_workers partitions
+    are in flight at a time, as in iter_partition_lists.
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: Archive bucket
+        user_id: User identifier
+        start: Range start (timezone aware)
+        end: Range end (timezone aware)
+        device_id: Optional device filter
+        max_workers: Partitions aggregated concurrently
+
+    Returns:
+        Dict with the statistics (None if the range is empty) and the
+        number of partitions read
+    """
+    start = start.astimezone(timezone.utc)
+    end = end.astimezone(timezone.utc)
+    partitions = [
+        day_prefix
+        for day in plan_partitions(s3_client, bucket, user_id, start, end, device_id)
+        for day_prefix in day
+    ]
+
+    total = StatsAccumulator()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    try:
+        for day_prefix in partitions:
+            pending.append(executor.submit(aggregate_partition, s3_client, bucket, day_prefix, start, end))
+            if len(pending) >= max_workers:
+                total.merge(pending.popleft().result())
+        while pending:
+            total.merge(pending.popleft().result())
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return {
+        'statistics': total.result(),
+        'partitions': len(partitions)
+    }
+
+
+def main():
+    """Run a query from the command line (e.g. against MinIO or LocalStack)."""
+    parser = argparse.ArgumentParser(description='Query the BPM S3 archive')
+    parser.add_argument('--bucket', required=True, help='Archive bucket name')
+    parser.add_argument('--user-id', required=True, help='User identifier')
+    parser.add_argument('--start', required=True, help='Range start (ISO 8601)')
+    parser.add_argument('--end', required=True, help='Range end (ISO 8601)')
+    parser.add_argument('--device-id', help='Only read this device')
+    parser.add_argument('--stats', action='store_true', help='Print statistics instead of readings')
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help='Parallel partitions')
+    parser.add_argument('--endpoint-url', help='S3 endpoint (MinIO, LocalStack, ...)')
+    args = parser.parse_args()
+
+    def parse_bound(value):
+        parsed = parse_timestamp(value)
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+    s3_client = create_s3_client(args.endpoint_url)
+    start, end = parse_bound(args.start), parse_bound(args.end)
+
+    if args.stats:
+        result = archive_statistics(
+            s3_client, args.bucket, args.user_id, start, end, args.device_id, args.workers
+        )
+        print(json.dumps(result, indent=2))
+        return
+
+    for record in iter_archive_range(
+        s3_client, args.bucket, args.user_id, start, end, args.device_id,
+        max_workers=args.workers
+    ):
+        print(json.dumps(record))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+AWS Clients
+Lazily created boto3 clients, resources and DynamoDB tables.
+
+Clients used to be built at import time, so every cold start paid for all
+of them even on routes that never call a service. Here each one is built on
+first use and cached for the warm container. boto3's default session is not
+thread safe, so creation is serialized; the cached objects themselves are
+shared by the sink and query worker threads.
+
+AWS_BACKEND=memory or AWS_BACKEND=sqlite swaps every client for the local
+stand-ins of local_backend (development and benchmarks only).
+"""
+
+import os
+import threading
+import boto3
+
+_lock = threading.Lock()
+_clients = {}
+_tables = {}
+_config = None
+
+
+def configure(config):
+    """
+    Set the botocore Config used for every client created afterwards.
+
+    Args:
+        config: botocore.config.Config (e.g. connection pool size)
+    """
+    global _config
+    _config = config
+
+
+def selected_backend():
+    """Return the local backend selected by AWS_BACKEND, or None for AWS."""
+    backend = os.environ.get('AWS_BACKEND', 'aws')
+    if backend == 'aws':
+        return None
+    import local_backend as local
+
+    return local.get_backend(backend)
+
+
+def get_client(service: str):
+    """
+    Return the cached low-level client of a service, creating it on first use.
+
+    Args:
+        service: Service name ('s3', 'sns', 'lambda', ...)
+
+    Returns:
+        boto3 client
+    """
+    client = _clients.get(('client', service))
+    if client is None:
+        with _lock:
+            client = _clients.get(('client', service))
+            if client is None:
+                local = selected_backend()
+                client = local.client(service) if local else boto3.client(service, config=_config)
+                _clients[('client', service)] = client
+    return client
+
+
+def get_resource(service: str):
+    """
+    Return the cached resource of a service, creating it on first use.
+
+    Args:
+        service: Service name ('dynamodb')
+
+    Returns:
+        boto3 service resource
+    """
+    resource = _clients.get(('resource', service))
+    if resource is None:
+        with _lock:
+            resource = _clients.get(('resource', service))
+            if resource is None:
+                local = selected_backend()
+                resource = local.resource(service) if local else boto3.resource(service, config=_config)
+                _clients[('resource', service)] = resource
+    return resource
+
+
+def get_table(name: str):
+    """
+    Return the cached DynamoDB Table object of a table.
+
+    Args:
+        name: Table name
+
+    Returns:
+        boto3 DynamoDB Table
+    """
+    table = _tables.get(name)
+    if table is None:
+        dynamodb = get_resource('dynamodb')
+        with _lock:
+            table = _tables.get(name)
+            if table is None:
+                table = dynamodb.Table(name)
+                _tables[name] = table
+    return table
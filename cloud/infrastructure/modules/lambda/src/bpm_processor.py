@@ -5,30 +5,63 @@ Processes incoming BPM measurements from IoT Core devices.
 This function:
 1. Validates incoming BPM data
 2. Classifies the BPM status (normal, warning, critical)
-3. Stores data in DynamoDB for real-time access
+3. Stores data in DynamoDB for real-time access (per reading or packed per time bucket)
 4. Archives data to S3 for historical analysis
-5. Triggers SNS alerts for abnormal readings
+5. Triggers SNS alerts on alert state transitions, one digest per user
+6. Maintains the latest reading per user and per device in the user state table
+7. Maintains minute/hour/day statistics rollups per user in the user state table
+8. Registers devices and refreshes their last reading in the devices table
+9. Drops redelivered readings (same device and timestamp) before they reach
+   the archive, rollups or alerts
+10. Emits end-to-end latency metrics (sensor to fog to Lambda to storage and
+    alert) in CloudWatch embedded metric format, once per invocation
+11. Accepts SQS and Kinesis batches (base64 and gzip bodies) and reports the
+    records whose readings could not be stored as batchItemFailures
 """
 
+import base64
+import gzip
 import json
 import os
+import random
+import time
 import logging
-from datetime import datetime, timezone
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime, timezone, timedelta
 from decimal import Decimal
-import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from aws_clients import configure, get_client, get_table
+from measurement_layout import (
+    MEASUREMENT_BUCKET_SECONDS,
+    bucket_sort_key,
+    bucket_update,
+    group_into_buckets,
+    packed_layout_enabled,
+    reading_offset
+)
 
 # Configure logging
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+# Fraction of invocations whose full event is logged at INFO level (with
+# LOG_LEVEL=DEBUG every event is)
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get('EVENT_LOG_SAMPLE_RATE', 0))
 
-# Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.client('s3')
-sns = boto3.client('sns')
+# Sinks (DynamoDB, S3, SNS) run concurrently on a pool shared by warm
+# invocations; every client gets enough connections for all workers.
+SINK_MAX_WORKERS = int(os.environ.get('SINK_MAX_WORKERS', 16))
+sink_executor = ThreadPoolExecutor(max_workers=SINK_MAX_WORKERS, thread_name_prefix='sink')
+
+# AWS clients are created on first use (aws_clients)
+configure(Config(max_pool_connections=SINK_MAX_WORKERS))
 
 # Environment variables
 DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
+USER_STATE_TABLE_NAME = os.environ.get('USER_STATE_TABLE_NAME')
+DEVICES_TABLE_NAME = os.environ.get('DEVICES_TABLE_NAME')
 S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
 
@@ -38,6 +71,51 @@ BPM_WARNING_LOW = int(os.environ.get('BPM_WARNING_LOW', 50))
 BPM_WARNING_HIGH = int(os.environ.get('BPM_WARNING_HIGH', 100))
 BPM_CRITICAL_HIGH = int(os.environ.get('BPM_CRITICAL_HIGH', 150))
 
+# Alert state settings
+ALERT_RENOTIFY_SECONDS = {
+    'warning': int(os.environ.get('ALERT_RENOTIFY_WARNING_SECONDS', 1800)),
+    'critical': int(os.environ.get('ALERT_RENOTIFY_CRITICAL_SECONDS', 300))
+}
+ALERT_NOTIFY_RECOVERY = os.environ.get('ALERT_NOTIFY_RECOVERY', 'true').lower() == 'true'
+ALERT_STATE_CACHE_SECONDS = int(os.environ.get('ALERT_STATE_CACHE_SECONDS', 60))
+ALERT_STATE_KEY = 'alert'
+LATEST_STATE_KEY = 'latest'
+DATA_VERSION_STATE_KEY = 'version'
+STATUS_RANK = {'normal': 0, 'warning': 1, 'critical': 2}
+
+# Rollups: sort key format and retention per granularity (None keeps forever)
+ROLLUP_GRANULARITIES = {
+    'minute': ('%Y-%m-%dT%H:%M', timedelta(days=2)),
+    'hour': ('%Y-%m-%dT%H', timedelta(days=90)),
+    'day': ('%Y-%m-%d', None)
+}
+ROLLUP_BUCKET_WIDTH = 10  # BPM per histogram bucket
+
+# Alert state cached in the warm container: user_id -> (state, expires_at)
+_alert_state_cache = {}
+
+# Device registry refresh interval; devices refreshed more recently by this
+# container are not written again: (user_id, device_id) -> refreshed_at
+DEVICE_REFRESH_SECONDS = int(os.environ.get('DEVICE_REFRESH_SECONDS', 60))
+_device_registry_cache = {}
+
+# Readings stored by this container, oldest first; fog retries and QoS 1
+# redeliveries of these are dropped without touching any sink
+DEDUP_CACHE_SIZE = int(os.environ.get('DEDUP_CACHE_SIZE', 50000))
+_stored_readings = OrderedDict()
+
+# Readings per bucket UpdateItem, bounded by the size of its condition expression
+BUCKET_APPEND_MAX = 100
+
+# First bytes of a gzip stream (compressed SQS / Kinesis record payloads)
+GZIP_MAGIC = b'\x1f\x8b'
+
+# End-to-end latency metrics in CloudWatch embedded metric format (EMF);
+# an EMF document holds at most 100 values per metric
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'BPMMonitoring')
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'bpm-processor')
+EMF_MAX_VALUES = 100
+
 
 def classify_bpm(bpm: int) -> dict:
     """
@@ -88,18 +166,64 @@ def validate_payload(payload: dict) -> tuple:
     return True, None
 
 
-def store_in_dynamodb(measurement: dict) -> bool:
+def reading_key(measurement: dict) -> tuple:
+    """Return the identity of a reading: (user_id, device_id, timestamp)."""
+    return (measurement['user_id'], measurement['device_id'], measurement['timestamp'])
+
+
+def drop_duplicates(measurements: list) -> tuple:
+    """
+    Drop readings repeated within the batch or already stored by this container.
+    
+    Args:
+        measurements: Validated measurements of this invocation
+        
+    Returns:
+        Tuple of (new measurements, number of duplicates dropped)
+    """
+    fresh = []
+    seen = set()
+    for measurement in measurements:
+        key = reading_key(measurement)
+        if key in seen or key in _stored_readings:
+            continue
+        seen.add(key)
+        fresh.append(measurement)
+    
+    return fresh, len(measurements) - len(fresh)
+
+
+def remember_stored(measurements: list):
+    """
+    Add stored readings to the container's duplicate cache.
+    
+    Args:
+        measurements: Measurements written to (or found in) the table
+    """
+    for measurement in measurements:
+        key = reading_key(measurement)
+        _stored_readings[key] = True
+        _stored_readings.move_to_end(key)
+    
+    while len(_stored_readings) > DEDUP_CACHE_SIZE:
+        _stored_readings.popitem(last=False)
+
+
+def store_in_dynamodb(measurement: dict):
     """
     Store BPM measurement in DynamoDB.
     
+    The write is conditional on the reading not being stored yet, so a
+    redelivered reading costs a failed condition instead of a second item.
+    
     Args:
         measurement: The measurement data to store
         
     Returns:
-        True if successful, False otherwise
+        List of readings found already stored, or None on error
     """
     try:
-        table = dynamodb.Table(DYNAMODB_TABLE_NAME)
+        table = get_table(DYNAMODB_TABLE_NAME)
         
         # Create composite sort key
         timestamp_device = f"{measurement['timestamp']}#{measurement['device_id']}"
@@ -123,13 +247,79 @@ def store_in_dynamodb(measurement: dict) -> bool:
             'created_at': datetime.now(timezone.utc).isoformat()
         }
         
-        table.put_item(Item=item)
-        logger.info(f"Stored measurement in DynamoDB for user {measurement['user_id']}")
-        return True
+        table.put_item(Item=item, ConditionExpression='attribute_not_exists(timestamp_device)')
+        logger.debug(f"Stored measurement in DynamoDB for user {measurement['user_id']}")
+        return []
         
     except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.debug(f"Duplicate measurement {timestamp_device} for user {measurement['user_id']}")
+            return [measurement]
         logger.error(f"Error storing in DynamoDB: {e}")
-        return False
+        return None
+
+
+def store_bucket_in_dynamodb(user_id: str, device_id: str, start: datetime,
+                             measurements: list):
+    """
+    Append the readings of one device and time bucket to its bucket item.
+    
+    Used with MEASUREMENT_LAYOUT=bucket: a single UpdateItem stores every
+    reading of the batch that falls in the bucket (BUCKET_APPEND_MAX per
+    update). If any of them is already stored the append fails; the stored
+    offsets are then read back and only the missing readings are appended.
+    
+    Args:
+        user_id: User identifier
+        device_id: Device identifier
+        start: Bucket start
+        measurements: Classified measurements of the bucket
+        
+    Returns:
+        List of readings found already stored, or None on error
+    """
+    try:
+        table = get_table(DYNAMODB_TABLE_NAME)
+        
+        # Calculate TTL (90 days from now; it is only set by the append that
+        # creates the bucket, so the bucket expires 90 days after its first write)
+        ttl = int(datetime.now(timezone.utc).timestamp()) + (90 * 24 * 60 * 60)
+        
+        duplicates = []
+        pending = list(measurements)
+        while pending:
+            chunk, pending = pending[:BUCKET_APPEND_MAX], pending[BUCKET_APPEND_MAX:]
+            try:
+                table.update_item(**bucket_update(
+                    user_id, device_id, start, chunk, ttl, MEASUREMENT_BUCKET_SECONDS
+                ))
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                
+                item = table.get_item(
+                    Key={'user_id': user_id, 'timestamp_device': bucket_sort_key(start, device_id)},
+                    ProjectionExpression='offsets',
+                    ConsistentRead=True
+                ).get('Item', {})
+                stored = {int(offset) for offset in item.get('offsets', [])}
+                found = [m for m in chunk if reading_offset(m, start) in stored]
+                if not found:
+                    raise
+                
+                # Retry with the missing readings; a concurrent append fails it again
+                duplicates.extend(found)
+                pending = [m for m in chunk if reading_offset(m, start) not in stored] + pending
+        
+        logger.debug(
+            f"Stored {len(measurements) - len(duplicates)} measurements in bucket for user {user_id}"
+            f" ({len(duplicates)} duplicates)"
+        )
+        return duplicates
+        
+    except ClientError as e:
+        logger.error(f"Error storing bucket in DynamoDB: {e}")
+        return None
 
 
 def archive_to_s3(measurement: dict) -> bool:
@@ -154,14 +344,14 @@ def archive_to_s3(measurement: dict) -> bool:
             f"{ts.strftime('%H%M%S%f')}.json"
         )
         
-        s3.put_object(
+        get_client('s3').put_object(
             Bucket=S3_BUCKET_NAME,
             Key=s3_key,
             Body=json.dumps(measurement),
             ContentType='application/json'
         )
         
-        logger.info(f"Archived measurement to S3: {s3_key}")
+        logger.debug(f"Archived measurement to S3: {s3_key}")
         return True
         
     except ClientError as e:
@@ -169,43 +359,425 @@ def archive_to_s3(measurement: dict) -> bool:
         return False
 
 
-def send_alert(measurement: dict) -> bool:
+def latest_readings(measurements: list) -> list:
+    """
+    Pick the newest measurement per user and per user/device of a batch.
+    
+    Args:
+        measurements: Measurements of this invocation
+        
+    Returns:
+        List of (state_key, measurement) tuples
+    """
+    latest = {}
+    for measurement in measurements:
+        user_id = measurement['user_id']
+        for state_key in (LATEST_STATE_KEY, f"{LATEST_STATE_KEY}#{measurement['device_id']}"):
+            current = latest.get((user_id, state_key))
+            if current is None or measurement['timestamp'] > current['timestamp']:
+                latest[(user_id, state_key)] = measurement
+    
+    return [(state_key, measurement) for (_, state_key), measurement in latest.items()]
+
+
+def update_latest_status(state_key: str, measurement: dict) -> bool:
     """
-    Send SNS alert for critical or warning BPM readings.
+    Upsert a latest-reading item unless a newer reading is already stored.
+    
+    Fog messages can arrive out of order; the write is conditional on the
+    stored timestamp being older so the item never moves back in time.
     
     Args:
+        state_key: 'latest' or 'latest#<device_id>'
         measurement: The measurement data with classification
         
+    Returns:
+        True if the item was written or is already newer, False on error
+    """
+    try:
+        table = get_table(USER_STATE_TABLE_NAME)
+        table.put_item(
+            Item={
+                'user_id': measurement['user_id'],
+                'state_key': state_key,
+                'device_id': measurement['device_id'],
+                'timestamp': measurement['timestamp'],
+                'bpm': Decimal(str(measurement['bpm'])),
+                'status': measurement['classification']['status'],
+                'severity': measurement['classification']['severity'],
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            },
+            ConditionExpression='attribute_not_exists(#ts) OR #ts < :ts',
+            ExpressionAttributeNames={'#ts': 'timestamp'},
+            ExpressionAttributeValues={':ts': measurement['timestamp']}
+        )
+        return True
+        
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return True  # A newer reading is already stored
+        logger.error(f"Error updating latest status: {e}")
+        return False
+
+
+def bump_data_version(user_id: str, stored: int) -> bool:
+    """
+    Advance a user's data version by the number of readings stored.
+    
+    Unlike the latest-reading item, it moves with every accepted reading,
+    including late ones inside past ranges, so the API handler can use it
+    to validate ETags of history and statistics responses.
+    
+    Args:
+        user_id: User identifier
+        stored: Readings of the user stored by this invocation
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    try:
+        table = get_table(USER_STATE_TABLE_NAME)
+        table.update_item(
+            Key={'user_id': user_id, 'state_key': DATA_VERSION_STATE_KEY},
+            UpdateExpression='ADD ingest_count :n SET updated_at = :now',
+            ExpressionAttributeValues={':n': stored, ':now': datetime.now(timezone.utc).isoformat()}
+        )
+        return True
+        
+    except ClientError as e:
+        logger.error(f"Error updating data version: {e}")
+        return False
+
+
+def register_device(measurement: dict) -> bool:
+    """
+    Register a device or refresh its last reading in the devices table.
+    
+    first_seen is only set on the first write. To keep write amplification
+    low, a device refreshed by this container within DEVICE_REFRESH_SECONDS
+    is skipped, so last_seen and last_bpm may lag by that interval.
+    
+    Args:
+        measurement: Newest measurement of the device in this batch
+        
+    Returns:
+        True if the device is registered, False on error
+    """
+    cache_key = (measurement['user_id'], measurement['device_id'])
+    now = time.time()
+    if now - _device_registry_cache.get(cache_key, 0) < DEVICE_REFRESH_SECONDS:
+        return True
+    
+    try:
+        table = get_table(DEVICES_TABLE_NAME)
+        table.update_item(
+            Key={'user_id': measurement['user_id'], 'device_id': measurement['device_id']},
+            UpdateExpression=(
+                'SET first_seen = if_not_exists(first_seen, :ts), '
+                'last_seen = :ts, last_bpm = :bpm, last_status = :status'
+            ),
+            ConditionExpression='attribute_not_exists(last_seen) OR last_seen < :ts',
+            ExpressionAttributeValues={
+                ':ts': measurement['timestamp'],
+                ':bpm': Decimal(str(measurement['bpm'])),
+                ':status': measurement['classification']['status']
+            }
+        )
+        
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return True  # A newer reading is already stored
+        logger.error(f"Error registering device: {e}")
+        return False
+    
+    _device_registry_cache[cache_key] = now
+    return True
+
+
+def aggregate_rollups(measurements: list) -> dict:
+    """
+    Aggregate the measurements of a batch into per-user rollup deltas.
+    
+    Args:
+        measurements: Measurements of this invocation
+        
+    Returns:
+        Dict of (user_id, state_key) to delta dict with count, sum, sum_sq,
+        values (distinct BPM values), hist (bucket to count) and ttl
+    """
+    rollups = {}
+    for measurement in measurements:
+        ts = datetime.fromisoformat(measurement['timestamp'].replace('Z', '+00:00'))
+        ts = ts.astimezone(timezone.utc)
+        bpm = measurement['bpm']
+        bucket = bpm // ROLLUP_BUCKET_WIDTH * ROLLUP_BUCKET_WIDTH
+        
+        for granularity, (key_format, retention) in ROLLUP_GRANULARITIES.items():
+            period = ts.strftime(key_format)
+            state_key = f"rollup#{granularity}#{period}"
+            delta = rollups.get((measurement['user_id'], state_key))
+            if delta is None:
+                ttl = None
+                if retention:
+                    period_start = datetime.strptime(period, key_format).replace(tzinfo=timezone.utc)
+                    ttl = int((period_start + retention).timestamp())
+                delta = {'count': 0, 'sum': 0, 'sum_sq': 0, 'values': set(), 'hist': {}, 'ttl': ttl}
+                rollups[(measurement['user_id'], state_key)] = delta
+            
+            delta['count'] += 1
+            delta['sum'] += bpm
+            delta['sum_sq'] += bpm * bpm
+            delta['values'].add(bpm)
+            delta['hist'][bucket] = delta['hist'].get(bucket, 0) + 1
+    
+    return rollups
+
+
+def update_rollup(user_id: str, state_key: str, delta: dict) -> bool:
+    """
+    Apply a rollup delta with a single atomic UpdateItem.
+    
+    Counters and histogram buckets are ADDed. Min and max cannot be ADDed,
+    so the distinct BPM values are kept in a number set instead (at most a
+    few hundred values) and min/max are taken from it when reading.
+    
+    Args:
+        user_id: User identifier
+        state_key: rollup#<granularity>#<period>
+        delta: Delta from aggregate_rollups
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    try:
+        table = get_table(USER_STATE_TABLE_NAME)
+        
+        names = {'#count': 'count', '#sum': 'sum', '#sum_sq': 'sum_sq', '#values': 'bpm_values'}
+        values = {
+            ':count': delta['count'],
+            ':sum': delta['sum'],
+            ':sum_sq': delta['sum_sq'],
+            ':values': set(delta['values'])
+        }
+        adds = ['#count :count', '#sum :sum', '#sum_sq :sum_sq', '#values :values']
+        
+        for bucket, count in delta['hist'].items():
+            names[f"#h{bucket}"] = f"hist_{bucket}"
+            values[f":h{bucket}"] = count
+            adds.append(f"#h{bucket} :h{bucket}")
+        
+        update_expression = 'ADD ' + ', '.join(adds)
+        if delta['ttl']:
+            names['#ttl'] = 'ttl'
+            values[':ttl'] = delta['ttl']
+            update_expression += ' SET #ttl = :ttl'
+        
+        table.update_item(
+            Key={'user_id': user_id, 'state_key': state_key},
+            UpdateExpression=update_expression,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+        return True
+        
+    except ClientError as e:
+        logger.error(f"Error updating rollup {state_key}: {e}")
+        return False
+
+
+def load_alert_state(user_id: str, refresh: bool = False) -> dict:
+    """
+    Load the alert state of a user, from the container cache when fresh.
+    
+    Args:
+        user_id: User identifier
+        refresh: Bypass the cache and read the table
+        
+    Returns:
+        Alert state dict (status 'normal' and version 0 if none stored)
+    """
+    cached = _alert_state_cache.get(user_id)
+    if cached and not refresh and cached[1] > time.time():
+        return cached[0]
+    
+    table = get_table(USER_STATE_TABLE_NAME)
+    response = table.get_item(
+        Key={'user_id': user_id, 'state_key': ALERT_STATE_KEY},
+        ConsistentRead=True
+    )
+    state = response.get('Item') or {
+        'user_id': user_id,
+        'state_key': ALERT_STATE_KEY,
+        'status': 'normal',
+        'severity': 'normal',
+        'last_alert_at': 0,
+        'version': 0
+    }
+    
+    _alert_state_cache[user_id] = (state, time.time() + ALERT_STATE_CACHE_SECONDS)
+    return state
+
+
+def save_alert_state(state: dict) -> bool:
+    """
+    Store a new alert state, guarded by its version number.
+    
+    The write only succeeds if nobody else updated the state since it was
+    read, so two containers cannot both notify the same transition.
+    
+    Args:
+        state: Alert state with the version it was read at
+        
+    Returns:
+        True if stored, False if the state changed concurrently
+    """
+    table = get_table(USER_STATE_TABLE_NAME)
+    expected_version = int(state['version'])
+    new_state = {**state, 'version': expected_version + 1}
+    
+    try:
+        table.put_item(
+            Item=new_state,
+            ConditionExpression='attribute_not_exists(version) OR version = :version',
+            ExpressionAttributeValues={':version': expected_version}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            _alert_state_cache.pop(state['user_id'], None)
+            return False
+        raise
+    
+    _alert_state_cache[state['user_id']] = (new_state, time.time() + ALERT_STATE_CACHE_SECONDS)
+    return True
+
+
+def restore_alert_state(state: dict):
+    """
+    Put back the alert state a failed notification replaced.
+    
+    The write is guarded by the version of the replacing state; if another
+    container has moved the state on since, its state is kept.
+    
+    Args:
+        state: Alert state as it was read before the notification
+    """
+    restored = {**state, 'version': int(state['version']) + 1}
+    if save_alert_state(restored):
+        logger.warning(f"Alert for user {state['user_id']} not sent, alert state restored")
+    else:
+        logger.warning(f"Alert for user {state['user_id']} not sent, alert state changed meanwhile")
+
+
+def evaluate_alert(state: dict, readings: list, now: float) -> tuple:
+    """
+    Decide whether a batch of readings for one user should be notified.
+    
+    Notifications are sent when the status escalates, when the severity
+    changes within the same status (e.g. low to high), when an abnormal
+    status persists longer than its re-notify interval, and optionally when
+    the user recovers.
+    
+    Args:
+        state: Current alert state of the user
+        readings: Measurements of the user in this batch, in time order
+        now: Current epoch time in seconds
+        
+    Returns:
+        Tuple of (reason or None, new state or None if unchanged)
+    """
+    abnormal = [r for r in readings if r['classification']['status'] != 'normal']
+    if abnormal:
+        # The worst reading of the batch wins, the latest one on ties
+        current = max(
+            abnormal,
+            key=lambda r: (STATUS_RANK[r['classification']['status']], r['timestamp'])
+        )
+    else:
+        current = readings[-1]
+    
+    status = current['classification']['status']
+    severity = current['classification']['severity']
+    previous_rank = STATUS_RANK.get(state.get('status', 'normal'), 0)
+    current_rank = STATUS_RANK[status]
+    
+    reason = None
+    if current_rank > previous_rank:
+        reason = 'escalation'
+    elif current_rank > 0 and current_rank == previous_rank:
+        if severity != state.get('severity'):
+            reason = 'transition'
+        elif now - float(state.get('last_alert_at', 0)) >= ALERT_RENOTIFY_SECONDS[status]:
+            reason = 'reminder'
+    elif current_rank == 0 and previous_rank > 0 and ALERT_NOTIFY_RECOVERY:
+        reason = 'recovered'
+    
+    if reason is None and severity == state.get('severity'):
+        return None, None
+    
+    new_state = {
+        **state,
+        'status': status,
+        'severity': severity,
+        'bpm': current['bpm'],
+        'device_id': current['device_id'],
+        'timestamp': current['timestamp'],
+        'updated_at': datetime.now(timezone.utc).isoformat()
+    }
+    if reason:
+        new_state['last_alert_at'] = int(now)
+        new_state['last_alert_reason'] = reason
+    
+    return reason, new_state
+
+
+def send_alert(user_id: str, readings: list, reason: str, state: dict) -> bool:
+    """
+    Send one SNS digest for the readings of a user in this batch.
+    
+    Args:
+        user_id: User identifier
+        readings: Measurements of the user in this batch, in time order
+        reason: Why the alert is sent (escalation, transition, reminder, recovered)
+        state: New alert state of the user
+        
     Returns:
         True if successful, False otherwise
     """
     try:
-        classification = measurement['classification']
+        abnormal = [r for r in readings if r['classification']['status'] != 'normal']
+        bpm_values = [r['bpm'] for r in readings]
+        status = state['status']
         
-        if classification['status'] == 'normal':
-            return True  # No alert needed
+        if reason == 'recovered':
+            summary = f"Recovered: BPM back to normal ({state['bpm']})"
+        else:
+            summary = f"{status.capitalize()}: {state['severity']} BPM ({state['bpm']})"
         
         message = {
-            'default': classification['message'],
+            'default': summary,
             'email': (
-                f"BPM Alert for User: {measurement['user_id']}\n"
-                f"Device: {measurement['device_id']}\n"
-                f"BPM: {measurement['bpm']}\n"
-                f"Status: {classification['status'].upper()}\n"
-                f"Time: {measurement['timestamp']}\n"
+                f"BPM Alert for User: {user_id}\n"
+                f"Device: {state['device_id']}\n"
+                f"BPM: {state['bpm']}\n"
+                f"Status: {status.upper()} ({reason})\n"
+                f"Time: {state['timestamp']}\n"
+                f"\nReadings in this update: {len(readings)} "
+                f"({len(abnormal)} abnormal), "
+                f"BPM range {min(bpm_values)}-{max(bpm_values)}, "
+                f"from {readings[0]['timestamp']} to {readings[-1]['timestamp']}\n"
                 f"\nPlease take appropriate action."
             ),
-            'sms': f"BPM Alert: {classification['message']} - User: {measurement['user_id']}"
+            'sms': f"BPM Alert: {summary} - User: {user_id}"
         }
         
-        sns.publish(
+        get_client('sns').publish(
             TopicArn=SNS_TOPIC_ARN,
             Message=json.dumps(message),
             MessageStructure='json',
-            Subject=f"BPM Alert: {classification['status'].upper()}"
+            Subject=f"BPM Alert: {'RECOVERED' if reason == 'recovered' else status.upper()}"
         )
         
-        logger.info(f"Sent {classification['status']} alert for user {measurement['user_id']}")
+        logger.info(f"Sent {status} alert ({reason}) for user {user_id}")
         return True
         
     except ClientError as e:
@@ -213,26 +785,305 @@ def send_alert(measurement: dict) -> bool:
         return False
 
 
+def group_readings_by_user(measurements: list) -> dict:
+    """
+    Group the measurements of a batch per user, in time order.
+    
+    Args:
+        measurements: Measurements of this invocation
+        
+    Returns:
+        Dict of user_id to list of measurements
+    """
+    by_user = {}
+    for measurement in measurements:
+        by_user.setdefault(measurement['user_id'], []).append(measurement)
+    
+    for readings in by_user.values():
+        readings.sort(key=lambda r: r['timestamp'])
+    
+    return by_user
+
+
+def process_user_alerts(user_id: str, readings: list) -> bool:
+    """
+    Update the alert state of a user and notify a transition.
+    
+    Readings are coalesced so a batch produces at most one notification
+    per user. A user whose batch holds only normal readings and whose
+    cached state (while fresh) is normal costs no table access.
+    
+    The new state is saved before publishing, so that only the container
+    whose versioned write wins notifies the transition. If the publish
+    fails, the previous state is restored, so the next readings raise the
+    alert again instead of being rate limited.
+    
+    Args:
+        user_id: User identifier
+        readings: Measurements of the user in this batch, in time order
+        
+    Returns:
+        True if an alert was sent
+    """
+    all_normal = all(r['classification']['status'] == 'normal' for r in readings)
+    
+    try:
+        # Retry once against a fresh read if another container won the race
+        for refresh in (False, True):
+            state = load_alert_state(user_id, refresh=refresh)
+            if all_normal and state.get('status') == 'normal':
+                return False
+            
+            reason, new_state = evaluate_alert(state, readings, time.time())
+            if new_state is None:
+                return False
+            if not save_alert_state(new_state):
+                continue
+            if not reason:
+                return False
+            
+            sent = False
+            try:
+                sent = send_alert(user_id, readings, reason, new_state)
+            finally:
+                if not sent:
+                    restore_alert_state(state)
+            return sent
+            
+    except ClientError as e:
+        logger.error(f"Error updating alert state for user {user_id}: {e}")
+    
+    return False
+
+
+def wait_for_sink(future, sink: str) -> bool:
+    """
+    Wait for a sink task and turn unexpected exceptions into a failure.
+    
+    Args:
+        future: Future returned by sink_executor.submit
+        sink: Sink name for logging
+        
+    Returns:
+        The task result, or False if it raised
+    """
+    try:
+        return future.result()
+    except Exception as e:
+        logger.error(f"Error in {sink} sink: {e}")
+        return False
+
+
+def epoch_seconds(timestamp: str):
+    """
+    Convert an ISO 8601 timestamp to epoch seconds.
+    
+    Args:
+        timestamp: Timestamp from a device or the fog
+        
+    Returns:
+        Epoch seconds, or None if missing or malformed
+    """
+    try:
+        ts = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def record_completion(completed_at: dict, future):
+    """
+    Done callback storing when a sink task finished.
+    
+    Waiters are woken before callbacks run, so a reader may find no entry
+    yet; it then uses the current time, which is at most a few microseconds
+    later.
+    """
+    completed_at[future] = time.time()
+
+
+def ingest_latencies(measurements: list, received_at: float) -> dict:
+    """
+    Compute the sensor to fog and fog to Lambda latency of each reading.
+    
+    Device clocks may drift from the fog and AWS clocks, so values can be
+    skewed (even negative); they are reported as measured.
+    
+    Args:
+        measurements: Measurements of this invocation
+        received_at: Epoch time the invocation started
+        
+    Returns:
+        Dict of metric name to latencies in milliseconds
+    """
+    latencies = {'SensorToFogLatency': [], 'FogToLambdaLatency': []}
+    for measurement in measurements:
+        sensor = epoch_seconds(measurement.get('timestamp'))
+        fog = epoch_seconds(measurement.get('fog_timestamp'))
+        if fog is None:
+            continue  # Sent without the fog
+        if sensor is not None:
+            latencies['SensorToFogLatency'].append(round((fog - sensor) * 1000, 1))
+        latencies['FogToLambdaLatency'].append(round((received_at - fog) * 1000, 1))
+    
+    return latencies
+
+
+def emit_latency_metrics(latencies: dict):
+    """
+    Write latency samples as CloudWatch embedded metric format log lines.
+    
+    All metrics of the invocation share one document; batches with more
+    than EMF_MAX_VALUES samples of a metric are split over several.
+    
+    Args:
+        latencies: Dict of metric name to latencies in milliseconds
+    """
+    latencies = {name: values for name, values in latencies.items() if values}
+    if not latencies:
+        return
+    
+    documents = -(-max(len(values) for values in latencies.values()) // EMF_MAX_VALUES)
+    for index in range(documents):
+        chunk = {
+            name: values[index * EMF_MAX_VALUES:(index + 1) * EMF_MAX_VALUES]
+            for name, values in latencies.items()
+        }
+        chunk = {name: values for name, values in chunk.items() if values}
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in chunk]
+                }]
+            },
+            'FunctionName': FUNCTION_NAME,
+            **chunk
+        }
+        # EMF is parsed from raw JSON lines on stdout, not from logger output
+        print(json.dumps(document), flush=True)
+
+
+def is_record_batch(event) -> bool:
+    """Check whether an event is an SQS or Kinesis 'Records' batch."""
+    return isinstance(event, dict) and isinstance(event.get('Records'), list)
+
+
+def decode_record_data(data: str, always_base64: bool):
+    """
+    Decode the payload of an SQS or Kinesis record.
+    
+    SQS bodies are JSON, or base64 when the IoT rule action sets use_base64;
+    Kinesis data is always base64. Either may be gzip compressed.
+    
+    Args:
+        data: Record body (SQS) or data (Kinesis)
+        always_base64: Whether the data is always base64 encoded
+        
+    Returns:
+        Decoded payload (one message or a list of messages)
+    """
+    if not always_base64:
+        try:
+            return json.loads(data)
+        except ValueError:
+            pass
+    
+    raw = base64.b64decode(data, validate=True)
+    if raw[:2] == GZIP_MAGIC:
+        raw = gzip.decompress(raw)
+    return json.loads(raw)
+
+
+def event_messages(event) -> tuple:
+    """
+    Flatten an invocation event into BPM messages.
+    
+    IoT Core invokes the function with one message (or a list of them);
+    SQS and Kinesis event source mappings deliver a batch of 'Records',
+    each holding one message or a list of messages.
+    
+    Args:
+        event: The incoming event
+        
+    Returns:
+        Tuple of (messages, batch item identifier of each message (None
+        for direct invocations), number of undecodable records)
+    """
+    if not is_record_batch(event):
+        messages = event if isinstance(event, list) else [event]
+        return messages, [None] * len(messages), 0
+    
+    messages = []
+    identifiers = []
+    undecodable = 0
+    for record in event['Records']:
+        try:
+            if 'kinesis' in record:
+                identifier = record['kinesis']['sequenceNumber']
+                payload = decode_record_data(record['kinesis']['data'], True)
+            else:
+                identifier = record['messageId']
+                payload = decode_record_data(record['body'], False)
+        except Exception as e:
+            # A retry cannot fix a malformed record: count it as an error
+            logger.error(f"Undecodable record: {e}")
+            undecodable += 1
+            continue
+        
+        batch = payload if isinstance(payload, list) else [payload]
+        messages.extend(batch)
+        identifiers.extend([identifier] * len(batch))
+    
+    return messages, identifiers, undecodable
+
+
+def log_event(event, message_count: int):
+    """
+    Log an incoming event without serializing every batch.
+    
+    The full payload is only dumped at DEBUG level or for a sampled
+    fraction of invocations (EVENT_LOG_SAMPLE_RATE).
+    
+    Args:
+        event: The incoming event
+        message_count: Number of messages in the event
+    """
+    if logger.isEnabledFor(logging.DEBUG) or random.random() < EVENT_LOG_SAMPLE_RATE:
+        logger.info(f"Received event: {json.dumps(event, default=str)}")
+    else:
+        logger.info(f"Received {message_count} messages")
+
+
 def lambda_handler(event, context):
     """
     Main Lambda handler for processing BPM measurements.
     
     Args:
-        event: The incoming event from IoT Core
+        event: The incoming event from IoT Core (one message or a list), or
+            an SQS / Kinesis batch of records
         context: Lambda context object
         
     Returns:
-        Response dict with processing status
+        Response dict with processing status, plus batchItemFailures for
+        record batches (records to retry)
     """
-    logger.info(f"Received event: {json.dumps(event)}")
-    
+    received_at = time.time()
     processed = 0
-    errors = 0
+    measurements = []
     
-    # Handle both single messages and batches
-    messages = event if isinstance(event, list) else [event]
+    # Handle single messages, lists and event source batches
+    messages, identifiers, undecodable = event_messages(event)
+    errors = undecodable
+    log_event(event, len(messages))
+    # Batch item holding each reading, to retry only the failed records
+    record_of = {}
     
-    for message in messages:
+    for message, identifier in zip(messages, identifiers):
         try:
             # Validate payload
             is_valid, error = validate_payload(message)
@@ -246,38 +1097,133 @@ def lambda_handler(event, context):
             classification = classify_bpm(bpm)
             
             # Create measurement record
-            measurement = {
+            measurements.append({
                 **message,
                 'bpm': bpm,
                 'classification': classification
-            }
-            
-            # Store in DynamoDB
-            if not store_in_dynamodb(measurement):
-                errors += 1
-                continue
-            
-            # Archive to S3
-            archive_to_s3(measurement)  # Non-critical, continue even if fails
-            
-            # Send alerts if needed
-            if classification['status'] != 'normal':
-                send_alert(measurement)
-            
-            processed += 1
+            })
+            record_of.setdefault(reading_key(message), identifier)
             
         except Exception as e:
             logger.error(f"Error processing message: {e}")
             errors += 1
     
+    measurements, duplicates = drop_duplicates(measurements)
+    
+    # Fan out the idempotent sinks of the batch at once, so the invocation
+    # waits for the slowest sink instead of the sum of all round trips
+    if packed_layout_enabled():
+        store_futures = [
+            (sink_executor.submit(store_bucket_in_dynamodb, user_id, device_id, start, readings), readings)
+            for (user_id, device_id, start), readings in group_into_buckets(
+                measurements, MEASUREMENT_BUCKET_SECONDS
+            ).items()
+        ]
+    else:
+        store_futures = [(sink_executor.submit(store_in_dynamodb, m), [m]) for m in measurements]
+    latest_futures = [
+        sink_executor.submit(update_latest_status, state_key, m)
+        for state_key, m in latest_readings(measurements)
+    ]
+    device_futures = [
+        sink_executor.submit(register_device, m)
+        for state_key, m in latest_readings(measurements)
+        if state_key != LATEST_STATE_KEY
+    ]
+    
+    # Stage latencies are collected for the whole batch and emitted once
+    latencies = {**ingest_latencies(measurements, received_at),
+                 'LambdaToStoreLatency': [], 'LambdaToAlertLatency': []}
+    completed_at = {}
+    for future, _ in store_futures:
+        future.add_done_callback(partial(record_completion, completed_at))
+    
+    # A message is processed once it is stored; results are read in order
+    stored_duplicates = set()
+    failed_readings = set()
+    failed_records = set()
+    for future, readings in store_futures:
+        found = wait_for_sink(future, 'DynamoDB')
+        if found is None or found is False:  # Write error or sink exception
+            errors += len(readings)
+            failed_readings.update(reading_key(m) for m in readings)
+            failed_records.update(record_of[reading_key(m)] for m in readings)
+            continue
+        latencies['LambdaToStoreLatency'].append(round((completed_at.get(future, time.time()) - received_at) * 1000, 1))
+        processed += len(readings) - len(found)
+        duplicates += len(found)
+        stored_duplicates.update(reading_key(m) for m in found)
+        remember_stored(readings)
+    
+    # Archive, rollups and alerts are not idempotent: only readings this
+    # invocation stored go on to them, not those the table already held
+    measurements = [
+        m for m in measurements
+        if reading_key(m) not in stored_duplicates and reading_key(m) not in failed_readings
+    ]
+    archive_futures = [sink_executor.submit(archive_to_s3, m) for m in measurements]
+    rollup_futures = [
+        sink_executor.submit(update_rollup, user_id, state_key, delta)
+        for (user_id, state_key), delta in aggregate_rollups(measurements).items()
+    ]
+    alert_futures = [
+        sink_executor.submit(process_user_alerts, user_id, readings)
+        for user_id, readings in group_readings_by_user(measurements).items()
+    ]
+    for future in alert_futures:
+        future.add_done_callback(partial(record_completion, completed_at))
+    
+    # Archive, latest status, rollups and registry are non-critical, failures are only logged
+    for future in archive_futures:
+        wait_for_sink(future, 'S3')
+    
+    for future in latest_futures:
+        wait_for_sink(future, 'latest status')
+    
+    for future in rollup_futures:
+        wait_for_sink(future, 'rollup')
+    
+    # Advanced only once the readings are in the table, archive and rollups,
+    # so a client never holds a version newer than the data it was given
+    version_futures = [
+        sink_executor.submit(bump_data_version, user_id, len(readings))
+        for user_id, readings in group_readings_by_user(measurements).items()
+    ]
+    
+    for future in device_futures:
+        wait_for_sink(future, 'device registry')
+    
+    for future in version_futures:
+        wait_for_sink(future, 'data version')
+    
+    alerts = 0
+    for future in alert_futures:
+        if wait_for_sink(future, 'SNS'):
+            alerts += 1
+            latencies['LambdaToAlertLatency'].append(round((completed_at.get(future, time.time()) - received_at) * 1000, 1))
+    
+    emit_latency_metrics(latencies)
+    
     response = {
         'statusCode': 200,
         'body': {
             'processed': processed,
             'errors': errors,
-            'total': len(messages)
+            'alerts': alerts,
+            'duplicates': duplicates,
+            'total': len(messages) + undecodable
         }
     }
     
+    if is_record_batch(event):
+        # Only these records are retried (ReportBatchItemFailures); for
+        # Kinesis the shard resumes from the lowest failed sequence number.
+        # Their failed readings reached no other sink, and the ones stored
+        # now are found as duplicates on retry, so each is counted once
+        response['batchItemFailures'] = [
+            {'itemIdentifier': identifier}
+            for identifier in dict.fromkeys(identifiers) if identifier in failed_records
+        ]
+    
     logger.info(f"Processing complete: {response['body']}")
     return response
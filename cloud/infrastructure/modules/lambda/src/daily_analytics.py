@@ -0,0 +1,563 @@
+"""
+Daily Analytics Lambda Function
+Computes a daily heart rate report per user with NumPy.
+
+This function:
+1. Loads each user's day from the minute rollups of the user state table
+   (kept for two days) or, for older days, from the S3 archive
+2. Folds the day into a per-minute grid (count, sum, sum of squares) plus
+   the day's extremes and the time spent in each threshold band
+3. Analyzes the grids of many users at once with array operations: resting
+   heart rate, time in zone, hourly trend, variability and abnormal episodes
+4. Writes one report#YYYY-MM-DD item per user to the user state table,
+   served as is by GET /bpm/report
+
+Reports of days read from rollups have minute resolution: the time in zone
+is assigned by minute mean. Archive days use every reading.
+
+It can also be run locally (e.g. with AWS_BACKEND=memory):
+    python daily_analytics.py --date 2024-01-01 --user-id u1
+"""
+
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone, timedelta
+from decimal import Decimal
+from operator import itemgetter
+import numpy as np
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from archive_query import iter_archive_range
+from aws_clients import get_client, get_table
+from downsampling import parse_timestamps
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+
+# Environment variables
+USER_STATE_TABLE_NAME = os.environ.get('USER_STATE_TABLE_NAME')
+DEVICES_TABLE_NAME = os.environ.get('DEVICES_TABLE_NAME')
+S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+
+# Same thresholds as bpm_processor.classify_bpm
+BPM_CRITICAL_LOW = int(os.environ.get('BPM_CRITICAL_LOW', 40))
+BPM_WARNING_LOW = int(os.environ.get('BPM_WARNING_LOW', 50))
+BPM_WARNING_HIGH = int(os.environ.get('BPM_WARNING_HIGH', 100))
+BPM_CRITICAL_HIGH = int(os.environ.get('BPM_CRITICAL_HIGH', 150))
+ZONES = ['critical_low', 'warning_low', 'normal', 'warning_high', 'critical_high']
+NORMAL_ZONE = ZONES.index('normal')
+
+MINUTES_PER_DAY = 1440
+MINUTE_EDGES_MS = np.arange(MINUTES_PER_DAY + 1, dtype=np.int64) * 60000
+# A reading stands for the time until the next one, at most this long
+MAX_READING_SECONDS = 60
+# Resting heart rate: low percentile of the rolling mean over short windows
+RESTING_WINDOW_MINUTES = 5
+RESTING_MIN_MINUTES = 3
+RESTING_PERCENTILE = 10
+# Abnormal episode: consecutive minutes whose mean is outside the normal band
+EPISODE_MIN_MINUTES = int(os.environ.get('ANALYTICS_EPISODE_MIN_MINUTES', 5))
+
+# Users loaded concurrently, and analyzed per vectorized batch
+LOAD_WORKERS = int(os.environ.get('ANALYTICS_LOAD_WORKERS', 16))
+BATCH_USERS = int(os.environ.get('ANALYTICS_BATCH_USERS', 500))
+
+REPORT_KEY_PREFIX = 'report#'
+MINUTE_ROLLUP_PREFIX = 'rollup#minute#'
+
+
+def zone_of(bpm: np.ndarray) -> np.ndarray:
+    """
+    Map BPM values to threshold bands (indices into ZONES).
+
+    Args:
+        bpm: BPM values (any shape)
+
+    Returns:
+        int8 array of zone indices, with the boundaries of classify_bpm
+    """
+    return (
+        (bpm > BPM_CRITICAL_LOW).astype(np.int8)
+        + (bpm > BPM_WARNING_LOW)
+        + (bpm >= BPM_WARNING_HIGH)
+        + (bpm >= BPM_CRITICAL_HIGH)
+    )
+
+
+class DayGrid:
+    """One user-day as per-minute aggregates, day extremes and seconds per zone."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.count = np.zeros(MINUTES_PER_DAY)
+        self.total = np.zeros(MINUTES_PER_DAY)
+        self.total_sq = np.zeros(MINUTES_PER_DAY)
+        self.min_bpm = np.nan
+        self.max_bpm = np.nan
+        self.zone_seconds = np.zeros(len(ZONES))
+
+    @classmethod
+    def from_readings(cls, ts_ms: np.ndarray, bpm: np.ndarray, day_start: datetime) -> 'DayGrid':
+        """
+        Build the grid of a day from raw readings.
+
+        The readings are sorted by time (they usually already are), so the
+        minute boundaries come from one searchsorted and each minute is a
+        contiguous slice reduced with ufunc.reduceat, instead of a scatter
+        per reading. Few temporaries of the readings' length are allocated:
+        at 1 Hz a day is 86400 readings and the build is memory bound.
+
+        Args:
+            ts_ms: Epoch milliseconds of the readings
+            bpm: BPM of the readings
+            day_start: Midnight UTC of the day
+
+        Returns:
+            DayGrid
+        """
+        grid = cls('archive')
+        ts_ms = np.asarray(ts_ms, dtype=np.int64)
+        bpm = np.asarray(bpm, dtype=np.float64)
+        if len(ts_ms) > 1 and (ts_ms[1:] < ts_ms[:-1]).any():
+            order = np.argsort(ts_ms, kind='stable')
+            ts_ms, bpm = ts_ms[order], bpm[order]
+
+        edges = np.searchsorted(ts_ms, int(day_start.timestamp() * 1000) + MINUTE_EDGES_MS)
+        ts_ms, bpm = ts_ms[edges[0]:edges[-1]], bpm[edges[0]:edges[-1]]
+        if not len(bpm):
+            return grid
+
+        count = np.diff(edges)
+        present = np.flatnonzero(count)
+        starts = edges[present] - edges[0]
+        grid.count = count.astype(np.float64)
+        grid.total[present] = np.add.reduceat(bpm, starts)
+        grid.total_sq[present] = np.add.reduceat(bpm * bpm, starts)
+        grid.min_bpm, grid.max_bpm = bpm.min(), bpm.max()
+
+        # Each reading lasts until the next one (gaps capped, in ms); the
+        # last one lasts as long as the one before it
+        durations = np.diff(ts_ms)
+        np.minimum(durations, MAX_READING_SECONDS * 1000, out=durations)
+        zone = zone_of(bpm)
+        zone_ms = np.bincount(zone[:-1], weights=durations, minlength=len(ZONES))
+        zone_ms[zone[-1]] += durations[-1] if len(durations) else 1000
+        grid.zone_seconds = zone_ms / 1000.0
+        return grid
+
+    @classmethod
+    def from_rollups(cls, items: list, day: date) -> 'DayGrid':
+        """
+        Build the grid of a day from its minute rollup items.
+
+        Each attribute is read into an array in one pass over the items and
+        the minutes are parsed from the fixed width sort keys as a byte
+        array. The BPM sets of the minutes are only merged for the day
+        extremes, which is all the report needs from them.
+
+        Args:
+            items: rollup#minute#YYYY-MM-DDTHH:MM items of the day
+            day: The day
+
+        Returns:
+            DayGrid
+        """
+        grid = cls('rollups')
+        if not items:
+            return grid
+
+        # state_key is rollup#minute#YYYY-MM-DDTHH:MM
+        hour = len(MINUTE_ROLLUP_PREFIX) + 11
+        keys = np.array([item['state_key'] for item in items], dtype=f'S{hour + 5}')
+        digits = keys.view(np.uint8).reshape(len(items), hour + 5)[:, hour:].astype(np.int64) - ord('0')
+        minute = (digits[:, 0] * 10 + digits[:, 1]) * 60 + digits[:, 3] * 10 + digits[:, 4]
+
+        grid.count[minute] = np.fromiter(map(itemgetter('count'), items), np.float64, len(items))
+        grid.total[minute] = np.fromiter(map(itemgetter('sum'), items), np.float64, len(items))
+        grid.total_sq[minute] = np.fromiter(map(itemgetter('sum_sq'), items), np.float64, len(items))
+        values = set().union(*map(itemgetter('bpm_values'), items))
+        grid.min_bpm, grid.max_bpm = float(min(values)), float(max(values))
+
+        # Without the readings, each minute is spent in the zone of its mean
+        means = grid.total[minute] / grid.count[minute]
+        grid.zone_seconds = np.bincount(zone_of(means), minlength=len(ZONES)) * 60.0
+        return grid
+
+    def is_empty(self) -> bool:
+        return not self.count.any()
+
+
+def rolling_sum(values: np.ndarray, window: int) -> np.ndarray:
+    """Sum of each run of window consecutive columns, per row."""
+    cumulative = np.cumsum(values, axis=1)
+    cumulative = np.concatenate([np.zeros((values.shape[0], 1)), cumulative], axis=1)
+    return cumulative[:, window:] - cumulative[:, :-window]
+
+
+def row_percentile(values: np.ndarray, percentile: float) -> np.ndarray:
+    """
+    Percentile of the non-NaN values of each row (nearest rank).
+
+    np.nanpercentile falls back to a Python loop over rows; sorting with
+    NaN last and indexing each row's rank stays vectorized.
+
+    Returns:
+        Percentile per row (NaN for rows without values)
+    """
+    valid = (~np.isnan(values)).sum(axis=1)
+    ordered = np.sort(values, axis=1)
+    rank = np.clip(np.floor((valid - 1) * percentile / 100.0).astype(np.int64), 0, values.shape[1] - 1)
+    result = np.take_along_axis(ordered, rank[:, None], axis=1)[:, 0]
+    return np.where(valid > 0, result, np.nan)
+
+
+def runs(mask: np.ndarray, min_length: int) -> tuple:
+    """
+    Find runs of True of at least min_length columns in every row.
+
+    Rows are padded with False and flattened, so the run boundaries of
+    all rows come from one diff.
+
+    Returns:
+        Tuple of (run count, longest run, columns in runs) per row
+    """
+    rows, columns = mask.shape
+    padded = np.zeros((rows, columns + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded.ravel())
+    starts = np.flatnonzero(edges == 1)
+    lengths = np.flatnonzero(edges == -1) - starts
+    kept = lengths >= min_length
+    row = starts[kept] // (columns + 2)
+
+    count = np.bincount(row, minlength=rows)
+    longest = np.zeros(rows, dtype=np.int64)
+    np.maximum.at(longest, row, lengths[kept])
+    covered = np.bincount(row, weights=lengths[kept], minlength=rows)
+    return count, longest, covered
+
+
+def analyze(grids: list) -> dict:
+    """
+    Analyze the grids of many user-days at once.
+
+    Args:
+        grids: DayGrid per user-day
+
+    Returns:
+        Dict of metric name to array (one value per grid; NaN when the
+        day has too little data for the metric)
+    """
+    count = np.stack([g.count for g in grids])
+    total = np.stack([g.total for g in grids])
+    total_sq = np.stack([g.total_sq for g in grids])
+    zone_seconds = np.stack([g.zone_seconds for g in grids])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        readings = count.sum(axis=1)
+        mean = total.sum(axis=1) / readings
+        std = np.sqrt(np.maximum(total_sq.sum(axis=1) / readings - mean * mean, 0))
+        minute_mean = np.where(count > 0, total / count, np.nan)
+
+        # Resting heart rate over windows with enough minutes of data
+        window_count = rolling_sum(count, RESTING_WINDOW_MINUTES)
+        window_minutes = rolling_sum((count > 0).astype(np.float64), RESTING_WINDOW_MINUTES)
+        window_mean = np.where(window_minutes >= RESTING_MIN_MINUTES,
+                               rolling_sum(total, RESTING_WINDOW_MINUTES) / window_count, np.nan)
+        resting = row_percentile(window_mean, RESTING_PERCENTILE)
+
+        # Hourly means and their least squares slope (BPM per hour)
+        hourly_count = count.reshape(len(grids), 24, 60).sum(axis=2)
+        hourly_mean = np.where(hourly_count > 0,
+                               total.reshape(len(grids), 24, 60).sum(axis=2) / hourly_count, np.nan)
+        has_hour = ~np.isnan(hourly_mean)
+        hours = np.arange(24.0)
+        n = has_hour.sum(axis=1)
+        sum_x = (has_hour * hours).sum(axis=1)
+        sum_y = np.where(has_hour, hourly_mean, 0).sum(axis=1)
+        sum_xx = (has_hour * hours * hours).sum(axis=1)
+        sum_xy = np.where(has_hour, hourly_mean * hours, 0).sum(axis=1)
+        denominator = n * sum_xx - sum_x * sum_x
+        trend = np.where((n >= 2) & (denominator > 0), (n * sum_xy - sum_x * sum_y) / denominator, np.nan)
+
+        # Variability of successive minute means
+        steps = np.diff(minute_mean, axis=1)
+        has_step = ~np.isnan(steps)
+        step_count = has_step.sum(axis=1)
+        rmssd = np.where(step_count > 0,
+                         np.sqrt(np.where(has_step, steps * steps, 0).sum(axis=1) / step_count), np.nan)
+
+    minute_zone = np.where(np.isnan(minute_mean), NORMAL_ZONE, zone_of(np.nan_to_num(minute_mean)))
+    low_count, low_longest, low_minutes = runs(minute_zone < NORMAL_ZONE, EPISODE_MIN_MINUTES)
+    high_count, high_longest, high_minutes = runs(minute_zone > NORMAL_ZONE, EPISODE_MIN_MINUTES)
+
+    return {
+        'readings': readings,
+        'minutes_covered': (count > 0).sum(axis=1),
+        'mean_bpm': mean,
+        'std_bpm': std,
+        'min_bpm': np.array([g.min_bpm for g in grids]),
+        'max_bpm': np.array([g.max_bpm for g in grids]),
+        'resting_bpm': resting,
+        'rmssd_bpm': rmssd,
+        'trend_bpm_per_hour': trend,
+        'hourly_mean': hourly_mean,
+        'zone_seconds': zone_seconds,
+        'low_episodes': low_count,
+        'low_episode_minutes': low_minutes,
+        'longest_low_episode_minutes': low_longest,
+        'high_episodes': high_count,
+        'high_episode_minutes': high_minutes,
+        'longest_high_episode_minutes': high_longest
+    }
+
+
+def to_number(value, digits: int = 1):
+    """Convert a metric to a DynamoDB number (None for NaN or infinity)."""
+    value = float(value)
+    if not np.isfinite(value):
+        return None
+    return Decimal(str(round(value, digits)))
+
+
+def build_report(metrics: dict, index: int, user_id: str, day: date, source: str) -> dict:
+    """
+    Build the report item of one user-day from the analyze() arrays.
+
+    Args:
+        metrics: Result of analyze()
+        index: Position of the user-day in the analyzed batch
+        user_id: User identifier
+        day: Reported day
+        source: 'rollups' or 'archive'
+
+    Returns:
+        Item for the user state table
+    """
+    zone_seconds = metrics['zone_seconds'][index]
+    covered_seconds = zone_seconds.sum()
+
+    return {
+        'user_id': user_id,
+        'state_key': f"{REPORT_KEY_PREFIX}{day.isoformat()}",
+        'date': day.isoformat(),
+        'source': source,
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'readings': int(metrics['readings'][index]),
+        'minutes_covered': int(metrics['minutes_covered'][index]),
+        'mean_bpm': to_number(metrics['mean_bpm'][index]),
+        'std_bpm': to_number(metrics['std_bpm'][index]),
+        'min_bpm': to_number(metrics['min_bpm'][index]),
+        'max_bpm': to_number(metrics['max_bpm'][index]),
+        'resting_bpm': to_number(metrics['resting_bpm'][index]),
+        'rmssd_bpm': to_number(metrics['rmssd_bpm'][index], 2),
+        'trend_bpm_per_hour': to_number(metrics['trend_bpm_per_hour'][index], 2),
+        'hourly_mean': [to_number(v) for v in metrics['hourly_mean'][index]],
+        'time_in_zone_seconds': {zone: to_number(s, 0) for zone, s in zip(ZONES, zone_seconds)},
+        'time_in_zone_pct': {
+            zone: to_number(s * 100 / covered_seconds if covered_seconds else np.nan)
+            for zone, s in zip(ZONES, zone_seconds)
+        },
+        'episodes': {
+            'min_minutes': EPISODE_MIN_MINUTES,
+            'low': int(metrics['low_episodes'][index]),
+            'low_minutes': int(metrics['low_episode_minutes'][index]),
+            'longest_low_minutes': int(metrics['longest_low_episode_minutes'][index]),
+            'high': int(metrics['high_episodes'][index]),
+            'high_minutes': int(metrics['high_episode_minutes'][index]),
+            'longest_high_minutes': int(metrics['longest_high_episode_minutes'][index])
+        }
+    }
+
+
+def load_rollup_day(user_id: str, day: date) -> DayGrid:
+    """
+    Load a user's day from the minute rollups.
+
+    Args:
+        user_id: User identifier
+        day: Day to load
+
+    Returns:
+        DayGrid (empty if the rollups expired or never existed)
+    """
+    table = get_table(USER_STATE_TABLE_NAME)
+    prefix = f"{MINUTE_ROLLUP_PREFIX}{day.isoformat()}T"
+    params = {
+        'KeyConditionExpression': Key('user_id').eq(user_id) & Key('state_key').begins_with(prefix),
+        'ProjectionExpression': 'state_key, #count, #sum, sum_sq, bpm_values',
+        'ExpressionAttributeNames': {'#count': 'count', '#sum': 'sum'}
+    }
+    items = []
+    while True:
+        response = table.query(**params)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return DayGrid.from_rollups(items, day)
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def load_archive_day(user_id: str, day: date) -> DayGrid:
+    """
+    Load a user's day from the S3 archive (all devices).
+
+    Args:
+        user_id: User identifier
+        day: Day to load
+
+    Returns:
+        DayGrid (empty if nothing is archived for the day)
+    """
+    day_start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    day_end = day_start + timedelta(days=1) - timedelta(microseconds=1)
+
+    timestamps = []
+    bpms = []
+    # One worker: users are already loaded concurrently
+    for record in iter_archive_range(get_client('s3'), S3_BUCKET_NAME, user_id, day_start, day_end,
+                                     max_workers=1):
+        timestamps.append(record['timestamp'])
+        bpms.append(record['bpm'])
+
+    if not timestamps:
+        return DayGrid('archive')
+    return DayGrid.from_readings(parse_timestamps(timestamps), np.array(bpms, dtype=np.float64), day_start)
+
+
+def load_day(user_id: str, day: date, source: str = 'auto') -> DayGrid:
+    """
+    Load a user's day from rollups, the archive, or rollups then the archive.
+
+    Args:
+        user_id: User identifier
+        day: Day to load
+        source: 'rollups', 'archive' or 'auto'
+
+    Returns:
+        DayGrid
+    """
+    if source in ('rollups', 'auto'):
+        grid = load_rollup_day(user_id, day)
+        if source == 'rollups' or not grid.is_empty():
+            return grid
+    return load_archive_day(user_id, day)
+
+
+def list_user_ids() -> list:
+    """List the users with registered devices (scan of the devices table)."""
+    table = get_table(DEVICES_TABLE_NAME)
+    params = {'ProjectionExpression': 'user_id'}
+    user_ids = set()
+    while True:
+        response = table.scan(**params)
+        user_ids.update(item['user_id'] for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return sorted(user_ids)
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def generate_reports(user_ids: list, day: date, source: str = 'auto') -> dict:
+    """
+    Generate and store the daily reports of a set of users.
+
+    Days are loaded concurrently, analyzed BATCH_USERS at a time and
+    written with a batch writer.
+
+    Args:
+        user_ids: Users to report on
+        day: Reported day
+        source: 'rollups', 'archive' or 'auto'
+
+    Returns:
+        Dict with counts of written, empty (no data) and failed users
+    """
+    summary = {'written': 0, 'empty': 0, 'errors': 0}
+    table = get_table(USER_STATE_TABLE_NAME)
+
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        for offset in range(0, len(user_ids), BATCH_USERS):
+            batch = user_ids[offset:offset + BATCH_USERS]
+            loaded = []
+            for user_id, future in [(u, executor.submit(load_day, u, day, source)) for u in batch]:
+                try:
+                    grid = future.result()
+                except Exception as e:
+                    # One user's bad data or failed read must not stop the run
+                    logger.error(f"Error loading {user_id} {day}: {e}")
+                    summary['errors'] += 1
+                    continue
+                if grid.is_empty():
+                    summary['empty'] += 1
+                else:
+                    loaded.append((user_id, grid))
+
+            if not loaded:
+                continue
+            metrics = analyze([grid for _, grid in loaded])
+
+            reports = []
+            for index, (user_id, grid) in enumerate(loaded):
+                try:
+                    reports.append(build_report(metrics, index, user_id, day, grid.source))
+                except Exception as e:
+                    logger.error(f"Error building report of {user_id} {day}: {e}")
+                    summary['errors'] += 1
+
+            try:
+                with table.batch_writer() as writer:
+                    for report in reports:
+                        writer.put_item(Item=report)
+                summary['written'] += len(reports)
+            except ClientError as e:
+                logger.error(f"Error writing reports for {day}: {e}")
+                summary['errors'] += len(reports)
+
+    return summary
+
+
+def lambda_handler(event, context):
+    """
+    Scheduled Lambda handler for the daily reports.
+
+    Args:
+        event: Scheduled event, optionally with 'date' (defaults to
+            yesterday UTC), 'user_ids' (defaults to every registered user)
+            and 'source' ('auto', 'rollups' or 'archive')
+        context: Lambda context object
+
+    Returns:
+        Response dict with the report summary
+    """
+    event = event or {}
+    day = date.fromisoformat(event['date']) if event.get('date') else (
+        datetime.now(timezone.utc).date() - timedelta(days=1)
+    )
+    user_ids = event.get('user_ids') or list_user_ids()
+    summary = generate_reports(user_ids, day, event.get('source', 'auto'))
+
+    logger.info(f"Daily reports for {day}: {summary}")
+    return {
+        'statusCode': 200,
+        'body': {'date': day.isoformat(), 'users': len(user_ids), **summary}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate daily heart rate reports')
+    parser.add_argument('--date', help='Day to report (YYYY-MM-DD, default yesterday)')
+    parser.add_argument('--user-id', action='append', help='User to report on (repeatable, default all)')
+    parser.add_argument('--source', default='auto', choices=['auto', 'rollups', 'archive'],
+                        help='Where to read the day from')
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    result = lambda_handler({'date': args.date, 'user_ids': args.user_id, 'source': args.source}, None)
+    print(json.dumps(result['body']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Downsampling for BPM chart queries.
+
+Implements MinMaxLTTB: readings are streamed page by page into fine time
+buckets that keep only their minimum and maximum point, then
+largest-triangle-three-buckets (LTTB) picks the output points among those
+candidates. Memory is bounded by the number of requested points, not by
+the number of raw readings, and a per-bucket min/max envelope is returned
+so spikes stay visible even when LTTB does not select them.
+
+Requires NumPy (provided to the API handler through a Lambda layer).
+"""
+
+import numpy as np
+
+# Fine buckets per output point used for the min/max preselection
+MINMAX_RATIO = 4
+
+
+def parse_timestamps(timestamps: list) -> np.ndarray:
+    """
+    Parse ISO 8601 UTC timestamps into epoch milliseconds.
+
+    Args:
+        timestamps: ISO strings, optionally ending in 'Z'
+
+    Returns:
+        int64 array of epoch milliseconds
+    """
+    stripped = [ts[:-1] if ts.endswith('Z') else ts for ts in timestamps]
+    return np.array(stripped, dtype='datetime64[ms]').astype(np.int64)
+
+
+class MinMaxAccumulator:
+    """
+    Streaming min/max preselection over fixed time buckets.
+
+    Pages of readings can arrive in any order; each page is folded into
+    the bucket arrays with vectorized operations.
+    """
+
+    def __init__(self, start_ms: int, end_ms: int, buckets: int):
+        self.start_ms = start_ms
+        self.end_ms = max(end_ms, start_ms + 1)
+        self.buckets = buckets
+        self.count = 0
+        self.min_bpm = np.full(buckets, np.inf)
+        self.min_ts = np.zeros(buckets, dtype=np.int64)
+        self.max_bpm = np.full(buckets, -np.inf)
+        self.max_ts = np.zeros(buckets, dtype=np.int64)
+
+    def bucket_of(self, ts: np.ndarray) -> np.ndarray:
+        """Map epoch-ms timestamps to bucket indices."""
+        span = self.end_ms - self.start_ms
+        index = (ts - self.start_ms) * self.buckets // span
+        return np.clip(index, 0, self.buckets - 1)
+
+    def add(self, ts: np.ndarray, bpm: np.ndarray):
+        """
+        Fold a page of readings into the buckets.
+
+        Args:
+            ts: int64 epoch-ms timestamps
+            bpm: BPM values
+        """
+        if len(ts) == 0:
+            return
+        self.count += len(ts)
+        bpm = bpm.astype(np.float64)
+        bucket = self.bucket_of(ts)
+
+        # Sort by bucket then value: the first row of a bucket group is its
+        # minimum and the last row its maximum
+        order = np.lexsort((bpm, bucket))
+        sorted_bucket = bucket[order]
+        starts = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+        ends = np.r_[starts[1:], len(order)] - 1
+        groups = sorted_bucket[starts]
+
+        page_min = bpm[order[starts]]
+        page_max = bpm[order[ends]]
+
+        lower = page_min < self.min_bpm[groups]
+        self.min_bpm[groups[lower]] = page_min[lower]
+        self.min_ts[groups[lower]] = ts[order[starts]][lower]
+
+        higher = page_max > self.max_bpm[groups]
+        self.max_bpm[groups[higher]] = page_max[higher]
+        self.max_ts[groups[higher]] = ts[order[ends]][higher]
+
+    def candidates(self) -> tuple:
+        """
+        Return the preselected min and max points in time order.
+
+        Returns:
+            Tuple of (ts, bpm) arrays
+        """
+        filled = np.isfinite(self.min_bpm)
+        ts = np.concatenate([self.min_ts[filled], self.max_ts[filled]])
+        bpm = np.concatenate([self.min_bpm[filled], self.max_bpm[filled]])
+        order = np.argsort(ts, kind='stable')
+        ts, bpm = ts[order], bpm[order]
+
+        # A bucket with a single reading contributes the same point twice
+        keep = np.r_[True, (ts[1:] != ts[:-1]) | (bpm[1:] != bpm[:-1])]
+        return ts[keep], bpm[keep]
+
+    def envelope(self, groups: int) -> dict:
+        """
+        Reduce the buckets to a min/max envelope of `groups` time buckets.
+
+        Args:
+            groups: Number of envelope buckets (must divide the bucket count)
+
+        Returns:
+            Dict with bucket start timestamps and min/max lists (None if empty)
+        """
+        per_group = self.buckets // groups
+        group_min = self.min_bpm.reshape(groups, per_group).min(axis=1)
+        group_max = self.max_bpm.reshape(groups, per_group).max(axis=1)
+        starts = self.start_ms + np.arange(groups) * (self.end_ms - self.start_ms) // groups
+
+        return {
+            'timestamps': starts.tolist(),
+            'min': [None if np.isinf(v) else int(v) for v in group_min],
+            'max': [None if np.isinf(v) else int(v) for v in group_max]
+        }
+
+
+def lttb(ts: np.ndarray, values: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Select point indices with largest-triangle-three-buckets.
+
+    The first and last points are always kept. For every bucket the point
+    forming the largest triangle with the previously selected point and
+    the average of the next bucket is selected; the area computation is
+    vectorized over the bucket.
+
+    Args:
+        ts: Timestamps in ascending order
+        values: Values aligned with ts
+        threshold: Number of points to select
+
+    Returns:
+        Array of selected indices
+    """
+    n = len(ts)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = ts.astype(np.float64)
+    y = values.astype(np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+
+        area = np.abs(
+            (x[previous] - avg_x) * (y[lo:hi] - y[previous])
+            - (x[previous] - x[lo:hi]) * (avg_y - y[previous])
+        )
+        previous = lo + int(np.argmax(area))
+        selected[i + 1] = previous
+
+    return selected
+
+
+def downsample_pages(pages, start_ms: int, end_ms: int, points: int) -> dict:
+    """
+    Downsample a stream of measurement pages to about `points` points.
+
+    Args:
+        pages: Iterable of lists of items with 'timestamp' and 'bpm'
+        start_ms: Range start in epoch milliseconds
+        end_ms: Range end in epoch milliseconds
+        points: Number of output points
+
+    Returns:
+        Dict with raw_count, timestamps, bpm and envelope
+    """
+    accumulator = MinMaxAccumulator(start_ms, end_ms, points * MINMAX_RATIO)
+
+    for items in pages:
+        if not items:
+            continue
+        ts = parse_timestamps([item['timestamp'] for item in items])
+        bpm = np.fromiter((int(item['bpm']) for item in items), dtype=np.float64, count=len(items))
+        accumulator.add(ts, bpm)
+
+    ts, bpm = accumulator.candidates()
+    selected = lttb(ts, bpm, points)
+
+    return {
+        'raw_count': accumulator.count,
+        'timestamps': ts[selected].tolist(),
+        'bpm': bpm[selected].astype(np.int64).tolist(),
+        'envelope': accumulator.envelope(points)
+    }
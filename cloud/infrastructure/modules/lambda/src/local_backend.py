@@ -0,0 +1,1203 @@
+"""
+Local Backend
+In-memory and SQLite stand-ins for the AWS services used by the Lambdas.
+
+Selected with AWS_BACKEND=memory or AWS_BACKEND=sqlite (LOCAL_BACKEND_PATH
+names the SQLite file, in memory by default); aws_clients then returns
+these objects instead of boto3 ones, so bpm_processor.lambda_handler and
+api_handler.lambda_handler run unchanged without AWS:
+- DynamoDB: the measurements, user state and devices tables with their key
+  schema and the device-index / date-index GSIs. Key, condition, update
+  and projection expressions are evaluated as DynamoDB does for the
+  subset this code uses; queries and scans page at 1 MB and report
+  consumed read and write units with the DynamoDB sizing rules. TTL is
+  not applied.
+- S3: objects, ranged GETs, listings (prefix, delimiter, start-after,
+  pagination) and multipart uploads
+- SNS publish and Lambda invoke are recorded (invoke runs a handler
+  registered with register_function)
+
+Every request is counted in metrics(), which the fleet benchmark reports.
+This module is not packaged with the Lambdas.
+"""
+
+import bisect
+import copy
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+# Key schemas of the tables, by the environment variable holding their name
+TABLE_SCHEMAS = {
+    'DYNAMODB_TABLE_NAME': {
+        'hash_key': 'user_id',
+        'range_key': 'timestamp_device',
+        'indexes': {
+            'device-index': ('device_id', 'timestamp_device'),
+            'date-index': ('user_id', 'measurement_date')
+        }
+    },
+    'USER_STATE_TABLE_NAME': {'hash_key': 'user_id', 'range_key': 'state_key', 'indexes': {}},
+    'DEVICES_TABLE_NAME': {'hash_key': 'user_id', 'range_key': 'device_id', 'indexes': {}}
+}
+
+QUERY_PAGE_BYTES = 1024 * 1024
+READ_UNIT_BYTES = 4096
+WRITE_UNIT_BYTES = 1024
+LIST_MAX_KEYS = 1000
+# Index entries carry the table keys on top of the projected item
+INDEX_OVERHEAD_BYTES = 100
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def client_error(code: str, message: str, operation: str) -> ClientError:
+    """Build the ClientError boto3 raises for a service error code."""
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+# DynamoDB item sizes
+
+
+def attribute_size(value) -> int:
+    """
+    Return the stored size of an attribute value with the DynamoDB sizing rules.
+
+    Args:
+        value: Deserialized attribute value
+
+    Returns:
+        Size in bytes
+    """
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        digits = len(str(abs(Decimal(str(value)))).replace('.', '').lstrip('0')) or 1
+        return math.ceil(digits / 2) + 1
+    if isinstance(value, (set, frozenset)):
+        return sum(attribute_size(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(attribute_size(v) + 1 for v in value)
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode('utf-8')) + attribute_size(v) + 1 for k, v in value.items())
+    raise TypeError(f"Unsupported attribute type: {type(value).__name__}")
+
+
+def item_size(item: dict) -> int:
+    """Return the size of an item (attribute names plus values) in bytes."""
+    if not item:
+        return 0
+    return sum(len(name.encode('utf-8')) + attribute_size(value) for name, value in item.items())
+
+
+def normalize_item(item: dict) -> dict:
+    """
+    Validate and convert an item as boto3 does (ints to Decimal, no floats).
+
+    Args:
+        item: Item as passed to put_item
+
+    Returns:
+        Item with DynamoDB value types
+    """
+    return {name: _deserializer.deserialize(_serializer.serialize(value)) for name, value in item.items()}
+
+
+# Expressions
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<op><>|<=|>=|=|<|>|\(|\)|,|\+|-)
+  | (?P<name>\#[A-Za-z0-9_]+)
+  | (?P<value>:[A-Za-z0-9_]+)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+""", re.VERBOSE)
+KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'REMOVE', 'ADD', 'DELETE'}
+COMPARATORS = {'=', '<>', '<', '<=', '>', '>='}
+MISSING = object()
+
+
+def tokenize(expression: str) -> list:
+    """Split an expression into (kind, text) tokens."""
+    tokens = []
+    position = 0
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match:
+            raise client_error('ValidationException', f"Invalid expression near: {expression[position:]}",
+                               'Expression')
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'space':
+            continue
+        if kind == 'ident' and text.upper() in KEYWORDS:
+            kind, text = 'keyword', text.upper()
+        tokens.append((kind, text))
+    return tokens
+
+
+class ExpressionParser:
+    """
+    Recursive descent parser of DynamoDB expressions.
+
+    Attribute paths are top-level names (plain or #placeholders); nested
+    paths are not used by this code and are rejected.
+    """
+
+    def __init__(self, expression: str, names: dict = None, values: dict = None):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset: int = 0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, kind: str = None, text: str = None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (text and token[1] != text):
+            raise client_error('ValidationException', f"Unexpected token {token[1]!r}", 'Expression')
+        self.position += 1
+        return token
+
+    def accept(self, kind: str, text: str = None) -> bool:
+        token = self.peek()
+        if token[0] == kind and (text is None or token[1] == text):
+            self.position += 1
+            return True
+        return False
+
+    def done(self) -> bool:
+        return self.position >= len(self.tokens)
+
+    def path(self) -> str:
+        kind, text = self.take()
+        if kind == 'name':
+            if text not in self.names:
+                raise client_error('ValidationException', f"Undefined name {text}", 'Expression')
+            return self.names[text]
+        if kind == 'ident':
+            return text
+        raise client_error('ValidationException', f"Expected attribute, got {text!r}", 'Expression')
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == 'value':
+            self.position += 1
+            if text not in self.values:
+                raise client_error('ValidationException', f"Undefined value {text}", 'Expression')
+            return ('value', self.values[text])
+        if kind == 'ident' and self.peek(1) == ('op', '('):
+            function = text
+            self.position += 2
+            arguments = [self.operand()]
+            while self.accept('op', ','):
+                arguments.append(self.operand())
+            self.take('op', ')')
+            return ('call', function, arguments)
+        return ('path', self.path())
+
+    # Conditions
+
+    def condition(self):
+        node = self.conjunction()
+        while self.accept('keyword', 'OR'):
+            node = ('or', node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.accept('keyword', 'AND'):
+            node = ('and', node, self.negation())
+        return node
+
+    def negation(self):
+        if self.accept('keyword', 'NOT'):
+            return ('not', self.negation())
+        return self.predicate()
+
+    def predicate(self):
+        if self.accept('op', '('):
+            node = self.condition()
+            self.take('op', ')')
+            return node
+
+        left = self.operand()
+        if left[0] == 'call' and left[1] in ('attribute_exists', 'attribute_not_exists',
+                                             'begins_with', 'contains', 'attribute_type'):
+            return ('function', left[1], left[2])
+
+        kind, text = self.peek()
+        if kind == 'op' and text in COMPARATORS:
+            self.position += 1
+            return ('compare', text, left, self.operand())
+        if self.accept('keyword', 'BETWEEN'):
+            low = self.operand()
+            self.take('keyword', 'AND')
+            return ('between', left, low, self.operand())
+        if self.accept('keyword', 'IN'):
+            self.take('op', '(')
+            options = [self.operand()]
+            while self.accept('op', ','):
+                options.append(self.operand())
+            self.take('op', ')')
+            return ('in', left, options)
+        raise client_error('ValidationException', f"Invalid condition near {text!r}", 'Expression')
+
+    # Updates
+
+    def update(self) -> list:
+        actions = []
+        while not self.done():
+            _, clause = self.take('keyword')
+            while True:
+                if clause == 'SET':
+                    target = self.path()
+                    self.take('op', '=')
+                    value = self.operand()
+                    kind, text = self.peek()
+                    if kind == 'op' and text in ('+', '-'):
+                        self.position += 1
+                        value = ('arith', text, value, self.operand())
+                    actions.append(('SET', target, value))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', self.path(), None))
+                elif clause in ('ADD', 'DELETE'):
+                    actions.append((clause, self.path(), self.operand()))
+                else:
+                    raise client_error('ValidationException', f"Unknown clause {clause}", 'Expression')
+                if not self.accept('op', ','):
+                    break
+        return actions
+
+
+def render_condition(condition, names: dict, values: dict, is_key_condition: bool = False) -> tuple:
+    """
+    Render a boto3 condition object as an expression string.
+
+    Args:
+        condition: boto3 condition or expression string
+        names: ExpressionAttributeNames to merge into
+        values: ExpressionAttributeValues to merge into
+
+    Returns:
+        Tuple of (expression, names, values)
+    """
+    if not isinstance(condition, ConditionBase):
+        return condition, names, values
+    built = ConditionExpressionBuilder().build_expression(condition, is_key_condition=is_key_condition)
+    # Placeholders of the builder (#n0, :v0) are prefixed to avoid clashes
+    expression = re.sub(r'([#:])(n|v)(\d+)', r'\1_\2\3', built.condition_expression)
+    names = {**names, **{f"#_{k[1:]}": v for k, v in built.attribute_name_placeholders.items()}}
+    values = {**values, **{f":_{k[1:]}": v for k, v in built.attribute_value_placeholders.items()}}
+    return expression, names, values
+
+
+def resolve(operand, item: dict):
+    """Evaluate an operand against an item (MISSING if the attribute is absent)."""
+    kind = operand[0]
+    if kind == 'value':
+        return operand[1]
+    if kind == 'path':
+        return item.get(operand[1], MISSING)
+    if kind == 'arith':
+        left, right = resolve(operand[2], item), resolve(operand[3], item)
+        if left is MISSING or right is MISSING:
+            raise client_error('ValidationException', 'Operand of + or - is missing', 'UpdateItem')
+        return left + right if operand[1] == '+' else left - right
+    _, function, arguments = operand
+    if function == 'if_not_exists':
+        current = resolve(arguments[0], item)
+        return resolve(arguments[1], item) if current is MISSING else current
+    if function == 'list_append':
+        return list(resolve(arguments[0], item)) + list(resolve(arguments[1], item))
+    if function == 'size':
+        value = resolve(arguments[0], item)
+        return MISSING if value is MISSING else Decimal(
+            attribute_size(value) if isinstance(value, (str, bytes)) else len(value)
+        )
+    raise client_error('ValidationException', f"Unsupported function {function}", 'Expression')
+
+
+def compare(operator: str, left, right) -> bool:
+    """Compare two attribute values; values of different types never match."""
+    if left is MISSING or right is MISSING:
+        return operator == '<>' and not (left is MISSING and right is MISSING)
+    if operator == '=':
+        return left == right
+    if operator == '<>':
+        return left != right
+    try:
+        return {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[operator]
+    except TypeError:
+        return False
+
+
+def evaluate(node, item: dict) -> bool:
+    """Evaluate a parsed condition against an item."""
+    kind = node[0]
+    if kind == 'and':
+        return evaluate(node[1], item) and evaluate(node[2], item)
+    if kind == 'or':
+        return evaluate(node[1], item) or evaluate(node[2], item)
+    if kind == 'not':
+        return not evaluate(node[1], item)
+    if kind == 'compare':
+        return compare(node[1], resolve(node[2], item), resolve(node[3], item))
+    if kind == 'between':
+        value = resolve(node[1], item)
+        return compare('>=', value, resolve(node[2], item)) and compare('<=', value, resolve(node[3], item))
+    if kind == 'in':
+        value = resolve(node[1], item)
+        return any(compare('=', value, resolve(option, item)) for option in node[2])
+
+    _, function, arguments = node
+    value = resolve(arguments[0], item)
+    if function == 'attribute_exists':
+        return value is not MISSING
+    if function == 'attribute_not_exists':
+        return value is MISSING
+    if value is MISSING:
+        return False
+    other = resolve(arguments[1], item)
+    if function == 'begins_with':
+        return isinstance(value, (str, bytes)) and type(value) is type(other) and value.startswith(other)
+    if function == 'contains':
+        if isinstance(value, str):
+            return isinstance(other, str) and other in value
+        return isinstance(value, (list, set, frozenset)) and other in value
+    raise client_error('ValidationException', f"Unsupported function {function}", 'Expression')
+
+
+def parse_condition(expression, names: dict, values: dict, is_key_condition: bool = False):
+    """Parse a condition expression (string or boto3 condition) into a tree."""
+    if expression is None:
+        return None
+    expression, names, values = render_condition(expression, names, values, is_key_condition)
+    parser = ExpressionParser(expression, names, values)
+    node = parser.condition()
+    if not parser.done():
+        raise client_error('ValidationException', f"Unexpected trailing tokens in {expression}", 'Expression')
+    return node
+
+
+def apply_update(item: dict, expression: str, names: dict, values: dict) -> dict:
+    """
+    Apply an update expression to (a copy of) an item.
+
+    Args:
+        item: Current item (with key attributes)
+        expression: UpdateExpression
+        names: ExpressionAttributeNames
+        values: ExpressionAttributeValues
+
+    Returns:
+        Updated item
+    """
+    actions = ExpressionParser(expression, names, values).update()
+    updated = copy.deepcopy(item)
+    # All operands see the item as it was before the update
+    for action, target, operand in actions:
+        if action == 'SET':
+            updated[target] = copy.deepcopy(resolve(operand, item))
+        elif action == 'REMOVE':
+            updated.pop(target, None)
+        elif action == 'ADD':
+            value = resolve(operand, item)
+            current = item.get(target, MISSING)
+            if isinstance(value, (set, frozenset)):
+                updated[target] = set(value) | (set(current) if current is not MISSING else set())
+            else:
+                updated[target] = value + (current if current is not MISSING else 0)
+        elif action == 'DELETE':
+            current = item.get(target, MISSING)
+            if current is not MISSING:
+                remaining = set(current) - set(resolve(operand, item))
+                if remaining:
+                    updated[target] = remaining
+                else:
+                    updated.pop(target, None)
+    return normalize_item(updated)
+
+
+def project(item: dict, projection: str, names: dict) -> dict:
+    """Keep the attributes listed in a ProjectionExpression."""
+    if not projection:
+        return item
+    attributes = [
+        names.get(part.strip(), part.strip()) for part in projection.split(',') if part.strip()
+    ]
+    return {name: item[name] for name in attributes if name in item}
+
+
+def key_range(node, range_key: str) -> tuple:
+    """
+    Extract the hash value and the range key bounds of a key condition.
+
+    Args:
+        node: Parsed key condition
+        range_key: Range key attribute of the table or index
+
+    Returns:
+        Tuple of (hash value, lower bound or None, upper bound or None)
+    """
+    predicates = []
+
+    def flatten(n):
+        if n[0] == 'and':
+            flatten(n[1])
+            flatten(n[2])
+        else:
+            predicates.append(n)
+
+    flatten(node)
+    hash_value, lower, upper = None, None, None
+    for predicate in predicates:
+        if predicate[0] == 'compare' and predicate[2] == ('path', range_key):
+            value = predicate[3][1]
+            if predicate[1] in ('>', '>='):
+                lower = value
+            elif predicate[1] in ('<', '<='):
+                upper = value
+            else:
+                lower = upper = value
+        elif predicate[0] == 'between':
+            lower, upper = predicate[2][1], predicate[3][1]
+        elif predicate[0] == 'function' and predicate[1] == 'begins_with':
+            lower, upper = predicate[2][1][1], predicate[2][1][1] + '\U0010ffff'
+        elif predicate[0] == 'compare' and predicate[1] == '=':
+            hash_value = predicate[3][1]
+        else:
+            raise client_error('ValidationException', 'Unsupported key condition', 'Query')
+    return hash_value, lower, upper
+
+
+# Storage engines
+
+
+class MemoryStore:
+    """Items in dicts, with sorted key lists per partition and GSI."""
+
+    def __init__(self):
+        self.items = {}       # table -> {(hash, range): item}
+        self.entries = {}     # (table, key) -> index entries of the stored item
+        self.partitions = {}  # (table, index) -> {hash: sorted [(range, hash, range)]}
+
+    def get(self, table: str, key: tuple):
+        return self.items.get(table, {}).get(key)
+
+    def put(self, table: str, key: tuple, item: dict, entries: dict):
+        self.items.setdefault(table, {})[key] = item
+        self.update_entries(table, self.entries.get((table, key), {}), entries)
+        self.entries[(table, key)] = entries
+
+    def delete(self, table: str, key: tuple, entries: dict):
+        self.items.get(table, {}).pop(key, None)
+        self.update_entries(table, self.entries.pop((table, key), {}), {})
+
+    def update_entries(self, table: str, old: dict, new: dict):
+        for index, (hash_value, order) in old.items():
+            if new.get(index) != (hash_value, order):
+                entries = self.partitions.get((table, index), {}).get(hash_value, [])
+                position = bisect.bisect_left(entries, order)
+                if position < len(entries) and entries[position] == order:
+                    entries.pop(position)
+        for index, (hash_value, order) in new.items():
+            if old.get(index) != (hash_value, order):
+                entries = self.partitions.setdefault((table, index), {}).setdefault(hash_value, [])
+                bisect.insort(entries, order)
+
+    def table_items(self, table: str, after):
+        """Yield (key, item) of a whole table in key order, after a key."""
+        for key in sorted(self.items.get(table, {})):
+            if after is None or key > after:
+                yield key, self.items[table][key]
+
+    def scan(self, table: str, index, hash_value, lower, upper, forward: bool, after):
+        """Yield (order, item) of a partition in key order between the bounds."""
+        entries = self.partitions.get((table, index), {}).get(hash_value, [])
+        if forward:
+            start = bisect.bisect_right(entries, after) if after else (
+                bisect.bisect_left(entries, (lower,)) if lower is not None else 0)
+            for order in entries[start:]:
+                if upper is not None and order[0] > upper:
+                    return
+                yield order, self.items[table][order[-2:]]
+        else:
+            end = bisect.bisect_left(entries, after) if after else (
+                bisect.bisect_right(entries, (upper, '\U0010ffff')) if upper is not None else len(entries))
+            for order in reversed(entries[:end]):
+                if lower is not None and order[0] < lower:
+                    return
+                yield order, self.items[table][order[-2:]]
+
+
+class SQLiteStore:
+    """Items serialized as DynamoDB JSON in SQLite, one row per table or GSI entry."""
+
+    def __init__(self, path: str = ':memory:'):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS items (
+                tbl TEXT, pk TEXT, sk TEXT, item TEXT,
+                PRIMARY KEY (tbl, pk, sk)
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                tbl TEXT, idx TEXT, hash TEXT, range TEXT, pk TEXT, sk TEXT,
+                PRIMARY KEY (tbl, idx, hash, range, pk, sk)
+            );
+            CREATE INDEX IF NOT EXISTS entries_item ON entries (tbl, pk, sk);
+            CREATE TABLE IF NOT EXISTS objects (
+                bucket TEXT, key TEXT, body BLOB, content_type TEXT, etag TEXT, modified TEXT,
+                PRIMARY KEY (bucket, key)
+            );
+        ''')
+
+    @staticmethod
+    def encode(item: dict) -> str:
+        return json.dumps({name: _serializer.serialize(value) for name, value in item.items()})
+
+    @staticmethod
+    def decode(data: str) -> dict:
+        return {name: _deserializer.deserialize(value) for name, value in json.loads(data).items()}
+
+    def get(self, table: str, key: tuple):
+        row = self.connection.execute(
+            'SELECT item FROM items WHERE tbl = ? AND pk = ? AND sk = ?', (table, *key)
+        ).fetchone()
+        return self.decode(row[0]) if row else None
+
+    def put(self, table: str, key: tuple, item: dict, entries: dict):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)', (table, *key, self.encode(item))
+            )
+            self.connection.execute('DELETE FROM entries WHERE tbl = ? AND pk = ? AND sk = ?', (table, *key))
+            self.connection.executemany(
+                'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                [(table, index or '', hash_value, order[0], *key) for index, (hash_value, order) in entries.items()]
+            )
+
+    def delete(self, table: str, key: tuple, entries: dict):
+        with self.connection:
+            self.connection.execute('DELETE FROM items WHERE tbl = ? AND pk = ? AND sk = ?', (table, *key))
+            self.connection.execute('DELETE FROM entries WHERE tbl = ? AND pk = ? AND sk = ?', (table, *key))
+
+    def table_items(self, table: str, after):
+        """Yield (key, item) of a whole table in key order, after a key."""
+        clause, params = ('AND (pk, sk) > (?, ?) ', [table, *after]) if after else ('', [table])
+        rows = self.connection.execute(
+            f"SELECT pk, sk, item FROM items WHERE tbl = ? {clause}ORDER BY pk, sk", params
+        )
+        for pk, sk, data in rows:
+            yield (pk, sk), self.decode(data)
+
+    def scan(self, table: str, index, hash_value, lower, upper, forward: bool, after):
+        """Yield (order, item) of a partition in key order between the bounds."""
+        clauses = ['e.tbl = ?', 'e.idx = ?', 'e.hash = ?']
+        params = [table, index or '', hash_value]
+        if lower is not None:
+            clauses.append('e.range >= ?')
+            params.append(lower)
+        if upper is not None:
+            clauses.append('e.range <= ?')
+            params.append(upper)
+        if after:
+            clauses.append('(e.range, e.pk, e.sk) > (?, ?, ?)' if forward else '(e.range, e.pk, e.sk) < (?, ?, ?)')
+            params.extend(after)
+        direction = 'ASC' if forward else 'DESC'
+        rows = self.connection.execute(
+            f"SELECT e.range, e.pk, e.sk, i.item FROM entries e "
+            f"JOIN items i ON i.tbl = e.tbl AND i.pk = e.pk AND i.sk = e.sk "
+            f"WHERE {' AND '.join(clauses)} "
+            f"ORDER BY e.range {direction}, e.pk {direction}, e.sk {direction}",
+            params
+        )
+        for range_value, pk, sk, data in rows:
+            yield (range_value, pk, sk), self.decode(data)
+
+
+# DynamoDB
+
+
+class LocalTable:
+    """DynamoDB Table stand-in (the boto3 resource Table methods used here)."""
+
+    def __init__(self, backend, name: str, schema: dict):
+        self.backend = backend
+        self.name = name
+        self.table_name = name
+        self.schema = schema
+
+    def key_of(self, item: dict) -> tuple:
+        try:
+            return (item[self.schema['hash_key']], item[self.schema['range_key']])
+        except KeyError as e:
+            raise client_error('ValidationException', f"Missing key attribute {e}", 'PutItem')
+
+    def entries(self, item: dict) -> dict:
+        """Index entries of an item: {index or None: (hash, order)}."""
+        key = self.key_of(item)
+        entries = {None: (key[0], (key[1], *key))}
+        for index, (hash_key, range_key) in self.schema['indexes'].items():
+            # Sparse indexes: items without the index keys are not indexed
+            if hash_key in item and range_key in item:
+                entries[index] = (item[hash_key], (item[range_key], *key))
+        return entries
+
+    def write_units(self, old: dict, new: dict) -> float:
+        """Write units of a table write, including GSI maintenance."""
+        units = max(1, math.ceil(max(item_size(old), item_size(new)) / WRITE_UNIT_BYTES))
+        for hash_key, range_key in self.schema['indexes'].values():
+            old_key = (old or {}).get(hash_key), (old or {}).get(range_key)
+            new_key = (new or {}).get(hash_key), (new or {}).get(range_key)
+            in_old, in_new = None not in old_key, None not in new_key
+            if in_old and in_new and old_key != new_key:
+                units += math.ceil((item_size(old) + INDEX_OVERHEAD_BYTES) / WRITE_UNIT_BYTES)
+            if in_new:
+                units += math.ceil((item_size(new) + INDEX_OVERHEAD_BYTES) / WRITE_UNIT_BYTES)
+            elif in_old:
+                units += math.ceil((item_size(old) + INDEX_OVERHEAD_BYTES) / WRITE_UNIT_BYTES)
+        return units
+
+    def check_condition(self, current: dict, kwargs: dict, operation: str, units: float):
+        node = parse_condition(kwargs.get('ConditionExpression'), kwargs.get('ExpressionAttributeNames', {}),
+                               kwargs.get('ExpressionAttributeValues', {}))
+        if node is not None and not evaluate(node, current or {}):
+            # A failed condition still consumes write capacity
+            self.backend.count_write(self.name, operation, units, written=False)
+            raise client_error('ConditionalCheckFailedException', 'The conditional request failed', operation)
+
+    def get_item(self, Key: dict, ProjectionExpression: str = None, ExpressionAttributeNames: dict = None,
+                 ConsistentRead: bool = False, **kwargs) -> dict:
+        with self.backend.lock:
+            item = self.backend.store.get(self.name, self.key_of(Key))
+            units = max(1, math.ceil(item_size(item) / READ_UNIT_BYTES)) * (1 if ConsistentRead else 0.5)
+            self.backend.count_read(self.name, 'GetItem', units)
+            if item is None:
+                return {}
+            return {'Item': project(copy.deepcopy(item), ProjectionExpression, ExpressionAttributeNames or {})}
+
+    def put_item(self, Item: dict, **kwargs) -> dict:
+        item = normalize_item(Item)
+        key = self.key_of(item)
+        with self.backend.lock:
+            current = self.backend.store.get(self.name, key)
+            units = self.write_units(current, item)
+            self.check_condition(current, kwargs, 'PutItem', max(1, math.ceil(item_size(current) / WRITE_UNIT_BYTES)))
+            self.backend.store.put(self.name, key, item, self.entries(item))
+            self.backend.count_write(self.name, 'PutItem', units)
+        return {}
+
+    def update_item(self, Key: dict, UpdateExpression: str, ExpressionAttributeNames: dict = None,
+                    ExpressionAttributeValues: dict = None, **kwargs) -> dict:
+        key = self.key_of(Key)
+        names = ExpressionAttributeNames or {}
+        values = normalize_item(ExpressionAttributeValues or {})
+        with self.backend.lock:
+            current = self.backend.store.get(self.name, key)
+            self.check_condition(current, {**kwargs, 'ExpressionAttributeNames': names,
+                                           'ExpressionAttributeValues': values},
+                                 'UpdateItem', max(1, math.ceil(item_size(current) / WRITE_UNIT_BYTES)))
+            updated = apply_update(current or dict(Key), UpdateExpression, names, values)
+            self.backend.store.put(self.name, key, updated, self.entries(updated))
+            self.backend.count_write(self.name, 'UpdateItem', self.write_units(current, updated))
+        return {'Attributes': copy.deepcopy(updated)} if kwargs.get('ReturnValues') == 'ALL_NEW' else {}
+
+    def delete_item(self, Key: dict, **kwargs) -> dict:
+        key = self.key_of(Key)
+        with self.backend.lock:
+            current = self.backend.store.get(self.name, key)
+            self.check_condition(current, kwargs, 'DeleteItem', 1)
+            if current is not None:
+                self.backend.store.delete(self.name, key, self.entries(current))
+            self.backend.count_write(self.name, 'DeleteItem', self.write_units(current, None))
+        return {}
+
+    def query(self, KeyConditionExpression, IndexName: str = None, FilterExpression=None,
+              ProjectionExpression: str = None, ExpressionAttributeNames: dict = None,
+              ExpressionAttributeValues: dict = None, ExclusiveStartKey: dict = None, Limit: int = None,
+              ScanIndexForward: bool = True, ConsistentRead: bool = False, **kwargs) -> dict:
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        if IndexName:
+            if IndexName not in self.schema['indexes']:
+                raise client_error('ValidationException', f"Unknown index {IndexName}", 'Query')
+            hash_key, range_key = self.schema['indexes'][IndexName]
+        else:
+            hash_key, range_key = self.schema['hash_key'], self.schema['range_key']
+
+        key_node = parse_condition(KeyConditionExpression, names, values, is_key_condition=True)
+        filter_node = parse_condition(FilterExpression, names, values)
+        hash_value, lower, upper = key_range(key_node, range_key)
+
+        after = None
+        if ExclusiveStartKey:
+            table_key = self.key_of(ExclusiveStartKey)
+            after = (ExclusiveStartKey[range_key], *table_key)
+
+        items, scanned, size, last_order = [], 0, 0, None
+        with self.backend.lock:
+            for order, item in self.backend.store.scan(self.name, IndexName, hash_value, lower, upper,
+                                                      ScanIndexForward, after):
+                if not evaluate(key_node, item):
+                    continue
+                scanned += 1
+                size += item_size(item)
+                last_order = order
+                # Limit counts evaluated items, before the filter
+                if filter_node is None or evaluate(filter_node, item):
+                    items.append(project(copy.deepcopy(item), ProjectionExpression, names))
+                if (Limit and scanned >= Limit) or size >= QUERY_PAGE_BYTES:
+                    break
+            else:
+                last_order = None
+
+            units = max(1, math.ceil(size / READ_UNIT_BYTES)) * (1 if ConsistentRead and not IndexName else 0.5)
+            self.backend.count_read(self.name, 'Query', units)
+
+        response = {'Items': items, 'Count': len(items), 'ScannedCount': scanned}
+        if last_order is not None:
+            last_key = {self.schema['hash_key']: last_order[-2], self.schema['range_key']: last_order[-1]}
+            if IndexName:
+                last_key.update({hash_key: hash_value, range_key: last_order[0]})
+            response['LastEvaluatedKey'] = last_key
+        return response
+
+    def scan(self, FilterExpression=None, ProjectionExpression: str = None, ExpressionAttributeNames: dict = None,
+             ExpressionAttributeValues: dict = None, ExclusiveStartKey: dict = None, Limit: int = None,
+             ConsistentRead: bool = False, **kwargs) -> dict:
+        names = ExpressionAttributeNames or {}
+        filter_node = parse_condition(FilterExpression, names, ExpressionAttributeValues or {})
+        after = self.key_of(ExclusiveStartKey) if ExclusiveStartKey else None
+
+        items, scanned, size, last_key = [], 0, 0, None
+        with self.backend.lock:
+            for key, item in self.backend.store.table_items(self.name, after):
+                scanned += 1
+                size += item_size(item)
+                last_key = key
+                if filter_node is None or evaluate(filter_node, item):
+                    items.append(project(copy.deepcopy(item), ProjectionExpression, names))
+                if (Limit and scanned >= Limit) or size >= QUERY_PAGE_BYTES:
+                    break
+            else:
+                last_key = None
+
+            units = max(1, math.ceil(size / READ_UNIT_BYTES)) * (1 if ConsistentRead else 0.5)
+            self.backend.count_read(self.name, 'Scan', units)
+
+        response = {'Items': items, 'Count': len(items), 'ScannedCount': scanned}
+        if last_key is not None:
+            response['LastEvaluatedKey'] = {self.schema['hash_key']: last_key[0],
+                                            self.schema['range_key']: last_key[1]}
+        return response
+
+    def batch_writer(self, overwrite_by_pkeys: list = None) -> 'LocalBatchWriter':
+        return LocalBatchWriter(self)
+
+
+class LocalBatchWriter:
+    """Table.batch_writer stand-in: buffers writes and flushes them 25 at a time."""
+
+    BATCH_SIZE = 25
+
+    def __init__(self, table: LocalTable):
+        self.table = table
+        self.pending = []
+
+    def put_item(self, Item: dict):
+        self.pending.append(('put', Item))
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def delete_item(self, Key: dict):
+        self.pending.append(('delete', Key))
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        for action, value in self.pending:
+            if action == 'put':
+                self.table.put_item(Item=value)
+            else:
+                self.table.delete_item(Key=value)
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+class LocalDynamoDB:
+    """DynamoDB service resource stand-in."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def Table(self, name: str) -> LocalTable:
+        for variable, schema in TABLE_SCHEMAS.items():
+            if os.environ.get(variable) == name:
+                return LocalTable(self.backend, name, schema)
+        raise client_error('ResourceNotFoundException', f"Requested resource not found: {name}", 'DescribeTable')
+
+    def batch_get_item(self, RequestItems: dict, **kwargs) -> dict:
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            found = responses.setdefault(name, [])
+            for key in request['Keys']:
+                item = table.get_item(
+                    Key=key, ProjectionExpression=request.get('ProjectionExpression'),
+                    ExpressionAttributeNames=request.get('ExpressionAttributeNames'),
+                    ConsistentRead=request.get('ConsistentRead', False)
+                ).get('Item')
+                if item is not None:
+                    found.append(item)
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+# S3
+
+
+class LocalPaginator:
+    """Paginator over a listing operation of the local S3 client."""
+
+    def __init__(self, operation):
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self.operation(**kwargs, **({'ContinuationToken': token} if token else {}))
+            yield page
+            token = page.get('NextContinuationToken')
+            if not token:
+                return
+
+
+class LocalS3:
+    """S3 client stand-in (objects held by the backend store or in memory)."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.objects = {}    # bucket -> {key: (body, content_type, etag, modified)}
+        self.keys = {}       # bucket -> sorted keys
+        self.uploads = {}    # upload id -> (bucket, key, content_type, {part: body})
+
+    def store_object(self, bucket: str, key: str, body: bytes, content_type: str):
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        modified = datetime.now(timezone.utc)
+        if isinstance(self.backend.store, SQLiteStore):
+            with self.backend.store.connection:
+                self.backend.store.connection.execute(
+                    'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)',
+                    (bucket, key, body, content_type, etag, modified.isoformat())
+                )
+        else:
+            keys = self.keys.setdefault(bucket, [])
+            if key not in self.objects.setdefault(bucket, {}):
+                bisect.insort(keys, key)
+            self.objects[bucket][key] = (body, content_type, etag, modified)
+        return etag
+
+    def load_object(self, bucket: str, key: str):
+        if isinstance(self.backend.store, SQLiteStore):
+            row = self.backend.store.connection.execute(
+                'SELECT body, content_type, etag, modified FROM objects WHERE bucket = ? AND key = ?', (bucket, key)
+            ).fetchone()
+            return (row[0], row[1], row[2], datetime.fromisoformat(row[3])) if row else None
+        return self.objects.get(bucket, {}).get(key)
+
+    def list_keys(self, bucket: str, start: str, inclusive: bool):
+        """Yield (key, size, etag, modified) of the keys from start, in key order."""
+        if isinstance(self.backend.store, SQLiteStore):
+            rows = self.backend.store.connection.execute(
+                f"SELECT key, length(body), etag, modified FROM objects "
+                f"WHERE bucket = ? AND key {'>=' if inclusive else '>'} ? ORDER BY key",
+                (bucket, start)
+            )
+            for key, size, etag, modified in rows:
+                yield key, size, etag, datetime.fromisoformat(modified)
+        else:
+            keys = self.keys.get(bucket, [])
+            first = bisect.bisect_left(keys, start) if inclusive else bisect.bisect_right(keys, start)
+            for key in keys[first:]:
+                body, _, etag, modified = self.objects[bucket][key]
+                yield key, len(body), etag, modified
+
+    def remove_object(self, bucket: str, key: str):
+        if isinstance(self.backend.store, SQLiteStore):
+            with self.backend.store.connection:
+                self.backend.store.connection.execute('DELETE FROM objects WHERE bucket = ? AND key = ?', (bucket, key))
+        elif key in self.objects.get(bucket, {}):
+            del self.objects[bucket][key]
+            self.keys[bucket].remove(key)
+
+    def put_object(self, Bucket: str, Key: str, Body=b'', ContentType: str = 'binary/octet-stream', **kwargs) -> dict:
+        body = Body.read() if hasattr(Body, 'read') else Body
+        body = body.encode('utf-8') if isinstance(body, str) else bytes(body)
+        with self.backend.lock:
+            etag = self.store_object(Bucket, Key, body, ContentType)
+            self.backend.count_s3('PUT')
+        return {'ETag': etag}
+
+    def get_object(self, Bucket: str, Key: str, Range: str = None, **kwargs) -> dict:
+        with self.backend.lock:
+            self.backend.count_s3('GET')
+            stored = self.load_object(Bucket, Key)
+        if stored is None:
+            raise client_error('NoSuchKey', 'The specified key does not exist.', 'GetObject')
+        body, content_type, etag, modified = stored
+        response = {'ContentType': content_type, 'ETag': etag, 'LastModified': modified}
+        if Range:
+            first, _, last = Range.replace('bytes=', '').partition('-')
+            first, last = int(first), min(int(last) if last else len(body) - 1, len(body) - 1)
+            body = body[first:last + 1]
+            response['ContentRange'] = f"bytes {first}-{last}/{len(stored[0])}"
+        response.update({'Body': io.BytesIO(body), 'ContentLength': len(body)})
+        return response
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        with self.backend.lock:
+            self.backend.count_s3('GET')
+            stored = self.load_object(Bucket, Key)
+        if stored is None:
+            raise client_error('404', 'Not Found', 'HeadObject')
+        return {'ContentLength': len(stored[0]), 'ContentType': stored[1], 'ETag': stored[2],
+                'LastModified': stored[3]}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', Delimiter: str = None, StartAfter: str = '',
+                        ContinuationToken: str = None, MaxKeys: int = LIST_MAX_KEYS, **kwargs) -> dict:
+        after = max(ContinuationToken or '', StartAfter or '')
+        inclusive = bool(Prefix) and Prefix > after
+        contents, prefixes, last_key, truncated = [], [], None, False
+        with self.backend.lock:
+            self.backend.count_s3('LIST')
+            for key, size, etag, modified in self.list_keys(Bucket, Prefix if inclusive else after, inclusive):
+                if not key.startswith(Prefix):
+                    break
+                common = None
+                if Delimiter:
+                    position = key.find(Delimiter, len(Prefix))
+                    if position >= 0:
+                        common = key[:position + len(Delimiter)]
+                        if prefixes and prefixes[-1]['Prefix'] == common:
+                            continue
+                if len(contents) + len(prefixes) >= MaxKeys:
+                    truncated = True
+                    break
+                if common:
+                    prefixes.append({'Prefix': common})
+                    # Resume after the whole common prefix, not inside it
+                    last_key = common + '\U0010ffff'
+                else:
+                    contents.append({'Key': key, 'Size': size, 'ETag': etag, 'LastModified': modified})
+                    last_key = key
+
+        response = {'KeyCount': len(contents) + len(prefixes), 'IsTruncated': truncated}
+        if contents:
+            response['Contents'] = contents
+        if prefixes:
+            response['CommonPrefixes'] = prefixes
+        if truncated:
+            response['NextContinuationToken'] = last_key
+        return response
+
+    def get_paginator(self, operation: str) -> LocalPaginator:
+        if operation != 'list_objects_v2':
+            raise NotImplementedError(operation)
+        return LocalPaginator(self.list_objects_v2)
+
+    def delete_objects(self, Bucket: str, Delete: dict, **kwargs) -> dict:
+        with self.backend.lock:
+            self.backend.count_s3('DELETE')
+            for obj in Delete['Objects']:
+                self.remove_object(Bucket, obj['Key'])
+        return {'Deleted': [{'Key': obj['Key']} for obj in Delete['Objects']]}
+
+    def create_multipart_upload(self, Bucket: str, Key: str, ContentType: str = 'binary/octet-stream',
+                                **kwargs) -> dict:
+        upload_id = uuid.uuid4().hex
+        with self.backend.lock:
+            self.backend.count_s3('PUT')
+            self.uploads[upload_id] = (Bucket, Key, ContentType, {})
+        return {'UploadId': upload_id, 'Bucket': Bucket, 'Key': Key}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body, **kwargs) -> dict:
+        body = Body.read() if hasattr(Body, 'read') else bytes(Body)
+        with self.backend.lock:
+            self.backend.count_s3('PUT')
+            self.uploads[UploadId][3][PartNumber] = body
+        return {'ETag': f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict,
+                                  **kwargs) -> dict:
+        with self.backend.lock:
+            self.backend.count_s3('PUT')
+            bucket, key, content_type, parts = self.uploads.pop(UploadId)
+            body = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+            etag = self.store_object(bucket, key, body, content_type)
+        return {'Bucket': bucket, 'Key': key, 'ETag': etag}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        with self.backend.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod: str, Params: dict, ExpiresIn: int = 3600, **kwargs) -> str:
+        return f"local://{Params['Bucket']}/{Params['Key']}"
+
+
+# SNS and Lambda
+
+
+class LocalSNS:
+    """SNS client stand-in recording published messages."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.messages = []
+
+    def publish(self, **kwargs) -> dict:
+        with self.backend.lock:
+            self.backend.metrics['sns']['Publish'] += 1
+            self.messages.append(kwargs)
+        return {'MessageId': uuid.uuid4().hex}
+
+
+class LocalLambda:
+    """Lambda client stand-in running registered handlers in process."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.functions = {}
+        self.invocations = []
+
+    def invoke(self, FunctionName: str, Payload=b'{}', InvocationType: str = 'RequestResponse', **kwargs) -> dict:
+        payload = json.loads(Payload)
+        with self.backend.lock:
+            self.backend.metrics['lambda']['Invoke'] += 1
+            self.invocations.append((FunctionName, InvocationType, payload))
+        handler = self.functions.get(FunctionName)
+        result = handler(payload, None) if handler else None
+        return {'StatusCode': 202 if InvocationType == 'Event' else 200,
+                'Payload': io.BytesIO(json.dumps(result, default=str).encode('utf-8'))}
+
+
+# Backend
+
+
+class LocalBackend:
+    """The local services of one process, sharing a store and request counters."""
+
+    def __init__(self, store):
+        self.store = store
+        # Handlers run sink and query threads; the stores are not thread safe
+        self.lock = threading.RLock()
+        self.reset_metrics()
+        self.dynamodb = LocalDynamoDB(self)
+        self.services = {'s3': LocalS3(self), 'sns': LocalSNS(self), 'lambda': LocalLambda(self)}
+
+    def reset_metrics(self):
+        """Zero every request counter."""
+        self.metrics = {
+            'dynamodb': {},
+            's3': {'PUT': 0, 'GET': 0, 'LIST': 0, 'DELETE': 0},
+            'sns': {'Publish': 0},
+            'lambda': {'Invoke': 0}
+        }
+
+    def table_metrics(self, table: str) -> dict:
+        return self.metrics['dynamodb'].setdefault(table, {
+            'read_units': 0.0, 'write_units': 0.0, 'items_written': 0, 'requests': {}
+        })
+
+    def count_read(self, table: str, operation: str, units: float):
+        metrics = self.table_metrics(table)
+        metrics['read_units'] += units
+        metrics['requests'][operation] = metrics['requests'].get(operation, 0) + 1
+
+    def count_write(self, table: str, operation: str, units: float, written: bool = True):
+        metrics = self.table_metrics(table)
+        metrics['write_units'] += units
+        metrics['items_written'] += 1 if written else 0
+        metrics['requests'][operation] = metrics['requests'].get(operation, 0) + 1
+
+    def count_s3(self, request: str):
+        self.metrics['s3'][request] += 1
+
+    def client(self, service: str):
+        if service not in self.services:
+            raise NotImplementedError(f"No local stand-in for {service}")
+        return self.services[service]
+
+    def resource(self, service: str):
+        if service != 'dynamodb':
+            raise NotImplementedError(f"No local stand-in for {service}")
+        return self.dynamodb
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend(kind: str = None) -> LocalBackend:
+    """
+    Return the process-wide local backend, creating it on first use.
+
+    Args:
+        kind: 'memory' or 'sqlite' (defaults to AWS_BACKEND)
+
+    Returns:
+        LocalBackend shared by every handler of the process
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            kind = kind or os.environ.get('AWS_BACKEND', 'memory')
+            if kind == 'sqlite':
+                store = SQLiteStore(os.environ.get('LOCAL_BACKEND_PATH', ':memory:'))
+            elif kind == 'memory':
+                store = MemoryStore()
+            else:
+                raise ValueError(f"Unknown local backend: {kind}")
+            _backend = LocalBackend(store)
+        return _backend
+
+
+def reset_backend():
+    """Drop the process-wide backend (the next get_backend starts empty)."""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+def metrics() -> dict:
+    """Return a copy of the request counters of the backend."""
+    return copy.deepcopy(get_backend().metrics)
+
+
+def register_function(name: str, handler):
+    """Run handler(event, context) when the local Lambda client invokes name."""
+    get_backend().services['lambda'].functions[name] = handler
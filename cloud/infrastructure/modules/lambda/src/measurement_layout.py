@@ -0,0 +1,185 @@
+"""
+Measurement Layout
+Storage layouts of the BPM measurements table.
+
+Two layouts can coexist in the table and are read transparently:
+- item: one item per reading (default)
+- bucket: one item per device and time bucket (MEASUREMENT_BUCKET_SECONDS)
+  holding the readings of the bucket as parallel lists, appended with
+  UpdateItem list_append
+
+A bucket item is keyed '<bucket start>#<device_id>' with the bucket start
+written as YYYY-MM-DDTHH:MM:SS. That key sorts just before the per-reading
+keys of the same second, so the timestamp range key conditions keep
+working once the start bound is floored to a bucket (floor_sort_key).
+"""
+
+import os
+from datetime import datetime, timezone, timedelta
+from decimal import Decimal
+
+MEASUREMENT_LAYOUT = os.environ.get('MEASUREMENT_LAYOUT', 'item')
+MEASUREMENT_BUCKET_SECONDS = int(os.environ.get('MEASUREMENT_BUCKET_SECONDS', 60))
+
+# Readings store a severity code; the status is its prefix
+SEVERITY_CODES = ['normal', 'warning_low', 'warning_high', 'critical_low', 'critical_high']
+SEVERITY_CODE_BY_NAME = {name: code for code, name in enumerate(SEVERITY_CODES)}
+# Attributes readers must project to unpack bucket items
+PACKED_ATTRIBUTES = 'bucket_seconds, offsets, bpms, codes'
+
+
+def packed_layout_enabled() -> bool:
+    """Check whether new readings are written as bucket items."""
+    return MEASUREMENT_LAYOUT == 'bucket'
+
+
+def parse_timestamp(timestamp: str) -> datetime:
+    """Parse an ISO 8601 timestamp as written by the devices."""
+    parsed = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def format_timestamp(ts: datetime) -> str:
+    """Format a UTC datetime like the device timestamps (ISO 8601, 'Z')."""
+    return ts.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def bucket_start(ts: datetime, seconds: int = MEASUREMENT_BUCKET_SECONDS) -> datetime:
+    """Return the start of the bucket a reading falls in."""
+    ts = ts.astimezone(timezone.utc)
+    midnight = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = int((ts - midnight).total_seconds())
+    return midnight + timedelta(seconds=elapsed - elapsed % seconds)
+
+
+def bucket_sort_key(start: datetime, device_id: str) -> str:
+    """Return the timestamp_device sort key of a bucket item."""
+    return f"{start.strftime('%Y-%m-%dT%H:%M:%S')}#{device_id}"
+
+
+def floor_sort_key(timestamp: str, seconds: int = MEASUREMENT_BUCKET_SECONDS) -> str:
+    """
+    Widen a range start so the bucket item containing it is included.
+
+    Args:
+        timestamp: Range start (ISO format)
+        seconds: Bucket length
+
+    Returns:
+        Sort key lower bound
+    """
+    return bucket_start(parse_timestamp(timestamp), seconds).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def group_into_buckets(measurements: list, seconds: int = MEASUREMENT_BUCKET_SECONDS) -> dict:
+    """
+    Group classified measurements by user, device and bucket.
+
+    Args:
+        measurements: Measurements with classification
+        seconds: Bucket length
+
+    Returns:
+        Dict keyed by (user_id, device_id, bucket start) with time-ordered lists
+    """
+    buckets = {}
+    for measurement in measurements:
+        start = bucket_start(parse_timestamp(measurement['timestamp']), seconds)
+        key = (measurement['user_id'], measurement['device_id'], start)
+        buckets.setdefault(key, []).append(measurement)
+
+    for readings in buckets.values():
+        readings.sort(key=lambda m: parse_timestamp(m['timestamp']))
+    return buckets
+
+
+def reading_offset(measurement: dict, start: datetime) -> int:
+    """Return the offset of a reading from its bucket start in microseconds."""
+    return int((parse_timestamp(measurement['timestamp']) - start) / timedelta(microseconds=1))
+
+
+def bucket_update(user_id: str, device_id: str, start: datetime, measurements: list,
+                  ttl: int, seconds: int = MEASUREMENT_BUCKET_SECONDS) -> dict:
+    """
+    Build the UpdateItem arguments appending readings to a bucket item.
+
+    Readings are stored as microsecond offsets from the bucket start, BPM
+    values and severity codes; the key attributes are only written once.
+    list_append is not idempotent, so the update is conditional on none of
+    the offsets being stored yet (a redelivered reading fails the write).
+
+    Args:
+        user_id: User identifier
+        device_id: Device identifier
+        start: Bucket start
+        measurements: Classified measurements of the bucket, time ordered
+        ttl: Expiry (epoch seconds) set when the bucket is created
+        seconds: Bucket length
+        
+    Returns:
+        Keyword arguments for Table.update_item
+    """
+    offsets = [reading_offset(m, start) for m in measurements]
+    offset_values = {f":o{i}": offset for i, offset in enumerate(offsets)}
+    return {
+        'Key': {'user_id': user_id, 'timestamp_device': bucket_sort_key(start, device_id)},
+        'UpdateExpression': (
+            'SET offsets = list_append(if_not_exists(offsets, :empty), :offsets), '
+            'bpms = list_append(if_not_exists(bpms, :empty), :bpms), '
+            'codes = list_append(if_not_exists(codes, :empty), :codes), '
+            'device_id = :device_id, #ts = :ts, measurement_date = :date, '
+            'bucket_seconds = :seconds, #ttl = if_not_exists(#ttl, :ttl) '
+            'ADD reading_count :count'
+        ),
+        'ConditionExpression': 'attribute_not_exists(offsets) OR NOT (' + ' OR '.join(
+            f"contains(offsets, {name})" for name in offset_values
+        ) + ')',
+        'ExpressionAttributeNames': {'#ts': 'timestamp', '#ttl': 'ttl'},
+        'ExpressionAttributeValues': {
+            ':empty': [],
+            ':offsets': offsets,
+            ':bpms': [Decimal(str(m['bpm'])) for m in measurements],
+            ':codes': [SEVERITY_CODE_BY_NAME[m['classification']['severity']] for m in measurements],
+            ':device_id': device_id,
+            ':ts': format_timestamp(start),
+            ':date': start.strftime('%Y-%m-%d'),
+            ':seconds': seconds,
+            ':ttl': ttl,
+            ':count': len(measurements),
+            **offset_values
+        }
+    }
+
+
+def is_packed(item: dict) -> bool:
+    """Check whether an item is a bucket item."""
+    return 'bucket_seconds' in item
+
+
+def unpack_item(item: dict) -> list:
+    """
+    Expand an item of either layout into reading dicts.
+
+    Args:
+        item: Measurement table item
+
+    Returns:
+        Readings in time order (a per-reading item is returned as is)
+    """
+    if not is_packed(item):
+        return [item]
+
+    start = parse_timestamp(item['timestamp'])
+    readings = []
+    # Appends from concurrent invocations may interleave out of order
+    for offset, bpm, code in sorted(zip(item['offsets'], item['bpms'], item['codes'])):
+        severity = SEVERITY_CODES[int(code)]
+        readings.append({
+            'user_id': item.get('user_id'),
+            'device_id': item.get('device_id'),
+            'timestamp': format_timestamp(start + timedelta(microseconds=int(offset))),
+            'bpm': bpm,
+            'status': severity.split('_')[0],
+            'severity': severity
+        })
+    return readings
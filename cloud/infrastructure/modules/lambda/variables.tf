@@ -33,6 +33,26 @@ variable "dynamodb_table_arn" {
   type        = string
 }
 
+variable "user_state_table_name" {
+  description = "DynamoDB table name for per-user state"
+  type        = string
+}
+
+variable "user_state_table_arn" {
+  description = "DynamoDB user state table ARN"
+  type        = string
+}
+
+variable "devices_table_name" {
+  description = "DynamoDB table name for the device registry"
+  type        = string
+}
+
+variable "devices_table_arn" {
+  description = "DynamoDB devices table ARN"
+  type        = string
+}
+
 variable "s3_bucket_name" {
   description = "S3 bucket name for historical data"
   type        = string
@@ -72,6 +92,239 @@ variable "bpm_critical_high" {
   default     = 150
 }
 
+variable "processor_sink_workers" {
+  description = "Threads (and connections per client) used by the processor to write sinks concurrently"
+  type        = number
+  default     = 16
+}
+
+variable "alert_renotify_warning_seconds" {
+  description = "Seconds before a persisting warning is notified again"
+  type        = number
+  default     = 1800
+}
+
+variable "alert_renotify_critical_seconds" {
+  description = "Seconds before a persisting critical state is notified again"
+  type        = number
+  default     = 300
+}
+
+variable "alert_notify_recovery" {
+  description = "Notify when a user returns to normal after an alert"
+  type        = bool
+  default     = true
+}
+
+variable "numpy_layer_arn" {
+  description = "Lambda layer providing NumPy (e.g. AWS SDK for pandas); empty disables downsampling and the daily analytics"
+  type        = string
+  default     = ""
+}
+
+variable "api_cache_ttl_current" {
+  description = "Seconds the API handler caches /bpm/current results"
+  type        = number
+  default     = 5
+}
+
+variable "api_cache_ttl_statistics" {
+  description = "Seconds the API handler caches /bpm/statistics results"
+  type        = number
+  default     = 30
+}
+
+variable "api_cache_ttl_devices" {
+  description = "Seconds the API handler caches /devices results"
+  type        = number
+  default     = 60
+}
+
+variable "api_cache_stale_seconds" {
+  description = "Seconds an expired cache entry may be served while refreshed (0 disables)"
+  type        = number
+  default     = 0
+}
+
+variable "compaction_schedule" {
+  description = "Schedule expression for the archive compactor"
+  type        = string
+  default     = "cron(30 2 * * ? *)"
+}
+
+variable "compaction_settle_hours" {
+  description = "Hours after the end of a day before it is compacted"
+  type        = number
+  default     = 2
+}
+
+variable "compaction_delete_sources" {
+  description = "Delete per-reading archive objects once compacted"
+  type        = bool
+  default     = false
+}
+
+variable "compaction_late_days" {
+  description = "Settled days every compaction run lists again for late readings"
+  type        = number
+  default     = 3
+}
+
+variable "compaction_fetch_workers" {
+  description = "Raw archive objects the compactor fetches concurrently"
+  type        = number
+  default     = 32
+}
+
+variable "compaction_memory_size" {
+  description = "Archive compactor memory size in MB"
+  type        = number
+  default     = 512
+}
+
+variable "compaction_timeout" {
+  description = "Archive compactor timeout in seconds"
+  type        = number
+  default     = 900
+}
+
+variable "analytics_schedule" {
+  description = "Schedule expression for the daily analytics (reports on the previous UTC day)"
+  type        = string
+  default     = "cron(30 0 * * ? *)"
+}
+
+variable "analytics_episode_min_minutes" {
+  description = "Consecutive abnormal minutes counted as an episode in the daily reports"
+  type        = number
+  default     = 5
+}
+
+variable "analytics_memory_size" {
+  description = "Daily analytics memory size in MB"
+  type        = number
+  default     = 1024
+}
+
+variable "analytics_timeout" {
+  description = "Daily analytics timeout in seconds"
+  type        = number
+  default     = 900
+}
+
+variable "long_poll_max_seconds" {
+  description = "Longest hold of GET /bpm/current?since=... (below the API Gateway 29 s limit and the Lambda timeout)"
+  type        = number
+  default     = 20
+}
+
+variable "patient_batch_max" {
+  description = "Maximum patients per POST /patients/status request"
+  type        = number
+  default     = 200
+}
+
+variable "patient_batch_concurrency" {
+  description = "Patients whose window statistics are queried in parallel per request"
+  type        = number
+  default     = 16
+}
+
+variable "archive_query_workers" {
+  description = "Archive partitions (device and day) read in parallel by S3 archive queries"
+  type        = number
+  default     = 8
+}
+
+variable "archive_stats_max_days" {
+  description = "Longest range accepted by GET /bpm/statistics with start_date, in days"
+  type        = number
+  default     = 93
+}
+
+variable "export_max_days" {
+  description = "Longest range accepted by POST /bpm/export, in days"
+  type        = number
+  default     = 366
+}
+
+variable "export_url_expires_seconds" {
+  description = "Validity of the presigned export URLs in seconds"
+  type        = number
+  default     = 3600
+}
+
+variable "export_memory_size" {
+  description = "Exporter memory size in MB"
+  type        = number
+  default     = 512
+}
+
+variable "export_timeout" {
+  description = "Exporter timeout in seconds"
+  type        = number
+  default     = 900
+}
+
+variable "measurement_layout" {
+  description = "Layout of new rows in the measurements table: item (one per reading) or bucket (readings packed per device and time bucket)"
+  type        = string
+  default     = "item"
+
+  validation {
+    condition     = contains(["item", "bucket"], var.measurement_layout)
+    error_message = "measurement_layout must be one of: item, bucket"
+  }
+}
+
+variable "measurement_bucket_seconds" {
+  description = "Length of a measurements bucket in seconds (bucket layout)"
+  type        = number
+  default     = 60
+}
+
+variable "log_level" {
+  description = "Log level of the processor and API functions (DEBUG logs every event in full)"
+  type        = string
+  default     = "INFO"
+}
+
+variable "event_log_sample_rate" {
+  description = "Fraction of invocations whose full event is logged (0 to 1)"
+  type        = number
+  default     = 0
+}
+
+variable "metrics_namespace" {
+  description = "CloudWatch namespace of the end-to-end latency metrics"
+  type        = string
+  default     = "BPMMonitoring"
+}
+
+variable "ingest_queue_enabled" {
+  description = "Buffer IoT measurements in an SQS queue and process them in batches"
+  type        = bool
+  default     = false
+}
+
+variable "ingest_batch_size" {
+  description = "Maximum SQS messages per processor invocation (ingest queue)"
+  type        = number
+  default     = 100
+}
+
+variable "ingest_batching_window_seconds" {
+  description = "Maximum seconds the ingest queue gathers messages before invoking the processor"
+  type        = number
+  default     = 5
+}
+
+variable "ingest_max_receive_count" {
+  description = "Deliveries of an ingest message before it moves to the dead-letter queue"
+  type        = number
+  default     = 5
+}
+
 variable "tags" {
   description = "Tags to apply to resources"
   type        = map(string)
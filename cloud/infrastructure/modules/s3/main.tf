@@ -109,6 +109,20 @@ resource "aws_s3_bucket_lifecycle_configuration" "bpm_historical" {
       days_after_initiation = 7
     }
   }
+
+  # Rule 5: Delete bulk exports after 7 days
+  rule {
+    id     = "expire-exports"
+    status = "Enabled"
+
+    filter {
+      prefix = "exports/"
+    }
+
+    expiration {
+      days = 7
+    }
+  }
 }
 
 
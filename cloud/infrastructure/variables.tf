@@ -77,6 +77,18 @@ variable "lambda_timeout" {
   default     = 30
 }
 
+variable "lambda_numpy_layer_arn" {
+  description = "Lambda layer ARN providing NumPy to the API handler and the daily analytics (e.g. AWSSDKPandas-Python311)"
+  type        = string
+  default     = ""
+}
+
+variable "ingest_queue_enabled" {
+  description = "Buffer IoT measurements in an SQS queue and process them in batches"
+  type        = bool
+  default     = false
+}
+
 # SNS Variables
 
 variable "alert_email" {
@@ -4,15 +4,16 @@ Recibe datos de dispositivos IoT, los preprocesa, filtra y decide si enviarlos a
 """
 
 import json
+import re
 import time
 import socket
 import threading
 import argparse
 from datetime import datetime, timezone
-from collections import deque
+from collections import deque, OrderedDict
 from typing import Optional
-from awscrt import mqtt
-from awsiot import mqtt_connection_builder
+# El SDK de AWS IoT (awscrt, awsiot) se importa al conectar con la nube, así el
+# procesador puede usarse sin él (--no-cloud, reproducción de tráfico grabado)
 
 
 # Configuración por defecto
@@ -29,9 +30,263 @@ BPM_WARNING_LOW = 50
 BPM_WARNING_HIGH = 100
 BPM_CRITICAL_HIGH = 150
 
-# Configuración de agregación
-AGGREGATION_WINDOW = 5  # Segundos para agregar datos
+# Configuración de agregación: cada dispositivo envía un resumen de sus lecturas
+# normales con un intervalo entre el mínimo (señal variable o con riesgo reciente)
+# y el máximo (señal estable)
+AGGREGATION_WINDOW_MIN = 5  # Segundos
+AGGREGATION_WINDOW_MAX = 60  # Segundos
 MIN_SAMPLES_FOR_AGGREGATION = 3
+ADAPTIVE_STD_CALM = 2.0  # Desviación (BPM) hasta la que la señal se considera estable
+ADAPTIVE_STD_VOLATILE = 8.0  # Desviación (BPM) a partir de la que se usa el intervalo mínimo
+ADAPTIVE_RISK_HALF_LIFE = 600  # Segundos para que el riesgo acumulado se reduzca a la mitad
+ADAPTIVE_RISK_REFERENCE = 30.0  # Riesgo acumulado que lleva al intervalo mínimo (p. ej. 6 advertencias)
+ANOMALY_RISK_SCORE = 5  # Riesgo de una lectura con anomalías (como una advertencia)
+
+# Detección de anomalías por dispositivo
+ANOMALY_JUMP_BPM = 20  # Cambio mínimo entre lecturas consecutivas...
+ANOMALY_RATE_BPM_PER_SECOND = 10  # ...y velocidad mínima del cambio
+ANOMALY_FLATLINE_SAMPLES = 30  # Lecturas idénticas seguidas (sensor congelado)
+ANOMALY_DROPOUT_SECONDS = 10  # Hueco máximo sin lecturas de un dispositivo
+ANOMALY_DROPOUT_SWEEP_SECONDS = 1.0  # Intervalo del barrido de dispositivos en silencio
+ANOMALY_ZSCORE = 4.0  # Desviaciones respecto a la línea base
+ANOMALY_BASELINE_ALPHA = 0.02  # Peso de cada lectura en la línea base (media móvil exponencial)
+ANOMALY_BASELINE_MIN_SAMPLES = 30  # Lecturas antes de evaluar el z-score
+ANOMALY_BASELINE_MIN_STD = 3.0  # Evita z-scores enormes en señales muy estables
+
+# Protección contra inundación: límites por conexión y por dispositivo (token bucket)
+DEVICE_RATE_LIMIT = 5.0  # Mensajes por segundo por dispositivo (los sensores envían 1 Hz)
+DEVICE_BURST = 20  # Ráfaga admitida por dispositivo
+CONNECTION_RATE_LIMIT = 50.0  # Mensajes por segundo por conexión (un colector puede agrupar varios sensores)
+CONNECTION_BURST = 200  # Ráfaga admitida por conexión
+MAX_LINE_BYTES = 4096  # Una línea más larga sin salto de línea se descarta
+MAX_TRACKED_DEVICES = 10000  # Dispositivos con estado en memoria; al superarlo se olvida el menos reciente
+
+# Campos leídos sin parsear el JSON, para decidir antes de procesar
+DEVICE_ID_PATTERN = re.compile(r'"device_id"\s*:\s*"([^"]*)"')
+BPM_PATTERN = re.compile(r'"bpm"\s*:\s*(-?\d+(?:\.\d+)?)')
+
+
+def reading_time(data: dict) -> float:
+    """Instante de la lectura (timestamp del sensor o, si no es válido, llegada al fog)."""
+    try:
+        return datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00')).timestamp()
+    except (KeyError, AttributeError, ValueError):
+        return time.time()
+
+
+def utc_timestamp(seconds: float) -> str:
+    """Timestamp ISO 8601 en UTC (formato de los sensores) de un instante epoch."""
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class AnomalyDetector:
+    """
+    Detector de anomalías de un dispositivo, más allá de los umbrales fijos:
+    1. Cambio brusco: salto de ANOMALY_JUMP_BPM o más a ANOMALY_RATE_BPM_PER_SECOND o más
+    2. Línea plana: ANOMALY_FLATLINE_SAMPLES lecturas idénticas seguidas
+    3. Pérdida de señal: más de ANOMALY_DROPOUT_SECONDS sin lecturas (si el
+       barrido periódico ya la marcó en silencio, no se repite al volver)
+    4. Z-score: lectura a ANOMALY_ZSCORE desviaciones o más de la línea base
+    
+    Mantiene solo la última lectura, la racha de valores iguales y la media y
+    varianza exponenciales, así que cada lectura cuesta un tiempo constante.
+    """
+    
+    __slots__ = ('last_bpm', 'last_time', 'flat_run', 'mean', 'variance', 'samples', 'silent')
+    
+    def __init__(self):
+        self.last_bpm = None
+        self.last_time = None
+        self.flat_run = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        self.samples = 0
+        self.silent = False  # Pérdida de señal ya informada por el barrido
+    
+    def observe(self, bpm: float, timestamp: float) -> dict:
+        """
+        Procesa una lectura y retorna sus anomalías ({tipo: magnitud}, vacío si no hay).
+        """
+        anomalies = {}
+        
+        if self.last_bpm is not None:
+            elapsed = timestamp - self.last_time
+            change = abs(bpm - self.last_bpm)
+            if elapsed > ANOMALY_DROPOUT_SECONDS:
+                if not self.silent:
+                    anomalies['dropout'] = round(elapsed, 1)
+            elif change >= ANOMALY_JUMP_BPM:
+                rate = change / max(elapsed, 1.0)
+                if rate >= ANOMALY_RATE_BPM_PER_SECOND:
+                    anomalies['rate_of_change'] = round(rate, 1)
+            
+            self.flat_run = self.flat_run + 1 if bpm == self.last_bpm else 1
+            # Se informa al alcanzar la racha y después una vez por racha completa
+            if self.flat_run >= ANOMALY_FLATLINE_SAMPLES and self.flat_run % ANOMALY_FLATLINE_SAMPLES == 0:
+                anomalies['flatline'] = self.flat_run
+        else:
+            self.flat_run = 1
+        
+        if self.samples >= ANOMALY_BASELINE_MIN_SAMPLES:
+            std = max(self.variance ** 0.5, ANOMALY_BASELINE_MIN_STD)
+            zscore = (bpm - self.mean) / std
+            if abs(zscore) >= ANOMALY_ZSCORE:
+                anomalies['zscore'] = round(zscore, 1)
+        
+        # Línea base: media y varianza exponenciales (la primera lectura la inicializa)
+        if self.samples:
+            delta = bpm - self.mean
+            self.mean += ANOMALY_BASELINE_ALPHA * delta
+            self.variance = (1 - ANOMALY_BASELINE_ALPHA) * (self.variance + ANOMALY_BASELINE_ALPHA * delta * delta)
+        else:
+            self.mean = float(bpm)
+        self.samples += 1
+        
+        self.last_bpm = bpm
+        self.last_time = timestamp
+        self.silent = False
+        return anomalies
+    
+    def observe_batch(self, readings: list) -> list:
+        """
+        Procesa varias lecturas del dispositivo, en orden.
+        Retorna las anomalías de cada lectura.
+        """
+        observe = self.observe
+        return [observe(data['bpm'], reading_time(data)) for data in readings]
+
+
+class TokenBucket:
+    """Token bucket: admite `rate` mensajes por segundo con ráfagas de hasta `burst`."""
+    
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+    
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+    
+    def refill(self, now: float) -> float:
+        """Repone los tokens del tiempo transcurrido y retorna los disponibles."""
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        return self.tokens
+
+
+class FloodGuard:
+    """
+    Limitador previo al procesamiento, que actúa sobre la línea sin parsear:
+    1. Lee device_id y bpm con expresiones regulares (sin json.loads)
+    2. Deja pasar siempre las lecturas críticas
+    3. Admite el resto si quedan tokens en el bucket de la conexión y en el del dispositivo
+    4. Resume las lecturas rechazadas por dispositivo (cantidad, media, mínimo,
+       máximo), que se agregan a las estadísticas y al siguiente mensaje a la nube
+    
+    Tiene su propio bloqueo, breve, de modo que un dispositivo que inunda el fog
+    no compite por el bloqueo del procesador. Guarda el bucket y los contadores
+    de hasta max_devices dispositivos: los device_id inventados de una
+    inundación desplazan a los menos recientes en lugar de agotar la memoria.
+    """
+    
+    def __init__(self, device_rate: float = DEVICE_RATE_LIMIT, device_burst: float = DEVICE_BURST,
+                 connection_rate: float = CONNECTION_RATE_LIMIT, connection_burst: float = CONNECTION_BURST,
+                 clock=time.monotonic, max_devices: int = MAX_TRACKED_DEVICES):
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.connection_rate = connection_rate
+        self.connection_burst = connection_burst
+        self.clock = clock
+        self.max_devices = max_devices
+        self.device_buckets = OrderedDict()  # En orden de último uso
+        self.summaries = {}  # Lecturas rechazadas pendientes de resumir, por dispositivo
+        self.counters = OrderedDict()  # Contadores por dispositivo, en orden de último uso
+        self.lock = threading.Lock()
+    
+    def connection_bucket(self) -> TokenBucket:
+        """Crea el bucket de una nueva conexión."""
+        return TokenBucket(self.connection_rate, self.connection_burst, self.clock())
+    
+    def admit(self, line: str, connection: TokenBucket) -> bool:
+        """
+        Decide si una línea se procesa. Las rechazadas quedan resumidas.
+        """
+        match = DEVICE_ID_PATTERN.search(line)
+        device_id = match.group(1) if match else 'unknown'
+        match = BPM_PATTERN.search(line)
+        bpm = float(match.group(1)) if match else None
+        now = self.clock()
+        
+        with self.lock:
+            counters = self.counters.get(device_id)
+            if counters is None:
+                counters = self.counters[device_id] = {'admitted': 0, 'throttled': 0, 'critical_bypassed': 0}
+                if len(self.counters) > self.max_devices:
+                    self.counters.popitem(last=False)
+            else:
+                self.counters.move_to_end(device_id)
+            
+            # Los eventos críticos nunca se limitan
+            if bpm is not None and 0 <= bpm <= 300 and (bpm < BPM_CRITICAL_LOW or bpm > BPM_CRITICAL_HIGH):
+                counters['critical_bypassed'] += 1
+                return True
+            
+            bucket = self.device_buckets.get(device_id)
+            if bucket is None:
+                bucket = self.device_buckets[device_id] = TokenBucket(self.device_rate, self.device_burst, now)
+                if len(self.device_buckets) > self.max_devices:
+                    self.device_buckets.popitem(last=False)
+            else:
+                self.device_buckets.move_to_end(device_id)
+            
+            if connection.refill(now) >= 1 and bucket.refill(now) >= 1:
+                connection.tokens -= 1
+                bucket.tokens -= 1
+                counters['admitted'] += 1
+                return True
+            
+            counters['throttled'] += 1
+            # Resumen: [lecturas, lecturas con BPM, suma, mínimo, máximo]; con
+            # max_devices resúmenes pendientes, los de dispositivos nuevos van a 'unknown'
+            if device_id not in self.summaries and len(self.summaries) >= self.max_devices:
+                device_id = 'unknown'
+            summary = self.summaries.get(device_id)
+            if summary is None:
+                summary = self.summaries[device_id] = [0, 0, 0.0, float('inf'), float('-inf')]
+            summary[0] += 1
+            if bpm is not None:
+                summary[1] += 1
+                summary[2] += bpm
+                if bpm < summary[3]:
+                    summary[3] = bpm
+                if bpm > summary[4]:
+                    summary[4] = bpm
+            return False
+    
+    def take_summaries(self) -> dict:
+        """Retorna y reinicia los resúmenes pendientes ({device_id: resumen})."""
+        with self.lock:
+            summaries, self.summaries = self.summaries, {}
+        return {
+            device_id: {
+                'count': count,
+                'bpm_count': bpm_count,
+                'bpm_sum': bpm_sum,
+                'min_bpm': min_bpm if bpm_count else None,
+                'max_bpm': max_bpm if bpm_count else None
+            }
+            for device_id, (count, bpm_count, bpm_sum, min_bpm, max_bpm) in summaries.items()
+        }
+    
+    def get_counters(self) -> dict:
+        """Contadores de los dispositivos que han sido limitados."""
+        with self.lock:
+            return {
+                device_id: dict(counters)
+                for device_id, counters in self.counters.items()
+                if counters['throttled']
+            }
 
 
 class FogProcessor:
@@ -43,11 +298,18 @@ class FogProcessor:
     4. Decisión de envío a la nube
     """
     
-    def __init__(self, send_all: bool = False, critical_only: bool = False):
+    def __init__(self, send_all: bool = False, critical_only: bool = False,
+                 min_window: float = AGGREGATION_WINDOW_MIN, max_window: float = AGGREGATION_WINDOW_MAX,
+                 clock=time.time, max_devices: int = MAX_TRACKED_DEVICES):
         self.send_all = send_all
         self.critical_only = critical_only
+        self.min_window = min_window
+        self.max_window = max(min_window, max_window)
+        self.clock = clock  # Reloj de las decisiones de envío (reemplazable al reproducir tráfico)
+        self.max_devices = max_devices
         self.device_buffers = {}  # Buffer por dispositivo para agregación
-        self.device_stats = {}  # Estadísticas por dispositivo
+        self.device_stats = OrderedDict()  # Estadísticas por dispositivo, en orden de última lectura
+        self.detectors = {}  # Detector de anomalías por dispositivo
         self.lock = threading.Lock()
         
     def preprocess(self, data: dict) -> dict:
@@ -96,30 +358,164 @@ class FogProcessor:
     
     def update_device_stats(self, device_id: str, data: dict):
         """Actualiza estadísticas del dispositivo para agregación."""
+        self.update_device_stats_batch(device_id, [data])
+    
+    def update_device_stats_batch(self, device_id: str, batch: list):
+        """
+        Actualiza estadísticas y detecta anomalías de varias lecturas de un
+        dispositivo con un solo bloqueo. Las anomalías se añaden a cada
+        lectura en 'anomalies'.
+        """
+        valid = [data for data in batch if data.get('valid', False)]
+        
         with self.lock:
-            if device_id not in self.device_buffers:
-                self.device_buffers[device_id] = deque(maxlen=100)
-                self.device_stats[device_id] = {
-                    'total_received': 0,
-                    'total_sent_to_cloud': 0,
-                    'last_sent_time': 0,
-                    'avg_bpm': 0,
-                    'min_bpm': float('inf'),
-                    'max_bpm': 0
-                }
-            
-            self.device_buffers[device_id].append(data)
-            stats = self.device_stats[device_id]
-            stats['total_received'] += 1
+            stats = self._device_entry(device_id)
+            buffer = self.device_buffers[device_id]
+            stats['total_received'] += len(batch)
             
-            bpm = data.get('bpm', 0)
-            stats['min_bpm'] = min(stats['min_bpm'], bpm)
-            stats['max_bpm'] = max(stats['max_bpm'], bpm)
+            for data, anomalies in zip(valid, self.detectors[device_id].observe_batch(valid)):
+                if anomalies:
+                    data['anomalies'] = anomalies
+                    for kind in anomalies:
+                        stats['anomalies'][kind] = stats['anomalies'].get(kind, 0) + 1
+                
+                score = max(data.get('risk_score', 0), ANOMALY_RISK_SCORE if anomalies else 0)
+                self._add_risk(stats, score, self.detectors[device_id].last_time)
+                
+                bpm = data['bpm']
+                stats['min_bpm'] = min(stats['min_bpm'], bpm)
+                stats['max_bpm'] = max(stats['max_bpm'], bpm)
+                
+                # Promedio móvil del buffer, con la suma mantenida al entrar y salir lecturas
+                if len(buffer) == buffer.maxlen:
+                    stats['buffer_bpm_sum'] -= buffer[0]['bpm']
+                buffer.append(data)
+                stats['buffer_bpm_sum'] += bpm
             
-            # Calcular promedio móvil
-            buffer = self.device_buffers[device_id]
             if buffer:
-                stats['avg_bpm'] = sum(d.get('bpm', 0) for d in buffer) / len(buffer)
+                stats['avg_bpm'] = stats['buffer_bpm_sum'] / len(buffer)
+            if valid:
+                stats['last_seen'] = self.clock()
+    
+    def _device_entry(self, device_id: str) -> dict:
+        """
+        Retorna las estadísticas del dispositivo, creándolas (con su buffer y su
+        detector) si no existen (con el bloqueo tomado). Con más de max_devices
+        se olvida el dispositivo que lleva más tiempo sin lecturas.
+        """
+        stats = self.device_stats.get(device_id)
+        if stats is not None:
+            self.device_stats.move_to_end(device_id)
+            return stats
+        
+        if len(self.device_stats) >= self.max_devices:
+            oldest, _ = self.device_stats.popitem(last=False)
+            del self.device_buffers[oldest]
+            del self.detectors[oldest]
+        
+        self.device_buffers[device_id] = deque(maxlen=100)
+        self.detectors[device_id] = AnomalyDetector()
+        stats = self.device_stats[device_id] = {
+            'total_received': 0,
+            'total_sent_to_cloud': 0,
+            'last_sent_time': 0,
+            'avg_bpm': 0,
+            'min_bpm': float('inf'),
+            'max_bpm': 0,
+            'buffer_bpm_sum': 0,
+            'anomalies': {},
+            'risk_memory': 0.0,
+            'risk_time': None,
+            'last_seen': None,
+            'aggregation_window': self.min_window
+        }
+        return stats
+    
+    def _add_risk(self, stats: dict, score: float, now: float):
+        """Riesgo reciente: suma de riesgos con decaimiento exponencial (con el bloqueo tomado)."""
+        if stats['risk_time'] is not None and now > stats['risk_time']:
+            stats['risk_memory'] *= 0.5 ** ((now - stats['risk_time']) / ADAPTIVE_RISK_HALF_LIFE)
+        stats['risk_memory'] += score
+        stats['risk_time'] = now
+    
+    def sweep_dropouts(self) -> list:
+        """
+        Marca la pérdida de señal de los dispositivos que llevan más de
+        ANOMALY_DROPOUT_SECONDS sin lecturas, sin esperar a que llegue la
+        siguiente, y solo una vez por silencio. El silencio se mide con el reloj
+        del procesador desde la llegada de la última lectura válida, así un
+        sensor con la hora desviada no parece siempre en silencio.
+        Retorna, para reenviarlo, un evento por dispositivo: su última lectura
+        con la anomalía 'dropout' (segundos de silencio) y con el instante del
+        barrido como timestamp (en el reloj del sensor), de modo que la nube no
+        lo descarta como duplicado de esa lectura; 'last_timestamp' conserva el
+        de la lectura.
+        """
+        now = self.clock()
+        silent = []
+        with self.lock:
+            for device_id, stats in self.device_stats.items():
+                detector = self.detectors[device_id]
+                if detector.silent or stats['last_seen'] is None:
+                    continue
+                elapsed = now - stats['last_seen']
+                if elapsed <= ANOMALY_DROPOUT_SECONDS:
+                    continue
+                
+                detector.silent = True
+                stats['anomalies']['dropout'] = stats['anomalies'].get('dropout', 0) + 1
+                # En el reloj del sensor, como el resto del riesgo del dispositivo
+                swept_at = detector.last_time + elapsed
+                self._add_risk(stats, ANOMALY_RISK_SCORE, swept_at)
+                reading = dict(self.device_buffers[device_id][-1])
+                reading['last_timestamp'] = reading.get('timestamp')
+                reading['timestamp'] = utc_timestamp(swept_at)
+                reading['fog_timestamp'] = utc_timestamp(time.time())
+                reading['anomalies'] = {'dropout': round(elapsed, 1)}
+                silent.append(reading)
+        return silent
+    
+    def record_throttled(self, device_id: str, summary: dict):
+        """
+        Incorpora el resumen de lecturas rechazadas por el limitador: cuentan
+        como recibidas y se envían agregadas en el siguiente mensaje a la nube.
+        Un dispositivo limitado antes de tener estadísticas se registra aquí.
+        """
+        with self.lock:
+            stats = self._device_entry(device_id)
+            stats['total_received'] += summary['count']
+            stats['total_throttled'] = stats.get('total_throttled', 0) + summary['count']
+            if summary['bpm_count']:
+                stats['min_bpm'] = min(stats['min_bpm'], summary['min_bpm'])
+                stats['max_bpm'] = max(stats['max_bpm'], summary['max_bpm'])
+            
+            pending = stats.get('throttled_pending')
+            if pending is None:
+                stats['throttled_pending'] = dict(summary)
+            else:
+                pending['count'] += summary['count']
+                pending['bpm_count'] += summary['bpm_count']
+                pending['bpm_sum'] += summary['bpm_sum']
+                for key, pick in (('min_bpm', min), ('max_bpm', max)):
+                    values = [v for v in (pending[key], summary[key]) if v is not None]
+                    pending[key] = pick(values) if values else None
+    
+    def aggregation_window(self, device_id: str) -> float:
+        """
+        Intervalo de envío de lecturas normales del dispositivo (con el bloqueo tomado).
+        Va del máximo, con señal estable y sin riesgo reciente, al mínimo, con
+        señal variable o riesgo reciente; hasta tener línea base usa el mínimo.
+        """
+        detector = self.detectors.get(device_id)
+        if detector is None or detector.samples < ANOMALY_BASELINE_MIN_SAMPLES:
+            return self.min_window
+        
+        variability = (detector.variance ** 0.5 - ADAPTIVE_STD_CALM) / (ADAPTIVE_STD_VOLATILE - ADAPTIVE_STD_CALM)
+        risk = self.device_stats[device_id]['risk_memory'] / ADAPTIVE_RISK_REFERENCE
+        activity = min(1.0, max(0.0, variability, risk))
+        
+        # Interpolación geométrica: cada paso de actividad multiplica el intervalo
+        return self.max_window * (self.min_window / self.max_window) ** activity
     
     def should_send_to_cloud(self, data: dict) -> tuple[bool, str]:
         """
@@ -148,18 +544,26 @@ class FogProcessor:
         if risk_level in ['warning_low', 'warning_high']:
             return True, f"Evento de advertencia: {risk_level}"
         
+        # Las anomalías del detector se tratan como advertencias
+        anomalies = data.get('anomalies')
+        if anomalies:
+            return True, f"Anomalía: {', '.join(anomalies)}"
+        
         # Para eventos normales, agregar y enviar periódicamente
         with self.lock:
             stats = self.device_stats.get(device_id, {})
             last_sent = stats.get('last_sent_time', 0)
-            current_time = time.time()
+            current_time = self.clock()
             
-            # Enviar resumen cada AGGREGATION_WINDOW segundos
-            if current_time - last_sent >= AGGREGATION_WINDOW:
+            # Enviar resumen cuando vence el intervalo del dispositivo
+            window = self.aggregation_window(device_id)
+            if device_id in self.device_stats:
+                stats['aggregation_window'] = window
+            if current_time - last_sent >= window:
                 buffer = self.device_buffers.get(device_id, [])
                 if len(buffer) >= MIN_SAMPLES_FOR_AGGREGATION:
                     stats['last_sent_time'] = current_time
-                    return True, f"Agregación periódica ({len(buffer)} muestras)"
+                    return True, f"Agregación periódica ({len(buffer)} muestras, cada {window:.0f} s)"
         
         return False, "Agregando datos normales"
     
@@ -170,6 +574,10 @@ class FogProcessor:
         with self.lock:
             stats = self.device_stats.get(device_id, {})
             stats['total_sent_to_cloud'] = stats.get('total_sent_to_cloud', 0) + 1
+            # Número de secuencia por dispositivo (reinicia con el proceso fog);
+            # permite detectar pérdidas y medir latencias extremo a extremo
+            stats['sequence'] = stats.get('sequence', 0) + 1
+            sequence = stats['sequence']
         
         # Crear mensaje compacto para la nube
         cloud_message = {
@@ -181,13 +589,28 @@ class FogProcessor:
             'risk_score': data.get('risk_score'),
             'fog_processed': True,
             'fog_timestamp': data.get('fog_timestamp'),
+            'sequence': sequence,
             'signal_quality': data.get('signal_quality_normalized'),
         }
+        if data.get('anomalies'):
+            cloud_message['anomalies'] = data['anomalies']
+        if data.get('last_timestamp'):
+            # Pérdida de señal: timestamp de la última lectura antes del silencio
+            cloud_message['last_timestamp'] = data['last_timestamp']
         
         # Añadir estadísticas agregadas si están disponibles
         with self.lock:
             if device_id in self.device_stats:
                 s = self.device_stats[device_id]
+                throttled = s.pop('throttled_pending', None)
+                if throttled:
+                    cloud_message['throttled'] = {
+                        'count': throttled['count'],
+                        'avg_bpm': round(throttled['bpm_sum'] / throttled['bpm_count'], 1)
+                                   if throttled['bpm_count'] else None,
+                        'min_bpm': throttled['min_bpm'],
+                        'max_bpm': throttled['max_bpm']
+                    }
                 cloud_message['aggregated_stats'] = {
                     'avg_bpm': round(s.get('avg_bpm', 0), 1),
                     'min_bpm': s.get('min_bpm') if s.get('min_bpm') != float('inf') else None,
@@ -205,7 +628,10 @@ class FogProcessor:
                     'received': stats.get('total_received', 0),
                     'sent_to_cloud': stats.get('total_sent_to_cloud', 0),
                     'filtered': stats.get('total_received', 0) - stats.get('total_sent_to_cloud', 0),
-                    'avg_bpm': round(stats.get('avg_bpm', 0), 1)
+                    'avg_bpm': round(stats.get('avg_bpm', 0), 1),
+                    'aggregation_window': round(stats.get('aggregation_window', self.min_window), 1),
+                    'throttled': stats.get('total_throttled', 0),
+                    'anomalies': dict(stats.get('anomalies', {}))
                 }
                 for device_id, stats in self.device_stats.items()
             }
@@ -220,12 +646,14 @@ class CloudConnector:
         self.key = key
         self.root_ca = root_ca
         self.thing_name = thing_name
-        self.connection: Optional[mqtt.Connection] = None
+        self.connection: Optional["mqtt.Connection"] = None
         self.connected = False
     
     def connect(self) -> bool:
         """Establece conexión con AWS IoT Core."""
         try:
+            from awsiot import mqtt_connection_builder
+            
             print("Conectando a AWS IoT Core...")
             
             self.connection = mqtt_connection_builder.mtls_from_path(
@@ -266,6 +694,8 @@ class CloudConnector:
             return False
         
         try:
+            from awscrt import mqtt
+            
             topic = f"bpm/{user_id}/{device_id}/measurements"
             self.connection.publish(
                 topic=topic,
@@ -292,18 +722,24 @@ class CloudConnector:
 class FogServer:
     """Servidor Fog que recibe datos de dispositivos IoT."""
     
-    def __init__(self, port: int, processor: FogProcessor, cloud: Optional[CloudConnector]):
+    def __init__(self, port: int, processor: FogProcessor, cloud: Optional[CloudConnector],
+                 record_path: Optional[str] = None, guard: Optional[FloodGuard] = None):
         self.port = port
         self.processor = processor
         self.cloud = cloud
+        self.guard = guard or FloodGuard()
         self.running = False
         self.server_socket = None
         self.clients = []
+        # Grabación del tráfico recibido (una línea por mensaje) para reproducirlo
+        self.record_file = open(record_path, 'a', encoding='utf-8') if record_path else None
+        self.record_lock = threading.Lock()
     
     def handle_client(self, client_socket: socket.socket, address: tuple):
         """Maneja la conexión de un cliente IoT."""
         print(f"Dispositivo conectado: {address}")
         buffer = ""
+        connection = self.guard.connection_bucket()
         
         try:
             while self.running:
@@ -311,13 +747,19 @@ class FogServer:
                 if not data:
                     break
                 
-                buffer += data.decode('utf-8')
+                buffer += data.decode('utf-8', errors='replace')
+                
+                # Procesar juntas las líneas completas recibidas
+                if '\n' in buffer:
+                    *lines, buffer = buffer.split('\n')
+                    lines = [line.strip() for line in lines if line.strip()]
+                    self.record(lines)
+                    # Límites por conexión y por dispositivo antes de parsear
+                    self.process_messages([line for line in lines if self.guard.admit(line, connection)])
                 
-                # Procesar líneas completas
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    if line.strip():
-                        self.process_message(line.strip())
+                if len(buffer) > MAX_LINE_BYTES:
+                    print(f"Línea demasiado larga de {address}, descartada")
+                    buffer = ""
                         
         except ConnectionResetError:
             pass
@@ -329,41 +771,90 @@ class FogServer:
             if client_socket in self.clients:
                 self.clients.remove(client_socket)
     
+    def record(self, lines: list):
+        """Graba las líneas recibidas, si la grabación está activa."""
+        if self.record_file and lines:
+            with self.record_lock:
+                self.record_file.write(''.join(f"{line}\n" for line in lines))
+                self.record_file.flush()
+    
     def process_message(self, raw_message: str):
         """Procesa un mensaje recibido del dispositivo IoT."""
-        try:
-            data = json.loads(raw_message)
-            device_id = data.get('device_id', 'unknown')
-            bpm = data.get('bpm', 0)
-            
-            # 1. Preprocesar
-            processed = self.processor.preprocess(data)
-            
-            # 2. Actualizar estadísticas
-            self.processor.update_device_stats(device_id, processed)
-            
-            # 3. Decidir si enviar a la nube
-            should_send, reason = self.processor.should_send_to_cloud(processed)
-            
-            # 4. Mostrar estado
-            status_icon = self._get_status_icon(processed.get('risk_level', 'normal'))
-            cloud_icon = " - " if should_send else " + "
-            
-            print(f"  {status_icon} BPM: {bpm:3d} | {cloud_icon} {reason}")
-            
-            # 5. Enviar a la nube si corresponde
-            if should_send and self.cloud and self.cloud.connected:
-                cloud_message = self.processor.create_cloud_message(processed)
-                user_id = data.get('user_id', 'unknown')
-                if self.cloud.publish(user_id, device_id, cloud_message):
-                    print(f"     Enviado a la nube")
-                else:
-                    print(f"     Error enviando a la nube")
-                    
-        except json.JSONDecodeError as e:
-            print(f"Mensaje inválido: {e}")
-        except Exception as e:
-            print(f"Error procesando mensaje: {e}")
+        self.process_messages([raw_message])
+    
+    def process_messages(self, raw_messages: list):
+        """
+        Procesa los mensajes recibidos de una vez: las lecturas de cada
+        dispositivo se actualizan y analizan en lote.
+        """
+        batch = []
+        for raw_message in raw_messages:
+            try:
+                data = json.loads(raw_message)
+                # 1. Preprocesar
+                batch.append((data, self.processor.preprocess(data)))
+            except json.JSONDecodeError as e:
+                print(f"Mensaje inválido: {e}")
+            except Exception as e:
+                print(f"Error procesando mensaje: {e}")
+        
+        # 2. Actualizar estadísticas y detectar anomalías por dispositivo
+        by_device = {}
+        for data, processed in batch:
+            by_device.setdefault(data.get('device_id', 'unknown'), []).append(processed)
+        for device_id, readings in by_device.items():
+            try:
+                self.processor.update_device_stats_batch(device_id, readings)
+            except Exception as e:
+                print(f"Error procesando mensajes de {device_id}: {e}")
+        
+        # Lecturas rechazadas por el limitador desde el último lote
+        for device_id, summary in self.guard.take_summaries().items():
+            print(f"  LIMITADO {device_id}: {summary['count']} lecturas resumidas")
+            self.processor.record_throttled(device_id, summary)
+        
+        for data, processed in batch:
+            try:
+                self.forward_message(data, processed)
+            except Exception as e:
+                print(f"Error procesando mensaje: {e}")
+    
+    def sweep_dropouts(self):
+        """
+        Barrido periódico: reenvía la pérdida de señal de los dispositivos en
+        silencio, que no enviarán la lectura que la pondría de manifiesto.
+        """
+        while self.running:
+            time.sleep(ANOMALY_DROPOUT_SWEEP_SECONDS)
+            try:
+                for reading in self.processor.sweep_dropouts():
+                    print(f"  SIN SEÑAL {reading['device_id']}: {reading['anomalies']['dropout']} s sin lecturas")
+                    self.forward_message(reading, reading)
+            except Exception as e:
+                print(f"Error en el barrido de pérdida de señal: {e}")
+    
+    def forward_message(self, data: dict, processed: dict):
+        """Decide, muestra y envía a la nube un mensaje ya procesado."""
+        device_id = data.get('device_id', 'unknown')
+        bpm = data.get('bpm', 0)
+        
+        # 3. Decidir si enviar a la nube
+        should_send, reason = self.processor.should_send_to_cloud(processed)
+        
+        # 4. Mostrar estado
+        status_icon = self._get_status_icon(processed.get('risk_level', 'normal'))
+        cloud_icon = " - " if should_send else " + "
+        
+        print(f"  {status_icon} BPM: {bpm:3d} | {cloud_icon} {reason}")
+        
+        # 5. Enviar a la nube si corresponde
+        if should_send and self.cloud and self.cloud.connected:
+            cloud_message = self.processor.create_cloud_message(processed)
+            user_id = data.get('user_id', 'unknown')
+            if self.cloud.publish(user_id, device_id, cloud_message):
+                print(f"     Enviado a la nube")
+            else:
+                print(f"     Error enviando a la nube")
     
     def _get_status_icon(self, risk_level: str) -> str:
         """Retorna el icono según el nivel de riesgo."""
@@ -388,6 +879,8 @@ class FogServer:
         print(f"\n Fog Server escuchando en puerto {self.port}...")
         print("Esperando dispositivos IoT...\n")
         
+        threading.Thread(target=self.sweep_dropouts, daemon=True).start()
+        
         try:
             while self.running:
                 try:
@@ -420,6 +913,18 @@ class FogServer:
             print(f"      Enviados a nube: {device_stats['sent_to_cloud']}")
             print(f"      Filtrados: {device_stats['filtered']}")
             print(f"      BPM promedio: {device_stats['avg_bpm']}")
+            print(f"      Intervalo de agregación: {device_stats['aggregation_window']} s")
+            if device_stats['throttled']:
+                print(f"      Limitados: {device_stats['throttled']}")
+            if device_stats['anomalies']:
+                print(f"      Anomalías: {device_stats['anomalies']}")
+        
+        throttled = self.guard.get_counters()
+        if throttled:
+            print("\nDispositivos limitados:")
+            for device_id, counters in throttled.items():
+                print(f"      {device_id}: {counters['throttled']} limitados, "
+                      f"{counters['admitted']} admitidos, {counters['critical_bypassed']} críticos sin límite")
         
         # Cerrar clientes
         for client in self.clients:
@@ -432,6 +937,9 @@ class FogServer:
         if self.server_socket:
             self.server_socket.close()
         
+        if self.record_file:
+            self.record_file.close()
+        
         # Desconectar de la nube
         if self.cloud:
             self.cloud.disconnect()
@@ -457,6 +965,16 @@ def main():
                         help='Enviar todos los mensajes a la nube (sin filtrar)')
     parser.add_argument('--critical-only', action='store_true',
                         help='Enviar solo eventos críticos a la nube')
+    parser.add_argument('--min-window', type=float, default=AGGREGATION_WINDOW_MIN,
+                        help='Intervalo mínimo (s) de envío de lecturas normales, para señales variables')
+    parser.add_argument('--max-window', type=float, default=AGGREGATION_WINDOW_MAX,
+                        help='Intervalo máximo (s) de envío de lecturas normales, para señales estables')
+    parser.add_argument('--device-rate', type=float, default=DEVICE_RATE_LIMIT,
+                        help='Mensajes por segundo admitidos por dispositivo (los críticos no se limitan)')
+    parser.add_argument('--connection-rate', type=float, default=CONNECTION_RATE_LIMIT,
+                        help='Mensajes por segundo admitidos por conexión')
+    parser.add_argument('--record',
+                        help='Grabar los mensajes recibidos en este fichero (JSON por línea)')
     
     args = parser.parse_args()
     
@@ -471,13 +989,16 @@ def main():
     elif args.critical_only:
         print("Solo críticos")
     else:
-        print("Inteligente (críticos + advertencias + agregación)")
+        print("Inteligente (críticos + advertencias + anomalías + agregación)")
+        print(f"Intervalo de agregación: {args.min_window:g}-{args.max_window:g} s según la variabilidad")
     print("=" * 60)
     
     # Crear procesador
     processor = FogProcessor(
         send_all=args.send_all,
-        critical_only=args.critical_only
+        critical_only=args.critical_only,
+        min_window=args.min_window,
+        max_window=args.max_window
     )
     
     # Crear conector de nube (opcional)
@@ -495,7 +1016,8 @@ def main():
             cloud = None
     
     # Crear y ejecutar servidor
-    server = FogServer(args.port, processor, cloud)
+    guard = FloodGuard(device_rate=args.device_rate, connection_rate=args.connection_rate)
+    server = FogServer(args.port, processor, cloud, record_path=args.record, guard=guard)
     server.start()
 
 
@@ -0,0 +1,11 @@
+"""
+Shared test setup: the Lambda sources and the fog server are plain modules,
+imported the way the Lambda runtime and the fog process import them.
+"""
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'cloud', 'infrastructure', 'modules', 'lambda', 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'fog'))
@@ -0,0 +1,205 @@
+"""Tests of the S3 archive compaction and range queries against moto."""
+
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import archive_compactor
+import archive_query
+from archive_compactor import compact_archive, compact_recent, compacted_keys, load_index
+
+BUCKET = 'bpm-archive'
+DAY_PREFIX = 'u1/d1/2025/01/01/'
+NOW = datetime(2025, 1, 2, 6, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name, value in (('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                        ('AWS_DEFAULT_REGION', 'us-east-1')):
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def archive(s3, timestamp: datetime, bpm: int = 70, user_id: str = 'u1', device_id: str = 'd1'):
+    """Archive one reading the way bpm_processor.archive_to_s3 does."""
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=f"{user_id}/{device_id}/{timestamp:%Y/%m/%d}/{timestamp:%H%M%S%f}.json",
+        Body=json.dumps({
+            'user_id': user_id,
+            'device_id': device_id,
+            'timestamp': timestamp.isoformat().replace('+00:00', 'Z'),
+            'bpm': bpm
+        })
+    )
+
+
+def at(hour: int, minute: int, second: int = 0) -> datetime:
+    return datetime(2025, 1, 1, hour, minute, second, tzinfo=timezone.utc)
+
+
+def compacted(s3, day_prefix: str = DAY_PREFIX) -> tuple:
+    data_key, index_key = compacted_keys(day_prefix)
+    data = s3.get_object(Bucket=BUCKET, Key=data_key)['Body'].read()
+    return data, load_index(s3, BUCKET, index_key)
+
+
+def timestamps(records) -> list:
+    return [record['timestamp'] for record in records]
+
+
+def test_compaction_writes_minute_members_and_offsets(s3):
+    for second in range(0, 180, 20):
+        archive(s3, at(10, 0) + timedelta(seconds=second), bpm=60 + second // 20)
+
+    assert compact_archive(s3, BUCKET, now=NOW)['compacted'] == 1
+    data, index = compacted(s3)
+    assert index['count'] == 9
+    assert [m['minute'] for m in index['minutes']] == ['10:00', '10:01', '10:02']
+    assert index['size'] == len(data)
+
+    # Every minute is a gzip member that decompresses on its own
+    for minute in index['minutes']:
+        member = data[minute['offset']:minute['offset'] + minute['length']]
+        lines = gzip.decompress(member).decode().splitlines()
+        assert len(lines) == minute['count']
+        assert all(json.loads(line)['timestamp'][11:16] == minute['minute'] for line in lines)
+
+
+def test_compacting_twice_gives_the_same_output(s3):
+    for second in range(0, 600, 7):
+        archive(s3, at(8, 0) + timedelta(seconds=second))
+    archive(s3, at(8, 0))  # A retry archived twice under the same key
+
+    assert compact_archive(s3, BUCKET, now=NOW)['compacted'] == 1
+    first, first_index = compacted(s3)
+    assert compact_archive(s3, BUCKET, now=NOW) == {
+        'compacted': 0, 'skipped': 1, 'pending': 0, 'errors': 0, 'stopped': False
+    }
+    second, second_index = compacted(s3)
+    assert second == first
+    assert second_index['minutes'] == first_index['minutes']
+
+    # Recompacting the same readings without the skip is byte-identical too
+    first_index['sources_fingerprint'] = 'changed'
+    s3.put_object(Bucket=BUCKET, Key=compacted_keys(DAY_PREFIX)[1], Body=json.dumps(first_index))
+    assert compact_archive(s3, BUCKET, now=NOW)['compacted'] == 1
+    third, third_index = compacted(s3)
+    assert third == first
+    assert third_index['count'] == first_index['count']
+
+
+@pytest.mark.parametrize('delete_sources', [False, True])
+def test_late_arrival_is_merged_after_compaction(s3, delete_sources):
+    for minute in (0, 1, 3):
+        archive(s3, at(12, minute))
+    compact_archive(s3, BUCKET, now=NOW, delete_sources=delete_sources)
+
+    archive(s3, at(12, 2), bpm=99)
+    assert compact_archive(s3, BUCKET, now=NOW, delete_sources=delete_sources)['compacted'] == 1
+    _, index = compacted(s3)
+    assert index['count'] == 4
+    assert [m['minute'] for m in index['minutes']] == ['12:00', '12:01', '12:02', '12:03']
+
+    records = list(archive_compactor.read_compacted_range(s3, BUCKET, DAY_PREFIX, at(12, 2), at(12, 2)))
+    assert [(r['timestamp'], r['bpm']) for r in records] == [('2025-01-01T12:02:00Z', 99)]
+
+
+def test_ranged_read_fetches_only_the_selected_minutes(s3, monkeypatch):
+    for minute in range(10):
+        archive(s3, at(6, minute))
+    compact_archive(s3, BUCKET, now=NOW)
+    _, index = compacted(s3)
+
+    ranges = []
+    get_object = s3.get_object
+
+    def recording_get_object(**kwargs):
+        ranges.append(kwargs.get('Range'))
+        return get_object(**kwargs)
+
+    monkeypatch.setattr(s3, 'get_object', recording_get_object)
+    records = list(archive_compactor.read_compacted_range(
+        s3, BUCKET, DAY_PREFIX, at(6, 3), at(6, 5, 59), index=index
+    ))
+    assert timestamps(records) == [f"2025-01-01T06:0{m}:00Z" for m in (3, 4, 5)]
+    first, last = index['minutes'][3], index['minutes'][5]
+    assert ranges == [f"bytes={first['offset']}-{last['offset'] + last['length'] - 1}"]
+
+
+@pytest.mark.parametrize('delete_sources', [False, True])
+def test_range_spans_compacted_and_raw_readings(s3, delete_sources):
+    for minute in (0, 10, 20):
+        archive(s3, at(9, minute))
+    compact_archive(s3, BUCKET, now=NOW, delete_sources=delete_sources)
+    # Not compacted yet: one after and one between the compacted readings
+    archive(s3, at(9, 30))
+    archive(s3, at(9, 15))
+
+    records = list(archive_query.iter_device_day(s3, BUCKET, DAY_PREFIX, at(9, 5), at(9, 45)))
+    expected = [at(9, m).isoformat().replace('+00:00', 'Z') for m in (10, 15, 20, 30)]
+    if not delete_sources:
+        # With the sources kept, only readings after the compacted ones are read raw
+        expected.remove('2025-01-01T09:15:00Z')
+    assert timestamps(records) == expected
+
+
+def test_archive_range_merges_devices_across_days(s3):
+    archive(s3, at(23, 59), device_id='d1')
+    archive(s3, at(23, 58), device_id='d2')
+    archive(s3, datetime(2025, 1, 2, 0, 1, tzinfo=timezone.utc), device_id='d2')
+    compact_archive(s3, BUCKET, now=NOW + timedelta(days=1), prefix='u1/d1/')
+
+    records = list(archive_query.iter_archive_range(
+        s3, BUCKET, 'u1', at(0, 0), datetime(2025, 1, 2, 23, tzinfo=timezone.utc)
+    ))
+    assert [(r['device_id'], r['timestamp']) for r in records] == [
+        ('d2', '2025-01-01T23:58:00Z'),
+        ('d1', '2025-01-01T23:59:00Z'),
+        ('d2', '2025-01-02T00:01:00Z')
+    ]
+    stats = archive_query.archive_statistics(
+        s3, BUCKET, 'u1', at(0, 0), datetime(2025, 1, 2, 23, tzinfo=timezone.utc)
+    )
+    assert stats['statistics']['count'] == 3
+    assert stats['partitions'] == 4
+
+
+def test_recent_run_only_lists_the_late_window(s3, monkeypatch):
+    monkeypatch.setattr(archive_compactor, 'LATE_DAYS', 2)
+    old = datetime(2024, 12, 1, 10, tzinfo=timezone.utc)
+    archive(s3, old)
+    archive(s3, at(10, 0))
+    s3.put_object(Bucket=BUCKET, Key='exports/u1/e1/part-0.ndjson', Body=b'{}')
+
+    summary = compact_recent(s3, BUCKET, now=NOW)
+    assert (summary['compacted'], summary['completed_through']) == (1, '2025-01-01')
+    assert load_index(s3, BUCKET, compacted_keys('u1/d1/2024/12/01/')[1]) is None
+
+    # The old day is only compacted by a full run
+    assert compact_archive(s3, BUCKET, now=NOW)['compacted'] == 1
+    assert compact_recent(s3, BUCKET, now=NOW)['skipped'] == 1
+
+
+def test_run_out_of_time_writes_nothing_and_resumes(s3):
+    for minute in range(3):
+        archive(s3, at(7, minute))
+    archive(s3, datetime(2024, 12, 31, 7, tzinfo=timezone.utc))
+
+    summary = compact_archive(s3, BUCKET, now=NOW, time_left=lambda: 0)
+    assert summary['stopped'] and summary['resume_after'] is None
+    assert load_index(s3, BUCKET, compacted_keys(DAY_PREFIX)[1]) is None
+
+    summary = compact_recent(s3, BUCKET, now=NOW, time_left=lambda: 0)
+    assert summary['stopped'] and summary['completed_through'] is None
+    summary = compact_recent(s3, BUCKET, now=NOW)
+    assert summary['completed_through'] == '2025-01-01'
+    assert load_index(s3, BUCKET, compacted_keys(DAY_PREFIX)[1])['count'] == 3
@@ -0,0 +1,50 @@
+"""Tests of the gzip negotiation of API responses."""
+
+import base64
+import gzip
+import json
+
+import pytest
+
+from api_handler import GZIP_MIN_BYTES, accepts_gzip, compress_response, create_response
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip', True),
+    ('br, gzip;q=0.8', True),
+    ('*', True),
+    ('gzip;q=0', False),
+    ('gzip; q=0.0', False),
+    ('identity', False),
+    ('', False),
+    (None, False),
+    ('gzip;q=abc', False),
+    ('gzip;q=', False),
+    ('gzip;q=nan', False),
+    ('gzip;q=2', False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) is expected
+
+
+def test_malformed_q_value_returns_the_uncompressed_response():
+    response = create_response(200, {'values': ['x' * GZIP_MIN_BYTES]})
+    compressed = compress_response(dict(response), 'gzip;q=abc')
+    assert compressed == response
+
+
+def test_large_body_is_gzipped():
+    response = create_response(200, {'values': ['x' * GZIP_MIN_BYTES]})
+    compressed = compress_response(dict(response), 'gzip')
+    assert compressed['isBase64Encoded']
+    assert json.loads(gzip.decompress(base64.b64decode(compressed['body']))) == json.loads(response['body'])
+
+
+def test_malformed_header_does_not_fail_the_handler(monkeypatch):
+    import api_handler
+
+    monkeypatch.setattr(api_handler, 'GZIP_MIN_BYTES', 0)
+    event = {'httpMethod': 'GET', 'path': '/health', 'headers': {'Accept-Encoding': 'gzip;q=abc'}}
+    response = api_handler.lambda_handler(event, None)
+    assert response['statusCode'] == 401
+    assert 'Content-Encoding' not in response['headers']
@@ -0,0 +1,67 @@
+"""Tests of the fog dropout sweep and its delivery to the cloud ingest."""
+
+import bpm_processor
+import fog_server
+from fog_server import ANOMALY_DROPOUT_SECONDS, FogProcessor
+
+
+def feed(processor: FogProcessor, clock: list, seconds: int, bpm: int = 70) -> dict:
+    """Feed one reading of device d1, sensor and fog clocks in step."""
+    clock[0] = 1735689600.0 + seconds
+    data = {
+        'user_id': 'u1',
+        'device_id': 'd1',
+        'timestamp': fog_server.utc_timestamp(clock[0]),
+        'bpm': bpm
+    }
+    processed = processor.preprocess(data)
+    processor.update_device_stats('d1', processed)
+    return processed
+
+
+def make_processor():
+    clock = [0.0]
+    return FogProcessor(clock=lambda: clock[0]), clock
+
+
+def test_silent_device_is_flagged_once_while_silent():
+    processor, clock = make_processor()
+    for second in range(5):
+        feed(processor, clock, second)
+
+    clock[0] += ANOMALY_DROPOUT_SECONDS
+    assert processor.sweep_dropouts() == []
+    clock[0] += 1
+    events = processor.sweep_dropouts()
+    assert [event['anomalies'] for event in events] == [{'dropout': ANOMALY_DROPOUT_SECONDS + 1}]
+    assert processor.should_send_to_cloud(events[0])[0]
+    clock[0] += 30
+    assert processor.sweep_dropouts() == []
+
+    # The reading that ends the silence does not report it again
+    returning = feed(processor, clock, 60)
+    assert 'dropout' not in returning.get('anomalies', {})
+    assert processor.get_stats_summary()['d1']['anomalies'] == {'dropout': 1}
+
+
+def test_swept_dropout_survives_cloud_deduplication():
+    processor, clock = make_processor()
+    for second in range(5):
+        last = feed(processor, clock, second)
+    clock[0] += ANOMALY_DROPOUT_SECONDS + 1
+    event, = processor.sweep_dropouts()
+
+    reading_message = processor.create_cloud_message(last)
+    dropout_message = processor.create_cloud_message(event)
+    assert dropout_message['timestamp'] > reading_message['timestamp']
+    assert dropout_message['last_timestamp'] == reading_message['timestamp']
+    assert bpm_processor.validate_payload(dropout_message) == (True, None)
+
+    fresh, duplicates = bpm_processor.drop_duplicates([reading_message, dropout_message])
+    assert duplicates == 0
+    assert fresh[1]['anomalies'] == {'dropout': ANOMALY_DROPOUT_SECONDS + 1}
+
+    # Also once the reading itself is already stored
+    bpm_processor.remember_stored([reading_message])
+    fresh, duplicates = bpm_processor.drop_duplicates([dropout_message])
+    assert (len(fresh), duplicates) == (1, 0)
@@ -0,0 +1,100 @@
+"""Tests of history paging over the device-index GSI against moto."""
+
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import api_handler
+import aws_clients
+
+TABLE = 'bpm-measurements'
+
+
+@pytest.fixture
+def table(monkeypatch):
+    for name, value in (('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                        ('AWS_DEFAULT_REGION', 'us-east-1')):
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(api_handler, 'DYNAMODB_TABLE_NAME', TABLE)
+    monkeypatch.setattr(aws_clients, '_clients', {})
+    monkeypatch.setattr(aws_clients, '_tables', {})
+    with mock_aws():
+        attribute = lambda name: {'AttributeName': name, 'AttributeType': 'S'}
+        boto3.client('dynamodb').create_table(
+            TableName=TABLE,
+            KeySchema=[{'AttributeName': 'user_id', 'KeyType': 'HASH'},
+                       {'AttributeName': 'timestamp_device', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[attribute('user_id'), attribute('timestamp_device'), attribute('device_id')],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'device-index',
+                'KeySchema': [{'AttributeName': 'device_id', 'KeyType': 'HASH'},
+                              {'AttributeName': 'timestamp_device', 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            }],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        yield boto3.resource('dynamodb').Table(TABLE)
+
+
+def store(table, user_id: str, device_id: str, timestamp: datetime):
+    """Store one reading the way bpm_processor.store_in_dynamodb does."""
+    iso = timestamp.isoformat().replace('+00:00', 'Z')
+    table.put_item(Item={
+        'user_id': user_id,
+        'timestamp_device': f"{iso}#{device_id}",
+        'device_id': device_id,
+        'timestamp': iso,
+        'measurement_date': iso[:10],
+        'bpm': Decimal(70),
+        'status': 'normal',
+        'severity': 'normal'
+    })
+
+
+def fill(table):
+    """u1's readings on a device id that u2's newer readings also use."""
+    start = datetime.now(timezone.utc) - timedelta(hours=2)
+    for second in range(6):
+        store(table, 'u1', 'shared', start + timedelta(seconds=second))
+    for second in range(30):
+        store(table, 'u2', 'shared', start + timedelta(minutes=10, seconds=second))
+
+
+def all_pages(user_id: str, device_id: str, limit: int) -> list:
+    pages, cursor = [], None
+    while True:
+        page = api_handler.get_bpm_history(user_id, device_id=device_id, limit=limit, cursor=cursor)
+        assert page['success']
+        pages.append(page['count'])
+        cursor = page['next_cursor']
+        if not cursor:
+            return pages
+
+
+def test_device_pages_are_filled_past_other_users_items(table):
+    fill(table)
+    assert all_pages('u1', 'shared', 5) == [5, 1]
+    assert all_pages('u2', 'shared', 25) == [25, 5]
+
+
+def test_filtered_reads_per_page_are_bounded(table, monkeypatch):
+    fill(table)
+    monkeypatch.setattr(api_handler, 'HISTORY_MAX_QUERIES_PER_PAGE', 2)
+
+    # The first page stops among u2's items; its cursor still resumes u1's
+    # history, and no reading is lost or repeated
+    pages = all_pages('u1', 'shared', 5)
+    assert pages[0] == 0
+    assert sum(pages) == 6
+
+
+def test_cursor_does_not_expose_other_users_keys(table, monkeypatch):
+    fill(table)
+    monkeypatch.setattr(api_handler, 'HISTORY_MAX_QUERIES_PER_PAGE', 1)
+    page = api_handler.get_bpm_history('u1', device_id='shared', limit=5)
+    assert page['count'] == 0
+    assert api_handler.decode_cursor(page['next_cursor'], 'u1')['user_id'] == 'u1'
+    assert 'u2' not in str(api_handler.decode_cursor(page['next_cursor'], 'u1'))
@@ -0,0 +1,67 @@
+"""Tests of the API response cache and its shared backend stand-in."""
+
+import pytest
+
+import api_handler
+from api_handler import InMemoryCacheBackend, ResponseCache, make_cache_backend
+
+
+def counting_loader(value: dict):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return dict(value, success=True)
+
+    return loader, calls
+
+
+def test_shared_backend_serves_other_containers():
+    backend = InMemoryCacheBackend()
+    first, second = ResponseCache(8, backend=backend), ResponseCache(8, backend=backend)
+    key = ResponseCache.make_key('/devices', 'u1')
+    loader, calls = counting_loader({'count': 2})
+
+    assert first.get_or_load(key, 60, loader)[1] == 'MISS'
+    value, status = second.get_or_load(key, 60, loader)
+    assert status == 'SHARED'
+    assert value['count'] == 2
+    assert len(calls) == 1
+
+
+def test_invalidate_evicts_local_and_shared_entries():
+    backend = InMemoryCacheBackend()
+    cache = ResponseCache(8, backend=backend)
+    devices = ResponseCache.make_key('/devices', 'u1')
+    current = ResponseCache.make_key('/bpm/current', 'u1')
+    other = ResponseCache.make_key('/devices', 'u2')
+    loader, calls = counting_loader({'count': 1})
+    for key in (devices, current, other):
+        cache.get_or_load(key, 60, loader)
+
+    cache.invalidate('u1', '/devices')
+    assert backend.get(devices) is None
+    assert backend.get(current) is not None
+    assert cache.get_or_load(devices, 60, loader)[1] == 'MISS'
+
+    cache.invalidate('u1')
+    assert backend.get(current) is None
+    assert backend.get(other) is not None
+    assert len(calls) == 4
+
+
+def test_shared_entries_expire_with_their_ttl(monkeypatch):
+    backend = InMemoryCacheBackend()
+    now = [1000.0]
+    monkeypatch.setattr(api_handler.time, 'time', lambda: now[0])
+    backend.set('k', {'success': True}, 5)
+    assert backend.get('k') == {'success': True}
+    now[0] += 5
+    assert backend.get('k') is None
+
+
+def test_backend_is_selected_by_name():
+    assert make_cache_backend('') is None
+    assert isinstance(make_cache_backend('memory'), InMemoryCacheBackend)
+    with pytest.raises(ValueError):
+        make_cache_backend('redis')